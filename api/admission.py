@@ -0,0 +1,248 @@
+"""
+Admission control: per-route and per-client rate limits, and a cap on
+requests in flight.
+
+AdmissionMiddleware resolves the route itself and decides before the
+session, auth or any view code runs, so a shed request never touches the
+database.
+
+Rate limits are token buckets configured in API_RATE_LIMITS as
+(requests per second, burst) per route name, for each client ('client') and
+for all clients together ('route'); '*' applies to unlisted routes. Buckets
+are kept in the API_RATE_LIMIT_CACHE_ALIAS cache as a single timestamp (the
+GCRA form of a token bucket), so a shared cache such as Redis enforces one
+budget across every process. The read-modify-write is only atomic within a
+process: with a shared cache, concurrent requests from one client in
+different processes can overshoot a budget slightly. Over budget is a 429
+with the seconds until a token frees up in Retry-After.
+
+API_MAX_CONCURRENT_REQUESTS caps the requests each process handles at once.
+A request waits up to API_CONCURRENCY_WAIT seconds for a slot and is
+otherwise shed with a 503 and Retry-After. The slot is released when the
+view returns, so the body of a streaming response is not counted.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+_bucket_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'API_RATE_LIMIT_CACHE_ALIAS', 'default')]
+
+
+def _record(route, reason):
+    with _stats_lock:
+        _stats[(route, reason)] += 1
+
+
+def get_stats():
+    """Returns a {(route, reason): count} snapshot of requests shed by this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def get_client(request):
+    """The client IP, from API_CLIENT_IP_HEADER behind a proxy that sets it."""
+    header = getattr(settings, 'API_CLIENT_IP_HEADER', None)
+    if header and request.META.get(header):
+        # Each proxy appends the address it was connected from, so the entry
+        # API_TRUSTED_PROXY_COUNT from the right is the one our outermost proxy
+        # saw. Anything left of it came from the client and can be made up.
+        addresses = request.META[header].split(',')
+        count = max(1, getattr(settings, 'API_TRUSTED_PROXY_COUNT', 1))
+        return addresses[max(0, len(addresses) - count)].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def get_limits(route):
+    limits = getattr(settings, 'API_RATE_LIMITS', {})
+    return limits.get(route, limits.get('*', {}))
+
+
+def take(buckets):
+    """
+    Takes a token from each bucket in `buckets`, a list of (key, rate, burst)
+    for buckets that refill at `rate` tokens per second and hold at most
+    `burst`. Tokens are taken from all of them or from none. Returns 0 if
+    they were taken, or else the seconds until every bucket has one.
+
+    A bucket is stored as the time it will be full again; it has a token
+    to spare while that is less than `burst` intervals away.
+    """
+    cache = get_cache()
+    with _bucket_lock:
+        now = time.time()
+        stored = cache.get_many([key for key, _, _ in buckets])
+        wait = 0
+        full_at = {}
+        for key, rate, burst in buckets:
+            interval = 1.0 / rate
+            full_at[key] = max(stored.get(key, now), now) + interval
+            wait = max(wait, full_at[key] - now - burst * interval)
+        if wait > 0:
+            return wait
+        for key, value in full_at.items():
+            cache.set(key, value, math.ceil(value - now) + 1)
+    return 0
+
+
+def check_rate(route, client):
+    """
+    Returns the seconds to wait if `client` is over a budget for `route`,
+    else 0. A request turned away by one budget isn't charged to the other.
+    """
+    limits = get_limits(route)
+    buckets = []
+    if 'client' in limits:
+        buckets.append(('api:ratelimit:%s:%s' % (route, client),) + tuple(limits['client']))
+    if 'route' in limits:
+        buckets.append(('api:ratelimit:%s' % route,) + tuple(limits['route']))
+    return take(buckets) if buckets else 0
+
+
+# Returned by acquire() when there is no cap.
+UNLIMITED = object()
+
+
+class ConcurrencyLimiter:
+    """
+    Per-process slots for API_MAX_CONCURRENT_REQUESTS. acquire() returns the
+    semaphore it took a slot from, UNLIMITED, or None if none freed up in
+    time; pass what it returned to release().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limit = None
+        self.slots = None
+        self.in_flight = 0
+
+    def get_slots(self):
+        limit = getattr(settings, 'API_MAX_CONCURRENT_REQUESTS', None)
+        with self.lock:
+            if limit != self.limit:
+                self.limit = limit
+                self.slots = threading.BoundedSemaphore(limit) if limit else None
+            return self.slots
+
+    def acquire(self, timeout):
+        slots = self.get_slots()
+        if slots is None:
+            slots = UNLIMITED
+        elif not slots.acquire(timeout=timeout):
+            return None
+        self.count(1)
+        return slots
+
+    async def aacquire(self, timeout):
+        # Polls rather than blocking the event loop on the semaphore.
+        slots = self.get_slots()
+        if slots is None:
+            slots = UNLIMITED
+        else:
+            deadline = time.monotonic() + timeout
+            while not slots.acquire(blocking=False):
+                if time.monotonic() >= deadline:
+                    return None
+                await asyncio.sleep(0.005)
+        self.count(1)
+        return slots
+
+    def release(self, slots):
+        self.count(-1)
+        if slots is not UNLIMITED:
+            slots.release()
+
+    def count(self, delta):
+        with self.lock:
+            self.in_flight += delta
+
+
+limiter = ConcurrencyLimiter()
+
+
+class AdmissionMiddleware:
+    """
+    Sheds requests over a rate limit (429) or beyond the concurrency cap
+    (503), before they reach the ORM. Routes in API_ADMISSION_EXEMPT, such
+    as metrics, are always let through.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        route = self.get_route(request)
+        if route is None:
+            return self.get_response(request)
+        response = self.check_rate(request, route)
+        if response is not None:
+            return response
+
+        slots = limiter.acquire(getattr(settings, 'API_CONCURRENCY_WAIT', 0))
+        if slots is None:
+            return self.overloaded(route)
+        try:
+            return self.get_response(request)
+        finally:
+            limiter.release(slots)
+
+    async def __acall__(self, request):
+        route = self.get_route(request)
+        if route is None:
+            return await self.get_response(request)
+        response = self.check_rate(request, route)
+        if response is not None:
+            return response
+
+        slots = await limiter.aacquire(getattr(settings, 'API_CONCURRENCY_WAIT', 0))
+        if slots is None:
+            return self.overloaded(route)
+        try:
+            return await self.get_response(request)
+        finally:
+            limiter.release(slots)
+
+    def get_route(self, request):
+        """The route name, or None for exempt and unknown paths."""
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        # Lets MetricsMiddleware label shed requests with their route.
+        request.resolver_match = match
+        route = match.url_name or match.route
+        if route in getattr(settings, 'API_ADMISSION_EXEMPT', ['metrics']):
+            return None
+        return route
+
+    def check_rate(self, request, route):
+        wait = check_rate(route, get_client(request))
+        if not wait:
+            return None
+        _record(route, 'rate_limited')
+        return JsonResponse({'error': 'Rate limit exceeded, try again later.'}, status=429,
+                            headers={'Retry-After': str(math.ceil(wait))})
+
+    def overloaded(self, route):
+        _record(route, 'overloaded')
+        return JsonResponse({'error': 'Server busy, try again shortly.'}, status=503,
+                            headers={'Retry-After': '1'})
@@ -0,0 +1,138 @@
+"""
+Native async versions of the read and create endpoints, served under /async/.
+
+They use Django's async ORM API and are meant to run under an ASGI server
+(`gunicorn backend.asgi:application -k uvicorn.workers.UvicornWorker`), where an
+in-flight request waiting on Postgres doesn't hold a worker thread. Under WSGI
+they still work, but each request is run through an event loop of its own.
+"""
+import json
+
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+
+from . import cache
+from .fastpath import FastJSONRenderer
+from .models import Post, Comment
+from .pagination import KeysetPagination
+from .serializers import (UserSerializer, PostSerializer, PostListSerializer, BulkPostSerializer,
+                          BulkCommentSerializer)
+
+
+def render(data, status_code=status.HTTP_200_OK):
+    # The sync views' renderer, so both servers send the same bytes.
+    return HttpResponse(FastJSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+class AsyncAPIView(View):
+    """
+    Base for the async views. Like DRF's APIView, requests are CSRF exempt and
+    malformed JSON bodies and unknown cursors become 400/404 responses.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except NotFound as exc:
+            return render({'detail': str(exc.detail)}, status.HTTP_404_NOT_FOUND)
+
+    def get_data(self):
+        try:
+            return json.loads(self.request.body or b'{}')
+        except ValueError:
+            return None
+
+
+class AsyncGetUserView(AsyncAPIView):
+    async def get(self, request, id):
+        async def load():
+            try:
+                return UserSerializer(await User.objects.aget(id=id)).data
+            except User.DoesNotExist:
+                return None
+
+        data = await cache.aget_or_load('user', id, load)
+        if data is None:
+            return render({"message": "User not found."}, status.HTTP_404_NOT_FOUND)
+        return render(data)
+
+
+class AsyncGetAllUsersView(AsyncAPIView):
+    async def get(self, request):
+        paginator = KeysetPagination(ordering=('date_joined', 'id'))
+        users = await paginator.apaginate_querysets([User.objects.all()], request)
+        return render(paginator.get_paginated_data(UserSerializer(users, many=True).data))
+
+
+class AsyncGetPostView(AsyncAPIView):
+    async def get(self, request, id):
+        async def load():
+            try:
+                return PostSerializer(await Post.objects.select_related('body').aget(id=id)).data
+            except Post.DoesNotExist:
+                return None
+
+        data = await cache.aget_or_load('post', id, load)
+        if data is None:
+            return render({'error': 'Post not found'}, status.HTTP_404_NOT_FOUND)
+        return render(data)
+
+
+class AsyncGetPostsByUserView(AsyncAPIView):
+    async def get(self, request, user_id):
+        paginator = KeysetPagination()
+        posts = await paginator.apaginate_querysets([Post.get_posts_by_user(user_id=user_id)], request)
+        if not posts and paginator.cursor is None:
+            return render({'error': 'Posts not found'}, status.HTTP_404_NOT_FOUND)
+        return render(paginator.get_paginated_data(PostListSerializer(posts, many=True).data))
+
+
+class AsyncCreatePostView(AsyncAPIView):
+    async def post(self, request):
+        data = self.get_data()
+        if not isinstance(data, dict):
+            return render({'error': 'Expected a JSON object.'}, status.HTTP_400_BAD_REQUEST)
+
+        user_id = data.get('user')
+        if not user_id or not await User.objects.filter(id=user_id).aexists():
+            return render({'user': 'Invalid user ID.'}, status.HTTP_400_BAD_REQUEST)
+
+        # The bulk serializer validates without touching the database, so it's
+        # safe to call from the event loop.
+        serializer = BulkPostSerializer(data=data)
+        if not serializer.is_valid():
+            return render(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+        post = await Post.objects.acreate(**serializer.validated_data)
+        return render(BulkPostSerializer(post).data, status.HTTP_201_CREATED)
+
+
+class AsyncCreateCommentView(AsyncAPIView):
+    async def post(self, request):
+        data = self.get_data()
+        if not isinstance(data, dict):
+            return render({'error': 'Expected a JSON object.'}, status.HTTP_400_BAD_REQUEST)
+
+        user_id = data.get('user')
+        if not user_id or not await User.objects.filter(id=user_id).aexists():
+            return render({'user': 'Invalid user ID.'}, status.HTTP_400_BAD_REQUEST)
+
+        post_id = data.get('post')
+        if not post_id or not await Post.objects.filter(id=post_id).aexists():
+            return render({'post': 'Invalid post ID.'}, status.HTTP_400_BAD_REQUEST)
+
+        serializer = BulkCommentSerializer(data=data)
+        if not serializer.is_valid():
+            return render(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+        comment = await Comment.objects.acreate(**serializer.validated_data)
+        return render(BulkCommentSerializer(comment).data, status.HTTP_201_CREATED)
@@ -0,0 +1,130 @@
+import http.client
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+
+class LoadResult:
+    """
+    Latencies of the 2xx responses, which are all the percentiles and
+    throughput cover. Rate-limited requests (429), other 4xx responses and
+    errors (5xx, other statuses, connection failures) are only counted:
+    they are answered without doing the work being measured.
+    """
+
+    def __init__(self, latencies, rejected, client_errors, errors, elapsed):
+        self.latencies = sorted(latencies)
+        self.rejected = rejected
+        self.client_errors = client_errors
+        self.errors = errors
+        self.elapsed = elapsed
+
+    @property
+    def requests(self):
+        return len(self.latencies) + self.rejected + self.client_errors + self.errors
+
+    @property
+    def throughput(self):
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        index = min(len(self.latencies) - 1, int(round(p / 100.0 * (len(self.latencies) - 1))))
+        return self.latencies[index]
+
+
+def run_load(url, concurrency=16, requests=1000, method='GET', body=None, headers=None, timeout=30):
+    """
+    Sends `requests` requests from `concurrency` threads, each reusing one
+    keep-alive connection, and returns the per-request latencies. `url` may be
+    a list of URLs on the same host, which are requested round-robin.
+    """
+    urls = [url] if isinstance(url, str) else list(url)
+    parts = urlsplit(urls[0])
+    paths = []
+    for target in urls:
+        target_parts = urlsplit(target)
+        paths.append((target_parts.path or '/') + ('?' + target_parts.query if target_parts.query else ''))
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    headers = dict(headers or {})
+    if body is not None:
+        headers.setdefault('Content-Type', 'application/json')
+
+    counter = [0]
+    lock = threading.Lock()
+
+    def take():
+        with lock:
+            if counter[0] >= requests:
+                return None
+            counter[0] += 1
+            return paths[counter[0] % len(paths)]
+
+    def worker():
+        latencies = []
+        outcomes = Counter()
+        connection = connection_class(parts.netloc, timeout=timeout)
+        while True:
+            path = take()
+            if path is None:
+                break
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                code = response.status
+            except (OSError, http.client.HTTPException):
+                code = None
+                connection.close()
+                connection = connection_class(parts.netloc, timeout=timeout)
+            if code is not None and 200 <= code < 300:
+                latencies.append(time.perf_counter() - start)
+            elif code == 429:
+                outcomes['rejected'] += 1
+            elif code is not None and 400 <= code < 500:
+                outcomes['client_errors'] += 1
+            else:
+                outcomes['errors'] += 1
+        connection.close()
+        return latencies, outcomes
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: worker(), range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for worker_latencies, _ in results for latency in worker_latencies]
+    outcomes = sum((worker_outcomes for _, worker_outcomes in results), Counter())
+    return LoadResult(latencies, outcomes['rejected'], outcomes['client_errors'], outcomes['errors'], elapsed)
+
+
+METRIC_LINE = re.compile(r'^(?P<name>[a-z_]+)\{(?P<labels>[^}]*)\} (?P<value>\S+)$')
+
+
+def scrape_metrics(base_url, timeout=30):
+    """Reads the server's /metrics/ endpoint into {(name, labels): value}."""
+    with urlopen(base_url.rstrip('/') + '/metrics/', timeout=timeout) as response:
+        text = response.read().decode('utf-8')
+    samples = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            samples[(match.group('name'), match.group('labels'))] = float(match.group('value'))
+    return samples
+
+
+def queries_per_request(before, after, route, method):
+    """Average SQL statements per request for `route` between two scrapes, or None."""
+    labels = 'route="%s",method="%s"' % (route, method)
+    requests = (after.get(('api_request_duration_seconds_count', labels), 0)
+                - before.get(('api_request_duration_seconds_count', labels), 0))
+    if not requests:
+        return None
+    queries = after.get(('api_db_queries_total', labels), 0) - before.get(('api_db_queries_total', labels), 0)
+    return queries / requests
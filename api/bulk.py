@@ -0,0 +1,294 @@
+"""
+Bulk export and import of users, posts and comments, for backfills and for
+cloning an environment (the export_data and import_data commands).
+
+Exports read the table in primary key order with `values_list().iterator()`,
+which runs over a server-side cursor on Postgres, so memory holds one chunk
+of rows however large the table is. Rows are written as NDJSON or as CSV
+with a header row, gzipped when the path ends in .gz. Posts carry their body
+from PostBody as a `content` column, and their excerpt is derived from it
+on import when the file has none. The CSV archives written by
+maintain_partitions use the same columns and can be imported back.
+
+Imports read the file in batches. Each batch is checked with one
+`IN (...)` query per unique field (the ID, and usernames for users) and one
+per foreign key; rows that are already there or point at a missing row are
+skipped and counted, not fatal. The rest are written with COPY FROM STDIN
+on Postgres and with executemany elsewhere, one transaction per batch. IDs
+in the file are kept, so importing users, then posts, then comments clones a
+dataset with its references intact; the ID sequences are moved past the
+imported IDs at the end.
+
+Neither path sends model signals. The object cache, response cache and
+post and comment counters are updated here, but imported posts are not
+fanned out into timelines, and imported passwords must already be hashed
+(import_users hashes raw ones).
+"""
+import csv
+import datetime
+import gzip
+import io
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import cache, counters, partitions, response_cache
+from .models import Comment, Post, PostBody, make_excerpt
+
+TABLES = {
+    'users': User,
+    'posts': Post,
+    'comments': Comment,
+}
+
+# Object cache kinds, for dropping cached 404s for imported IDs.
+CACHE_KINDS = {
+    User: 'user',
+    Post: 'post',
+}
+
+
+def get_format(path):
+    """'csv' for *.csv and *.csv.gz, 'ndjson' otherwise."""
+    if path.endswith('.gz'):
+        path = path[:-3]
+    return 'csv' if path.endswith('.csv') else 'ndjson'
+
+
+def open_file(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def read_rows(path, fmt):
+    with open_file(path, 'r') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def get_fields(model):
+    return model._meta.concrete_fields
+
+
+def get_columns(model):
+    """The columns of an export: the concrete fields, then the body for posts."""
+    columns = [field.attname for field in get_fields(model)]
+    return columns + ['content'] if model is Post else columns
+
+
+def export_rows(model, using='default', chunk_size=2000):
+    """Yields every row of `model` as a tuple in `get_columns` order."""
+    lookups = [field.attname for field in get_fields(model)]
+    if model is Post:
+        lookups.append('body__content')
+    queryset = model._base_manager.using(using).order_by('pk').values_list(*lookups)
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+def write_rows(f, fmt, model, rows):
+    """Writes `rows` from `export_rows` to `f` and returns how many there were."""
+    columns = get_columns(model)
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([value.isoformat() if isinstance(value, datetime.datetime) else value
+                             for value in row])
+            count += 1
+    else:
+        encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+        for row in rows:
+            f.write(encoder.encode(dict(zip(columns, row))) + '\n')
+            count += 1
+    return count
+
+
+def parse_row(model, raw, now):
+    """
+    Converts a row read from a file into {attname: value}. Missing columns
+    take the field's default; a missing or empty ID is left to the database.
+    Raises ValidationError or ValueError for values that don't convert.
+    """
+    row = {}
+    for field in get_fields(model):
+        value = raw.get(field.attname)
+        if field.primary_key and value in (None, ''):
+            continue
+        if field.attname not in raw:
+            if field.has_default():
+                value = field.get_default()
+            elif getattr(field, 'auto_now_add', False) or getattr(field, 'auto_now', False):
+                value = now
+            elif field.null:
+                value = None
+            else:
+                raise ValueError('missing column %s' % field.attname)
+        elif value is None or (value == '' and field.null):
+            # CSV has no NULL; an empty cell in a nullable column stands for one.
+            value = None
+        else:
+            value = field.to_python(value)
+        if isinstance(value, datetime.datetime) and settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value, datetime.timezone.utc)
+        row[field.attname] = value
+    if model is Post:
+        # Written to PostBody by insert_rows.
+        if raw.get('content') is None:
+            raise ValueError('missing column content')
+        row['content'] = str(raw['content'])
+        if 'excerpt' not in raw:
+            row['excerpt'] = make_excerpt(row['content'])
+    return row
+
+
+def filter_rows(model, rows):
+    """
+    Drops rows that clash with an existing row or an earlier one in `rows`
+    on a unique field, or whose foreign keys point at missing rows. Returns
+    the remaining rows and a Counter of skip reasons.
+    """
+    skipped = Counter()
+    for field in get_fields(model):
+        if field.unique:
+            values = {row[field.attname] for row in rows if row.get(field.attname) is not None}
+            seen = set(model._base_manager.filter(**{field.attname + '__in': values})
+                       .values_list(field.attname, flat=True))
+            kept = []
+            for row in rows:
+                value = row.get(field.attname)
+                if value is not None:
+                    if value in seen:
+                        skipped['existing %s' % field.name] += 1
+                        continue
+                    seen.add(value)
+                kept.append(row)
+            rows = kept
+        elif field.is_relation:
+            ids = {row[field.attname] for row in rows if row[field.attname] is not None}
+            existing = set(field.related_model._base_manager.filter(pk__in=ids).values_list('pk', flat=True))
+            kept = []
+            for row in rows:
+                if row[field.attname] is not None and row[field.attname] not in existing:
+                    skipped['missing %s' % field.name] += 1
+                    continue
+                kept.append(row)
+            rows = kept
+    return rows, skipped
+
+
+def copy_value(value):
+    """Formats `value` for COPY's text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_rows(cursor, model, rows):
+    """Writes `rows`, which all have the same keys, with one COPY FROM STDIN."""
+    connection = connections['default']
+    fields = [field for field in get_fields(model) if field.attname in rows[0]]
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(row[field.attname]) for field in fields) + '\n')
+    buffer.seek(0)
+    cursor.copy_expert('COPY %s (%s) FROM STDIN' % (
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(field.column) for field in fields),
+    ), buffer)
+
+
+def insert_many(cursor, model, rows):
+    """
+    Writes `rows`, which all have the same keys, with one executemany. Not
+    bulk_create, which would replace imported created_at values with now.
+    Rows without an ID are inserted one at a time, to read back theirs.
+    """
+    connection = connections['default']
+    fields = [field for field in get_fields(model) if field.attname in rows[0]]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    params = [[field.get_db_prep_save(row[field.attname], connection) for field in fields] for row in rows]
+    pk = model._meta.pk.attname
+    if pk in rows[0]:
+        cursor.executemany(sql, params)
+        return
+    for row, values in zip(rows, params):
+        cursor.execute(sql, values)
+        row[pk] = cursor.lastrowid
+
+
+def reserve_ids(cursor, model, rows):
+    """Gives `rows` IDs from `model`'s sequence, so COPY can write them along with the rows that refer to them."""
+    table = model._meta.db_table
+    cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                   [table, model._meta.pk.column, len(rows)])
+    for row, (pk,) in zip(rows, cursor.fetchall()):
+        row[model._meta.pk.attname] = pk
+
+
+def insert_rows(model, rows):
+    postgres = connections['default'].vendor == 'postgresql'
+    write = copy_rows if postgres else insert_many
+    pk = model._meta.pk.attname
+    with connections['default'].cursor() as cursor:
+        if model is Post and postgres:
+            reserve_ids(cursor, model, [row for row in rows if pk not in row])
+        for group in ([row for row in rows if pk in row], [row for row in rows if pk not in row]):
+            if group:
+                write(cursor, model, group)
+        if model is Post:
+            write(cursor, PostBody, [{'post_id': row[pk], 'content': row['content']} for row in rows])
+
+
+def import_batch(model, rows):
+    """
+    Filters and writes one batch of parsed rows, and updates the counters
+    and caches they affect. Returns the number written and a Counter of skip
+    reasons.
+    """
+    rows, skipped = filter_rows(model, rows)
+    if not rows:
+        return 0, skipped
+
+    with transaction.atomic():
+        insert_rows(model, rows)
+        for name, (counted, field) in counters.SOURCES.items():
+            if counted is model:
+                counters.increment_many(name, Counter(row[field] for row in rows))
+
+    pk = model._meta.pk.attname
+    if model in CACHE_KINDS:
+        cache.invalidate_many(CACHE_KINDS[model], [row[pk] for row in rows if pk in row])
+    if model is User:
+        response_cache.invalidate('users')
+    elif model is Post:
+        for user_id in {row['user_id'] for row in rows}:
+            response_cache.invalidate('posts-by-user:%s' % user_id)
+    return len(rows), skipped
+
+
+def finish_import(model):
+    """Moves `model`'s ID sequence past the imported IDs."""
+    connection = connections['default']
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+            cursor.execute(sql)
+    partitions.clear_bounds()
@@ -0,0 +1,139 @@
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import routing
+
+# Stored in place of a row that does not exist, so repeated 404s stay off the database.
+MISSING = '__missing__'
+# Left behind by an invalidation for API_OBJECT_CACHE_INVALIDATED_TIMEOUT
+# seconds. Fills use add(), which won't replace it, so a load that read the
+# row before the write committed can't cache the old version afterwards.
+INVALIDATED = '__invalidated__'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'API_OBJECT_CACHE_ALIAS', 'default')]
+
+
+def cache_key(kind, pk):
+    return 'api:object:%s:%s' % (kind, pk)
+
+
+def _record(kind, outcome):
+    with _stats_lock:
+        _stats[(kind, outcome)] += 1
+
+
+def get_stats():
+    """Returns a {(kind, 'hit' | 'miss' | 'bypass'): count} snapshot for this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def get_or_load(kind, pk, loader):
+    """
+    Read-through lookup of a serialized object.
+
+    `loader` is called on a miss and must return the serialized dict, or None
+    if the row does not exist. Entries are dropped by the signal handlers in
+    api/signals.py once a save or delete of the row commits; the timeout only
+    bounds staleness for writes that bypass signals (e.g. queryset.update()).
+    Just after an invalidation the row is loaded but not cached (see
+    INVALIDATED).
+
+    Clients pinned to the primary after a write (api/routing.py) bypass the
+    cache: an entry, or a cached 404, filled from a lagging replica could
+    hide their own write.
+    """
+    if routing.is_pinned():
+        _record(kind, 'bypass')
+        return loader()
+    cache = get_cache()
+    key = cache_key(kind, pk)
+
+    value = cache.get(key)
+    if value is not None and value != INVALIDATED:
+        _record(kind, 'hit')
+        return None if value == MISSING else value
+
+    _record(kind, 'miss')
+    value = loader()
+    fill(cache, key, value)
+    return value
+
+
+def fill(cache, key, value):
+    if value is None:
+        cache.add(key, MISSING, getattr(settings, 'API_OBJECT_CACHE_MISS_TIMEOUT', 30))
+    else:
+        cache.add(key, dict(value), getattr(settings, 'API_OBJECT_CACHE_TIMEOUT', 300))
+
+
+def get_many_or_load(kind, pks, loader):
+    """
+    `get_or_load` for several objects: one cache round trip for all of
+    `pks`, then one `loader(missing_pks)` call for the misses, which returns
+    {pk: serialized dict} and leaves out rows that don't exist. Returns
+    {pk: dict or None}.
+    """
+    if routing.is_pinned():
+        _record(kind, 'bypass')
+        loaded = loader(list(pks))
+        return {pk: loaded.get(pk) for pk in pks}
+    cache = get_cache()
+    keys = {cache_key(kind, pk): pk for pk in pks}
+    found = cache.get_many(list(keys))
+
+    values = {}
+    for key, pk in keys.items():
+        if key in found and found[key] != INVALIDATED:
+            _record(kind, 'hit')
+            values[pk] = None if found[key] == MISSING else found[key]
+        else:
+            _record(kind, 'miss')
+    missing = [pk for pk in keys.values() if pk not in values]
+    if not missing:
+        return values
+
+    loaded = loader(missing)
+    for pk in missing:
+        values[pk] = loaded.get(pk)
+        fill(cache, cache_key(kind, pk), values[pk])
+    return values
+
+
+async def aget_or_load(kind, pk, loader):
+    """`get_or_load` for async views; `loader` is a coroutine function."""
+    if routing.is_pinned():
+        _record(kind, 'bypass')
+        return await loader()
+    cache = get_cache()
+    key = cache_key(kind, pk)
+
+    value = await cache.aget(key)
+    if value is not None and value != INVALIDATED:
+        _record(kind, 'hit')
+        return None if value == MISSING else value
+
+    _record(kind, 'miss')
+    value = await loader()
+    if value is None:
+        await cache.aadd(key, MISSING, getattr(settings, 'API_OBJECT_CACHE_MISS_TIMEOUT', 30))
+    else:
+        await cache.aadd(key, dict(value), getattr(settings, 'API_OBJECT_CACHE_TIMEOUT', 300))
+    return value
+
+
+def invalidate(kind, pk):
+    invalidate_many(kind, [pk])
+
+
+def invalidate_many(kind, pks):
+    get_cache().set_many({cache_key(kind, pk): INVALIDATED for pk in pks},
+                         getattr(settings, 'API_OBJECT_CACHE_INVALIDATED_TIMEOUT', 5))
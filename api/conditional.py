@@ -0,0 +1,25 @@
+import hashlib
+import json
+
+from django.utils.cache import get_conditional_response
+
+
+def make_etag(*parts):
+    """Strong ETag over a tuple of cheap-to-fetch values (IDs, counts, timestamps)."""
+    return '"%s"' % hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def etag_for_data(kind, data):
+    """Strong ETag for an already-serialized object, e.g. one from the object cache."""
+    return make_etag(kind, json.dumps(data, sort_keys=True, default=str))
+
+
+def not_modified(request, etag):
+    """
+    Returns a 304 response if the request's If-None-Match matches `etag`,
+    otherwise None. Call it before serializing anything.
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+    return response
@@ -0,0 +1,110 @@
+"""
+Denormalized counts kept in CounterShard rows.
+
+POST_COUNT is a user's number of posts and COMMENT_COUNT a post's number of
+comments. Each count is split over API_COUNTER_SHARDS[name] rows; an
+increment adds to one shard chosen at random with an `F()` update, so
+comments arriving on a viral post spread their row locks over several rows
+instead of queueing on one. Reading a count sums its shards, which the
+unique (name, object_id, shard) index answers directly.
+
+Counts are maintained by the signal handlers in api/signals.py and by the
+bulk write paths. Writes that bypass both (queryset.update(), raw SQL, a
+failed request between the row write and the counter update) can leave them
+off; `reconcile()` and the reconcile_counters command rebuild them from
+COUNT(*).
+"""
+import random
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from .models import Comment, CounterShard, Post
+
+POST_COUNT = 'post_count'
+COMMENT_COUNT = 'comment_count'
+
+# name -> (model counted, field holding the object ID the count belongs to)
+SOURCES = {
+    POST_COUNT: (Post, 'user_id'),
+    COMMENT_COUNT: (Comment, 'post_id'),
+}
+
+
+def get_shard_count(name):
+    return max(1, getattr(settings, 'API_COUNTER_SHARDS', {}).get(name, 1))
+
+
+def increment(name, object_id, delta=1):
+    shard = random.randrange(get_shard_count(name))
+    rows = CounterShard.objects.filter(name=name, object_id=object_id, shard=shard)
+    if rows.update(value=F('value') + delta):
+        return
+    try:
+        with transaction.atomic():
+            CounterShard.objects.create(name=name, object_id=object_id, shard=shard, value=delta)
+    except IntegrityError:
+        # Another writer created the shard first.
+        rows.update(value=F('value') + delta)
+
+
+def increment_many(name, deltas):
+    """
+    Applies {object_id: delta}, as after a bulk_create. Shards are updated in
+    object ID order, so two transactions counting overlapping objects take
+    their row locks in the same order and can't deadlock.
+    """
+    for object_id, delta in sorted(deltas.items()):
+        if delta:
+            increment(name, object_id, delta)
+
+
+def get_counts(name, object_ids):
+    """Returns {object_id: count} in one query; missing counts are 0."""
+    counts = dict.fromkeys(object_ids, 0)
+    rows = (CounterShard.objects.filter(name=name, object_id__in=counts).order_by()
+            .values('object_id').annotate(total=Sum('value')).values_list('object_id', 'total'))
+    counts.update(rows)
+    return counts
+
+
+def get_count(name, object_id):
+    return get_counts(name, [object_id])[object_id]
+
+
+def delete(name, object_ids):
+    CounterShard.objects.filter(name=name, object_id__in=list(object_ids)).delete()
+
+
+def reconcile(name, dry_run=False, batch_size=1000):
+    """
+    Compares every stored count with COUNT(*) over its source table and
+    rewrites the drifted ones as a single shard. Returns {object_id: (stored,
+    actual)} for the counts that were off.
+
+    Writes that land between the COUNT(*) and the rewrite are lost from the
+    rewritten counts, so run it when writes are quiet, or run it twice.
+    """
+    model, field = SOURCES[name]
+    actual = dict(model.objects.order_by().values(field).annotate(n=Count('id')).values_list(field, 'n'))
+    stored = dict(CounterShard.objects.filter(name=name).order_by().values('object_id')
+                  .annotate(total=Sum('value')).values_list('object_id', 'total'))
+
+    drifted = {}
+    for object_id in actual.keys() | stored.keys():
+        if actual.get(object_id, 0) != stored.get(object_id, 0):
+            drifted[object_id] = (stored.get(object_id, 0), actual.get(object_id, 0))
+    if dry_run or not drifted:
+        return drifted
+
+    object_ids = sorted(drifted)
+    with transaction.atomic():
+        for i in range(0, len(object_ids), batch_size):
+            delete(name, object_ids[i:i + batch_size])
+        CounterShard.objects.bulk_create(
+            [CounterShard(name=name, object_id=object_id, shard=0, value=drifted[object_id][1])
+             for object_id in object_ids if drifted[object_id][1]],
+            batch_size=batch_size,
+        )
+    return drifted
@@ -0,0 +1,102 @@
+"""
+Serializer-free read path for the user and post endpoints.
+
+Rows are fetched with `values()` and turned into the same dicts UserSerializer,
+PostSerializer and PostListSerializer would produce, and responses are encoded with orjson. The
+output is byte-for-byte what the serializers and DRF's JSONRenderer return;
+the tests in api/tests.py compare the two.
+"""
+from django.db.models import F
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+from . import fieldsets
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Formats datetimes exactly as the serializers' DateTimeFields do.
+_datetime_field = serializers.DateTimeField()
+
+USER_VALUES = ('id', 'username', 'email', 'first_name', 'last_name')
+POST_VALUES = ('id', 'title', 'user_id', 'created_at')
+POST_LIST_VALUES = ('id', 'title', 'excerpt', 'user_id', 'created_at')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it's installed. Requests that
+    ask for indented output, or data orjson can't encode, go through the
+    stock renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # JSONRenderer escapes these two for JavaScript compatibility; match it.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def user_values(queryset, *extra, fields=None):
+    """`fields` narrows the columns to a sparse fieldset (api/fieldsets.py)."""
+    if fields is not None:
+        return queryset.values(*fieldsets.columns(fields, *extra))
+    return queryset.values(*dict.fromkeys(USER_VALUES + extra))
+
+
+def user_representation(row, fields=None):
+    if fields is not None:
+        return {name: row[name] for name in fields}
+    return {
+        'id': row['id'],
+        'username': row['username'],
+        'email': row['email'],
+        'first_name': row['first_name'],
+        'last_name': row['last_name'],
+    }
+
+
+def post_values(queryset):
+    """Full posts, with the body joined in from PostBody."""
+    return queryset.values(*POST_VALUES, content=F('body__content'))
+
+
+def post_representation(row):
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'content': row['content'],
+        'user': row['user_id'],
+        'created_at': _datetime_field.to_representation(row['created_at']),
+    }
+
+
+def post_list_values(queryset, *extra, fields=None):
+    """Posts for lists, which read the excerpt and never touch PostBody."""
+    if fields is not None:
+        return queryset.values(*fieldsets.columns(fields, *extra))
+    return queryset.values(*dict.fromkeys(POST_LIST_VALUES + extra))
+
+
+def post_list_representation(row, fields=None):
+    if fields is not None:
+        return {name: _post_field(row, name) for name in fields}
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'excerpt': row['excerpt'],
+        'user': row['user_id'],
+        'created_at': _datetime_field.to_representation(row['created_at']),
+    }
+
+
+def _post_field(row, name):
+    if name == 'created_at':
+        return _datetime_field.to_representation(row['created_at'])
+    return row[fieldsets.SOURCES.get(name, name)]
@@ -0,0 +1,60 @@
+"""
+Sparse fieldsets: `?fields=id,title,created_at` on the user and post read
+endpoints.
+
+Each object in the response is trimmed to the named fields, and list
+queries load only the columns those fields need, through `values()` on
+the fast path and `only()` where a serializer is used, so a page of titles
+doesn't read post excerpts off disk or over the wire. Columns a keyset cursor
+orders by are loaded whatever was asked for. Single objects served from
+the object cache are cached whole and trimmed on the way out.
+"""
+from rest_framework.exceptions import ValidationError
+
+from .pagination import get_query_params
+
+USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name')
+POST_FIELDS = ('id', 'title', 'content', 'user', 'created_at')
+# Lists show a post's excerpt; only single posts carry the body.
+POST_LIST_FIELDS = ('id', 'title', 'excerpt', 'user', 'created_at')
+
+# Representation name -> model attribute, where they differ.
+SOURCES = {'user': 'user_id'}
+
+
+def parse_fields(request, available):
+    """
+    The fields named in ?fields=, in `available` order, or None if the
+    parameter isn't given. Raises ValidationError (a 400) for unknown names.
+    """
+    value = get_query_params(request).get('fields')
+    if value is None:
+        return None
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested - set(available)
+    if not requested or unknown:
+        raise ValidationError({'fields': 'Unknown or missing field names %s; choose from %s.'
+                               % (', '.join(sorted(unknown)) or '(none given)', ', '.join(available))})
+    return tuple(name for name in available if name in requested)
+
+
+def columns(fields, *required):
+    """The model attributes to load for `fields`, plus `required` ones such as ordering keys."""
+    return tuple(dict.fromkeys([SOURCES.get(name, name) for name in fields] + list(required)))
+
+
+def trim(data, fields):
+    if fields is None:
+        return data
+    return {name: data[name] for name in fields}
+
+
+class SparseFieldsMixin:
+    """Serializer mixin taking a `fields` argument that drops every other field."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
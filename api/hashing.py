@@ -0,0 +1,48 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+
+
+def get_pool_size():
+    return getattr(settings, 'API_PASSWORD_HASH_WORKERS', None) or os.cpu_count() or 2
+
+
+def _get_pool():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            workers = get_pool_size()
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+            # One slot per worker plus the allowed backlog; anything beyond that is shed.
+            _slots = threading.BoundedSemaphore(workers + getattr(settings, 'API_PASSWORD_HASH_QUEUE', 32))
+        return _executor, _slots
+
+
+def hash_password(raw_password):
+    """
+    Hashes `raw_password` on the bounded hashing pool.
+
+    PBKDF2 runs in OpenSSL with the GIL released, so the pool caps how many
+    cores signups can occupy at once. If no slot frees up within
+    API_PASSWORD_HASH_WAIT seconds, HashingBusy is raised so the caller can
+    shed the request instead of queueing without bound.
+    """
+    executor, slots = _get_pool()
+    if not slots.acquire(timeout=getattr(settings, 'API_PASSWORD_HASH_WAIT', 2)):
+        raise HashingBusy()
+    try:
+        return executor.submit(make_password, raw_password).result()
+    finally:
+        slots.release()
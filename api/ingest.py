@@ -0,0 +1,186 @@
+"""
+Write coalescing for comment ingestion.
+
+With API_COMMENT_INGEST enabled, create-comment validates the payload,
+queues it here and answers 202 with a receipt ID. A background flusher
+drains the queue into one `bulk_create` per API_COMMENT_INGEST_BATCH_SIZE
+comments, or per API_COMMENT_INGEST_FLUSH_INTERVAL seconds if the batch
+fills more slowly than that.
+
+Durability: a queued comment lives only in this process's memory until its
+batch commits. A graceful shutdown (SIGTERM to gunicorn or uvicorn workers,
+or any normal interpreter exit) runs `CommentIngest.shutdown()` from an
+atexit hook, which lets the flusher finish its batch and writes the rest of
+the queue, so nothing is lost; a crash or SIGKILL loses whatever was queued,
+at most one flush interval's worth plus any backlog. A batch that fails to write is
+retried API_COMMENT_INGEST_RETRIES times and then dropped and logged with
+its receipt IDs. Callers that need a comment committed before they get a
+response should leave ingest mode off, or use create-comments.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connection, transaction
+
+from . import counters
+from .models import Comment, Post
+
+logger = logging.getLogger(__name__)
+
+
+class IngestFull(Exception):
+    """Raised when the ingest queue is at API_COMMENT_INGEST_MAX_QUEUE."""
+
+
+def is_enabled():
+    return getattr(settings, 'API_COMMENT_INGEST', False)
+
+
+class CommentIngest:
+    def __init__(self):
+        self.queue = None
+        self.thread = None
+        self.lock = threading.Lock()
+        # Serializes writers, so flush() at shutdown doesn't race the flusher.
+        self.write_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.stats = Counter()
+
+    def get_queue(self):
+        with self.lock:
+            if self.queue is None:
+                self.queue = queue.Queue(maxsize=getattr(settings, 'API_COMMENT_INGEST_MAX_QUEUE', 10000))
+            return self.queue
+
+    def submit(self, data):
+        """
+        Queues validated comment data ({'user_id', 'post_id', 'content'}) and
+        returns its receipt ID.
+        """
+        receipt = uuid.uuid4().hex
+        try:
+            self.get_queue().put_nowait((receipt, data))
+        except queue.Full:
+            self.record('rejected')
+            raise IngestFull()
+        self.record('queued')
+        self.start_flusher()
+        return receipt
+
+    def start_flusher(self):
+        with self.lock:
+            if self.stopping.is_set():
+                return
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='comment-ingest', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while not self.stopping.is_set():
+            batch = self.take_batch(block=True)
+            if batch:
+                self.write(batch)
+            close_old_connections()
+
+    def take_batch(self, block=False):
+        """
+        Takes up to API_COMMENT_INGEST_BATCH_SIZE items. With `block`, waits
+        for a first item and then up to API_COMMENT_INGEST_FLUSH_INTERVAL
+        seconds for the batch to fill.
+        """
+        q = self.get_queue()
+        batch_size = getattr(settings, 'API_COMMENT_INGEST_BATCH_SIZE', 500)
+        batch = []
+        if block:
+            try:
+                # Wake up now and then to notice shutdown().
+                batch.append(q.get(timeout=0.5))
+            except queue.Empty:
+                return batch
+            deadline = time.monotonic() + getattr(settings, 'API_COMMENT_INGEST_FLUSH_INTERVAL', 0.05)
+            while len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        while len(batch) < batch_size:
+            try:
+                batch.append(q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch):
+        retries = getattr(settings, 'API_COMMENT_INGEST_RETRIES', 3)
+        with self.write_lock:
+            for attempt in range(retries + 1):
+                try:
+                    created = self.insert([data for _, data in batch])
+                except Exception:
+                    logger.exception('Comment ingest batch of %d failed (attempt %d).', len(batch), attempt + 1)
+                    connection.close()
+                    time.sleep(min(2 ** attempt * 0.1, 2))
+                    continue
+                self.record('written', created)
+                self.record('orphaned', len(batch) - created)
+                return
+        self.record('dropped', len(batch))
+        logger.error('Dropped comment ingest batch; receipts: %s', ', '.join(receipt for receipt, _ in batch))
+
+    def insert(self, rows):
+        """
+        Inserts `rows` in one transaction and returns how many were written.
+        Users or posts deleted since the comment was queued are checked with
+        one `id IN (...)` query each and their comments skipped.
+        """
+        users = set(User.objects.filter(id__in={row['user_id'] for row in rows}).values_list('id', flat=True))
+        posts = set(Post.objects.filter(id__in={row['post_id'] for row in rows}).values_list('id', flat=True))
+        comments = [Comment(**row) for row in rows if row['user_id'] in users and row['post_id'] in posts]
+        with transaction.atomic():
+            Comment.objects.bulk_create(comments)
+            counters.increment_many(counters.COMMENT_COUNT, Counter(comment.post_id for comment in comments))
+        return len(comments)
+
+    def flush(self):
+        """Writes everything queued so far from the calling thread."""
+        if self.queue is None:
+            return
+        while True:
+            batch = self.take_batch()
+            if not batch:
+                return
+            self.write(batch)
+
+    def shutdown(self, timeout=10):
+        """
+        Stops the flusher after it writes the batch it holds, then flushes
+        the rest of the queue. Registered with atexit.
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.flush()
+
+    def record(self, outcome, count=1):
+        with self.lock:
+            self.stats[outcome] += count
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['depth'] = self.queue.qsize() if self.queue is not None else 0
+        return stats
+
+
+comments = CommentIngest()
+atexit.register(comments.shutdown)
@@ -0,0 +1,69 @@
+"""
+Request-scoped batching of user and post lookups, in the style of DataLoader.
+
+Code handling a request gets the loader for a kind with
+`get_loader(request, kind)`. `want(ids)` registers IDs that will be
+needed, and the next `get()` or `get_many()` fetches everything wanted and
+not yet loaded in one round: a single get_many against the object cache,
+then a single `id IN (...)` query for the misses. The results (including
+rows that don't exist) are cached like single lookups, and memoized on the
+request, so asking again for an ID costs nothing.
+
+The loaders return the cached representations that get-user and get-post
+serve, built from `values()` rows by api/fastpath.py. `in_bulk()` doesn't
+accept `values()` querysets, so `fetch_*` build the same {id: row} map
+from an `id__in` filter instead.
+"""
+from django.contrib.auth.models import User
+
+from . import cache, fastpath
+from .models import Post
+
+
+def fetch_users(ids):
+    rows = fastpath.user_values(User.objects.filter(id__in=ids))
+    return {row['id']: fastpath.user_representation(row) for row in rows}
+
+
+def fetch_posts(ids):
+    rows = fastpath.post_values(Post.objects.filter(id__in=ids))
+    return {row['id']: fastpath.post_representation(row) for row in rows}
+
+
+FETCHERS = {
+    'user': fetch_users,
+    'post': fetch_posts,
+}
+
+
+class Loader:
+    def __init__(self, kind):
+        self.kind = kind
+        self.loaded = {}
+        self.pending = set()
+
+    def want(self, ids):
+        """Queues `ids` for the next fetch."""
+        self.pending.update(int(pk) for pk in ids if int(pk) not in self.loaded)
+
+    def get_many(self, ids):
+        """Returns {id: representation or None} for `ids`, fetching whatever is pending."""
+        ids = [int(pk) for pk in ids]
+        self.want(ids)
+        if self.pending:
+            pending, self.pending = self.pending, set()
+            self.loaded.update(cache.get_many_or_load(self.kind, pending, FETCHERS[self.kind]))
+        return {pk: self.loaded[pk] for pk in ids}
+
+    def get(self, pk):
+        return self.get_many([pk])[int(pk)]
+
+
+def get_loader(request, kind):
+    """The loader for `kind` ('user' or 'post') belonging to `request`."""
+    # Kept on the Django request, so a DRF Request and the HttpRequest it wraps share loaders.
+    request = getattr(request, '_request', request)
+    loaders = request.__dict__.setdefault('api_loaders', {})
+    if kind not in loaders:
+        loaders[kind] = Loader(kind)
+    return loaders[kind]
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from api.benchmark import run_load
+
+DEFAULT_PATHS = ['/get-user/1/', '/get-post/1/', '/get-posts-by-user/1/', '/get-users/']
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares concurrent throughput of the WSGI deployment and the async views under ASGI. '
+        'Start both servers with the same number of workers first, e.g. '
+        '`gunicorn backend.wsgi:application -w 4 -b :8000` and '
+        '`gunicorn backend.asgi:application -w 4 -k uvicorn.workers.UvicornWorker -b :8001`.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi', default='http://127.0.0.1:8000', help='Base URL of the WSGI server.')
+        parser.add_argument('--asgi', default='http://127.0.0.1:8001', help='Base URL of the ASGI server.')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Sync endpoint path to compare; the ASGI run uses /async<path>. Repeatable.')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or DEFAULT_PATHS
+        self.stdout.write('%-32s %-5s %10s %9s %9s %9s %7s %7s %7s' % (
+            'path', 'mode', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', '429', '4xx', 'errors'))
+        for path in paths:
+            for mode, url in (('wsgi', options['wsgi'].rstrip('/') + path),
+                              ('asgi', options['asgi'].rstrip('/') + '/async' + path)):
+                result = run_load(url, concurrency=options['concurrency'], requests=options['requests'])
+                self.stdout.write('%-32s %-5s %10.1f %9.2f %9.2f %9.2f %7d %7d %7d' % (
+                    path, mode, result.throughput, result.percentile(50) * 1000, result.percentile(95) * 1000,
+                    result.percentile(99) * 1000, result.rejected, result.client_errors, result.errors))
@@ -0,0 +1,58 @@
+from collections import Counter
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import bulk
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports users, posts or comments from an NDJSON or CSV file as written by export_data (or a '
+        'maintain_partitions archive), keeping their IDs. Rows are written with COPY on Postgres and '
+        'executemany elsewhere, a batch per transaction; rows whose ID or username is taken, or whose '
+        'user or post is missing, are skipped. Import users before posts before comments. Passwords must '
+        'be hashed already, and imported posts are not fanned out to timelines.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=sorted(bulk.TABLES))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Input format; defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        model = bulk.TABLES[options['table']]
+        path = options['path']
+        rows = enumerate(bulk.read_rows(path, options['format'] or bulk.get_format(path)), 1)
+        now = timezone.now()
+        pk = model._meta.pk.attname
+
+        imported = 0
+        skipped = Counter()
+        with_ids = False
+        while True:
+            batch = []
+            for line, raw in islice(rows, options['batch_size']):
+                try:
+                    batch.append(bulk.parse_row(model, raw, now))
+                except (ValidationError, ValueError) as e:
+                    raise CommandError('Row %d: %s' % (line, '; '.join(getattr(e, 'messages', [str(e)]))))
+            if not batch:
+                break
+            with_ids = with_ids or any(pk in row for row in batch)
+
+            batch_imported, batch_skipped = bulk.import_batch(model, batch)
+            imported += batch_imported
+            skipped += batch_skipped
+            self.stdout.write('%d imported, %d skipped' % (imported, sum(skipped.values())))
+
+        if with_ids:
+            bulk.finish_import(model)
+
+        reasons = ', '.join('%d %s' % (count, reason) for reason, count in sorted(skipped.items()))
+        self.stdout.write(self.style.SUCCESS('Imported %d %s (%d skipped%s).' % (
+            imported, options['table'], sum(skipped.values()), ': ' + reasons if reasons else '')))
@@ -0,0 +1,74 @@
+import datetime
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from api import counters, partitions, response_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Maintains the monthly partitions of api_post and api_comment (API_PARTITION_BY_MONTH). Creates '
+        'partitions for the coming months, and with --retain-months archives older months: each partition '
+        'is detached, exported to gzipped CSV in --archive-dir and dropped, instead of deleting its rows. '
+        'Run it at least monthly, e.g. from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int,
+                            default=getattr(settings, 'API_PARTITION_MONTHS_AHEAD', 3))
+        parser.add_argument('--retain-months', type=int,
+                            default=getattr(settings, 'API_PARTITION_RETENTION_MONTHS', None),
+                            help='Archive months that ended more than this many months ago.')
+        parser.add_argument('--archive-dir', default=getattr(settings, 'API_PARTITION_ARCHIVE_DIR', None),
+                            help='Where archived partitions are exported.')
+        parser.add_argument('--no-export', action='store_true', help='Drop archived partitions without exporting.')
+        parser.add_argument('--dry-run', action='store_true', help='List what would be archived.')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not partitions.is_enabled(using):
+            raise CommandError('Partitioning is off; it needs Postgres and API_PARTITION_BY_MONTH.')
+
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            for table in partitions.TABLES:
+                if not partitions.is_partitioned(cursor, table):
+                    raise CommandError('%s is not partitioned; run migrate with API_PARTITION_BY_MONTH on.' % table)
+                for name in partitions.ensure_partitions(cursor, table, options['months_ahead']):
+                    self.stdout.write('Created %s' % name)
+
+        if options['retain_months'] is not None:
+            self.archive(using, options)
+
+    def archive(self, using, options):
+        output_dir = None if options['no_export'] else options['archive_dir']
+        if output_dir is None and not options['no_export'] and not options['dry_run']:
+            raise CommandError('Pass --archive-dir, or --no-export to drop old partitions without a copy.')
+        if output_dir is not None and not options['dry_run']:
+            os.makedirs(output_dir, exist_ok=True)
+
+        this_month = partitions.month_start(datetime.datetime.now(datetime.timezone.utc))
+        cutoff = partitions.add_months(this_month, -options['retain_months'])
+        # Comments first: a month's comments are on posts from that month or earlier.
+        for table in ('api_comment', 'api_post'):
+            with connections[using].cursor() as cursor:
+                months = partitions.partitions_before(cursor, table, cutoff)
+            for month in months:
+                name = partitions.partition_name(table, month)
+                if options['dry_run']:
+                    self.stdout.write('Would archive %s' % name)
+                    continue
+                # One transaction per partition keeps each lock on the parent table short.
+                with transaction.atomic(using=using), connections[using].cursor() as cursor:
+                    result = partitions.archive_partition(cursor, table, month, output_dir)
+                    if table == 'api_post':
+                        # The comment counters went with the posts; the authors' counts drop.
+                        counters.increment_many(counters.POST_COUNT, {
+                            user_id: -count for user_id, count in result['affected'].items()})
+                if table == 'api_post':
+                    for user_id in result['affected']:
+                        response_cache.invalidate('posts-by-user:%s' % user_id)
+                self.stdout.write(self.style.SUCCESS('Archived %s (%d rows)' % (name, result['rows'])))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api import counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the denormalized post and comment counts from COUNT(*) over the posts and comments '
+        'tables, rewriting only the counts that drifted. Writes made while it runs can be lost from '
+        'the rewritten counts, so run it when writes are quiet.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counter', action='append', dest='names', choices=sorted(counters.SOURCES),
+                            help='Only reconcile this counter. Repeatable.')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without repairing it.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for name in options['names'] or sorted(counters.SOURCES):
+            drifted = counters.reconcile(name, dry_run=options['dry_run'], batch_size=options['batch_size'])
+            for object_id, (stored, actual) in sorted(drifted.items())[:20]:
+                self.stdout.write('%s %s: %d -> %d' % (name, object_id, stored, actual))
+            if len(drifted) > 20:
+                self.stdout.write('... and %d more' % (len(drifted) - 20))
+            verb = 'drifted' if options['dry_run'] else 'repaired'
+            self.stdout.write(self.style.SUCCESS('%s: %d %s.' % (name, len(drifted), verb)))
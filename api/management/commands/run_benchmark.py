@@ -0,0 +1,111 @@
+import json
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import queries_per_request, run_load, scrape_metrics
+from api.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Drives each API endpoint concurrently against a running server and reports throughput, '
+        'p50/p95/p99 latency and SQL queries per request (read from the server\'s /metrics/). '
+        'Run it with the same settings as the server so it can sample real IDs, e.g. after seed_data. '
+        'Save results with --output and pass them to a later run with --compare to see the change.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per endpoint.')
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help='Only run this endpoint (URL name). Repeatable.')
+        parser.add_argument('--include-writes', action='store_true',
+                            help='Also benchmark create-post and create-comment (adds rows).')
+        parser.add_argument('--sample', type=int, default=100, help='Distinct IDs to rotate through.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--compare', help='JSON results from an earlier run to compare against.')
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+        rng = random.Random(0)
+        user_ids = list(User.objects.order_by('?').values_list('id', flat=True)[:options['sample']])
+        post_ids = list(Post.objects.order_by('?').values_list('id', flat=True)[:options['sample']])
+        if not user_ids or not post_ids:
+            raise CommandError('No users or posts to benchmark against; run seed_data first.')
+
+        def urls(pattern, ids):
+            return [base_url + pattern % pk for pk in ids]
+
+        # (label, URL name as recorded by /metrics/, method, URLs, body)
+        endpoints = [
+            ('get-user', 'get-user', 'GET', urls('/get-user/%d/', user_ids), None),
+            ('get-users', 'get-users', 'GET', [base_url + '/get-users/'], None),
+            ('get-post', 'get-post', 'GET', urls('/get-post/%d/', post_ids), None),
+            ('get-post?include=comments', 'get-post', 'GET', urls('/get-post/%d/?include=comments', post_ids),
+             None),
+            ('get-posts-by-user', 'get-posts-by-user', 'GET', urls('/get-posts-by-user/%d/', user_ids), None),
+            ('get-comments-by-post', 'get-comments-by-post', 'GET', urls('/get-comments-by-post/%d/', post_ids),
+             None),
+            ('get-home-timeline', 'get-home-timeline', 'GET', urls('/get-home-timeline/%d/', user_ids), None),
+            ('search-posts', 'search-posts', 'GET', [base_url + '/search-posts/?q=lorem'], None),
+        ]
+        if options['include_writes']:
+            endpoints += [
+                ('create-post', 'create-post', 'POST', [base_url + '/create-post/'],
+                 json.dumps({'user': rng.choice(user_ids), 'title': 'Benchmark', 'content': 'Benchmark post.'})),
+                ('create-comment', 'create-comment', 'POST', [base_url + '/create-comment/'],
+                 json.dumps({'user': rng.choice(user_ids), 'post': rng.choice(post_ids),
+                             'content': 'Benchmark comment.'})),
+            ]
+        if options['endpoints']:
+            endpoints = [endpoint for endpoint in endpoints if endpoint[1] in options['endpoints']]
+
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = {result['name']: result for result in json.load(f)}
+
+        self.stdout.write('%-40s %10s %9s %9s %9s %9s %7s %7s %7s' % (
+            'endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', '429', '4xx', 'errors'))
+        results = []
+        for label, route, method, targets, body in endpoints:
+            name = '%s %s' % (method, label)
+            before = scrape_metrics(base_url)
+            load = run_load(targets, concurrency=options['concurrency'], requests=options['requests'],
+                            method=method, body=body)
+            queries = queries_per_request(before, scrape_metrics(base_url), route, method)
+
+            result = {
+                'name': name,
+                'throughput': load.throughput,
+                'p50': load.percentile(50),
+                'p95': load.percentile(95),
+                'p99': load.percentile(99),
+                'queries': queries,
+                'rejected': load.rejected,
+                'client_errors': load.client_errors,
+                'errors': load.errors,
+            }
+            results.append(result)
+            self.stdout.write('%-40s %10.1f %9.2f %9.2f %9.2f %9s %7d %7d %7d' % (
+                name, result['throughput'], result['p50'] * 1000, result['p95'] * 1000, result['p99'] * 1000,
+                '-' if queries is None else '%.1f' % queries, result['rejected'], result['client_errors'],
+                result['errors']))
+
+            previous = baseline.get(name)
+            if previous:
+                self.stdout.write('%-40s %+9.1f%% %+8.1f%% %+8.1f%% %+8.1f%%' % (
+                    '  vs baseline', self.change(previous['throughput'], result['throughput']),
+                    self.change(previous['p50'], result['p50']), self.change(previous['p95'], result['p95']),
+                    self.change(previous['p99'], result['p99'])))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    @staticmethod
+    def change(before, after):
+        return (after - before) / before * 100 if before else 0.0
@@ -0,0 +1,101 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import counters, timeline
+from api.models import Comment, Follow, Post
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+         'et dolore magna aliqua sourdough pasta cycling garden coffee travel music river mountain city').split()
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a synthetic dataset for benchmarking: N users, each following F random users and '
+        'with P posts, each with C comments from random users. Rows are written with bulk_create, '
+        'which skips signals, so posts are fanned out to timelines here and post and comment '
+        'counters are rebuilt with a reconcile at the end. All users share the password "password".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--posts-per-user', type=int, default=10)
+        parser.add_argument('--comments-per-post', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='seeduser', help='Username prefix; must not be in use yet.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible datasets.')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError('Users with prefix %r already exist; pass a different --prefix.' % prefix)
+
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        password = make_password('password')
+
+        with transaction.atomic():
+            users = User.objects.bulk_create(
+                [User(username='%s%d' % (prefix, i), email='%s%d@example.com' % (prefix, i),
+                      first_name='Seed', last_name=str(i), password=password)
+                 for i in range(options['users'])],
+                batch_size=batch_size,
+            )
+            user_ids = [user.pk for user in users]
+            self.stdout.write('%d users' % len(user_ids))
+
+            follows_per_user = min(options['follows_per_user'], len(user_ids) - 1)
+            follow_count = 0
+            for chunk in self.chunks(user_ids, max(1, batch_size // max(1, follows_per_user))):
+                follows = Follow.objects.bulk_create(
+                    [Follow(follower_id=user_id, followee_id=followee_id)
+                     for user_id in chunk for followee_id in self.others(rng, user_ids, user_id, follows_per_user)],
+                    batch_size=batch_size,
+                )
+                follow_count += len(follows)
+            self.stdout.write('%d follows' % follow_count)
+
+            post_ids = []
+            for chunk in self.chunks(user_ids, max(1, batch_size // max(1, options['posts_per_user']))):
+                posts = Post.objects.bulk_create(
+                    [Post(user_id=user_id, title=self.sentence(rng, 6), content=self.sentence(rng, 60))
+                     for user_id in chunk for _ in range(options['posts_per_user'])],
+                    batch_size=batch_size,
+                )
+                post_ids.extend(post.pk for post in posts)
+                timeline.fan_out(posts)
+            self.stdout.write('%d posts' % len(post_ids))
+
+            comment_count = 0
+            for chunk in self.chunks(post_ids, max(1, batch_size // max(1, options['comments_per_post']))):
+                comments = Comment.objects.bulk_create(
+                    [Comment(post_id=post_id, user_id=rng.choice(user_ids), content=self.sentence(rng, 15))
+                     for post_id in chunk for _ in range(options['comments_per_post'])],
+                    batch_size=batch_size,
+                )
+                comment_count += len(comments)
+            self.stdout.write('%d comments' % comment_count)
+
+        for name in (counters.POST_COUNT, counters.COMMENT_COUNT):
+            counters.reconcile(name)
+
+        self.stdout.write(self.style.SUCCESS('Seeded %d users, %d posts, %d comments.'
+                                             % (len(user_ids), len(post_ids), comment_count)))
+
+    @staticmethod
+    def chunks(items, size):
+        for i in range(0, len(items), size):
+            yield items[i:i + size]
+
+    @staticmethod
+    def others(rng, user_ids, user_id, count):
+        # One extra in case the sample includes the user themselves.
+        return [other for other in rng.sample(user_ids, min(count + 1, len(user_ids))) if other != user_id][:count]
+
+    @staticmethod
+    def sentence(rng, words):
+        return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
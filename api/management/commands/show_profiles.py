@@ -0,0 +1,60 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        'Lists the request profiles captured by ProfilingMiddleware (API_PROFILE_SAMPLE_RATE, '
+        'API_PROFILE_SLOW_SECONDS), newest first, or prints one in full: its SQL grouped by statement, '
+        'the EXPLAIN plans of the slowest queries and the cProfile summary.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('report_id', nargs='?')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--clear', action='store_true', help='Delete every stored profile.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            profiling.clear_reports()
+            self.stdout.write(self.style.SUCCESS('Cleared profiles in %s.' % profiling.get_directory()))
+            return
+        if options['report_id']:
+            report = profiling.load_report(options['report_id'])
+            if report is None:
+                raise CommandError('No profile %r in %s.' % (options['report_id'], profiling.get_directory()))
+            self.show(report)
+            return
+
+        self.stdout.write('%-22s %-19s %-7s %8s %7s %6s  %s' % ('id', 'time', 'reason', 'ms', 'queries',
+                                                                'status', 'request'))
+        for report_id in profiling.list_report_ids()[:options['limit']]:
+            report = profiling.load_report(report_id)
+            if report is None:
+                continue
+            self.stdout.write('%-22s %-19s %-7s %8.1f %7d %6d  %s %s' % (
+                report['id'], self.format_time(report['time']), report['reason'], report['seconds'] * 1000,
+                report['queries'], report['status'], report['method'], report['path']))
+
+    def show(self, report):
+        self.stdout.write('%s %s -> %d in %.1f ms (%s, route %s, %s)' % (
+            report['method'], report['path'], report['status'], report['seconds'] * 1000, report['reason'],
+            report['route'], self.format_time(report['time'])))
+        self.stdout.write('\n%d queries, %.1f ms of SQL' % (report['queries'], report['query_seconds'] * 1000))
+        for statement in report['statements']:
+            self.stdout.write('  %4dx %8.1f ms  [%s] %s' % (statement['count'], statement['seconds'] * 1000,
+                                                            statement['alias'], statement['sql']))
+        for plan in report['explains']:
+            self.stdout.write('\nEXPLAIN (%.1f ms) [%s] %s' % (plan['seconds'] * 1000, plan['alias'], plan['sql']))
+            self.stdout.write('  params: %s' % ', '.join(plan['params']))
+            for line in plan['plan']:
+                self.stdout.write('  ' + line)
+        if report['profile']:
+            self.stdout.write('\n' + report['profile'])
+
+    @staticmethod
+    def format_time(timestamp):
+        return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+
+from . import admission, cache, ingest, usernames
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """In-process request/SQL metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = Counter()
+            self.latency_buckets = {}
+            self.latency_sum = Counter()
+            self.latency_count = Counter()
+            self.queries = Counter()
+            self.query_seconds = Counter()
+
+    def observe(self, route, method, status_code, seconds, queries=None, query_seconds=None):
+        key = (route, method)
+        with self.lock:
+            self.requests[(route, method, str(status_code))] += 1
+            buckets = self.latency_buckets.setdefault(key, [0] * len(LATENCY_BUCKETS))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self.latency_sum[key] += seconds
+            self.latency_count[key] += 1
+            if queries is not None:
+                self.queries[key] += queries
+                self.query_seconds[key] += query_seconds
+
+    def render(self):
+        lines = []
+        with self.lock:
+            lines.append('# HELP api_requests_total Requests handled, by route, method and status.')
+            lines.append('# TYPE api_requests_total counter')
+            for (route, method, status_code), value in sorted(self.requests.items()):
+                lines.append('api_requests_total{route="%s",method="%s",status="%s"} %d'
+                             % (route, method, status_code, value))
+
+            lines.append('# HELP api_request_duration_seconds Request latency, by route and method.')
+            lines.append('# TYPE api_request_duration_seconds histogram')
+            for key in sorted(self.latency_buckets):
+                labels = 'route="%s",method="%s"' % key
+                for bound, value in zip(LATENCY_BUCKETS, self.latency_buckets[key]):
+                    lines.append('api_request_duration_seconds_bucket{%s,le="%s"} %d' % (labels, bound, value))
+                lines.append('api_request_duration_seconds_bucket{%s,le="+Inf"} %d'
+                             % (labels, self.latency_count[key]))
+                lines.append('api_request_duration_seconds_sum{%s} %f' % (labels, self.latency_sum[key]))
+                lines.append('api_request_duration_seconds_count{%s} %d' % (labels, self.latency_count[key]))
+
+            lines.append('# HELP api_db_queries_total SQL statements executed, by route and method.')
+            lines.append('# TYPE api_db_queries_total counter')
+            for key, value in sorted(self.queries.items()):
+                lines.append('api_db_queries_total{route="%s",method="%s"} %d' % (key + (value,)))
+
+            lines.append('# HELP api_db_query_seconds_total Time spent executing SQL, by route and method.')
+            lines.append('# TYPE api_db_query_seconds_total counter')
+            for key, value in sorted(self.query_seconds.items()):
+                lines.append('api_db_query_seconds_total{route="%s",method="%s"} %f' % (key + (value,)))
+
+        lines.append('# HELP api_object_cache_requests_total Object cache lookups, by kind and outcome.')
+        lines.append('# TYPE api_object_cache_requests_total counter')
+        for (kind, outcome), value in sorted(cache.get_stats().items()):
+            lines.append('api_object_cache_requests_total{kind="%s",outcome="%s"} %d' % (kind, outcome, value))
+
+        lines.append('# HELP api_requests_in_flight Requests being served by this process.')
+        lines.append('# TYPE api_requests_in_flight gauge')
+        lines.append('api_requests_in_flight %d' % admission.limiter.in_flight)
+        lines.append('# HELP api_shed_requests_total Requests shed by admission control, by route and reason.')
+        lines.append('# TYPE api_shed_requests_total counter')
+        for (route, reason), value in sorted(admission.get_stats().items()):
+            lines.append('api_shed_requests_total{route="%s",reason="%s"} %d' % (route, reason, value))
+
+        lines.append('# HELP api_username_checks_total Username availability checks, by outcome; '
+                     '"filtered" ones skipped the database.')
+        lines.append('# TYPE api_username_checks_total counter')
+        for outcome, value in sorted(usernames.get_stats().items()):
+            lines.append('api_username_checks_total{outcome="%s"} %d' % (outcome, value))
+
+        ingest_stats = ingest.comments.get_stats()
+        lines.append('# HELP api_comment_ingest_queue_depth Comments queued for a batched insert.')
+        lines.append('# TYPE api_comment_ingest_queue_depth gauge')
+        lines.append('api_comment_ingest_queue_depth %d' % ingest_stats.pop('depth'))
+        lines.append('# HELP api_comment_ingest_total Ingested comments, by outcome.')
+        lines.append('# TYPE api_comment_ingest_total counter')
+        for outcome, value in sorted(ingest_stats.items()):
+            lines.append('api_comment_ingest_total{outcome="%s"} %d' % (outcome, value))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class QueryRecorder:
+    """`connection.execute_wrapper` that counts and times every statement."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+def get_route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unmatched>'
+    return match.url_name or match.route
+
+
+class MetricsMiddleware:
+    """
+    Records latency, query count and SQL time for every request into `registry`.
+
+    Queries issued while a StreamingHttpResponse is being consumed happen after
+    the view returns and are not attributed to the route. Under ASGI the async
+    ORM runs queries on a worker thread the wrapper can't see, so async requests
+    only record latency.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        registry.observe(get_route(request), request.method, response.status_code,
+                         elapsed, recorder.count, recorder.seconds)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        registry.observe(get_route(request), request.method, response.status_code, time.perf_counter() - start)
+        return response
@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 12:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0006_alter_comment_user_alter_post_user_delete_user'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='api_post_user_created_idx'),
+        ),
+        # auth_user belongs to django.contrib.auth, so its keyset index for
+        # get-users pagination is created directly.
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS api_user_date_joined_idx ON auth_user (date_joined, id);',
+            reverse_sql='DROP INDEX IF EXISTS api_user_date_joined_idx;',
+        ),
+    ]
@@ -0,0 +1,82 @@
+from django.db import migrations
+
+# Post search is maintained by the database itself so that every write path
+# (ORM saves, bulk_create, raw imports) keeps it current: a weighted tsvector
+# column with a GIN index on Postgres, an external-content FTS5 table on SQLite.
+POSTGRES_FORWARD = [
+    "ALTER TABLE api_post ADD COLUMN search_vector tsvector;",
+    """
+    CREATE FUNCTION api_post_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.content, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER api_post_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, content ON api_post
+    FOR EACH ROW EXECUTE FUNCTION api_post_search_vector_update();
+    """,
+    "UPDATE api_post SET title = title;",
+    "CREATE INDEX api_post_search_idx ON api_post USING GIN (search_vector);",
+]
+
+POSTGRES_REVERSE = [
+    "DROP TRIGGER IF EXISTS api_post_search_vector_trigger ON api_post;",
+    "DROP FUNCTION IF EXISTS api_post_search_vector_update();",
+    "ALTER TABLE api_post DROP COLUMN IF EXISTS search_vector;",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE api_post_fts USING fts5(title, content, content='api_post', content_rowid='id');",
+    "INSERT INTO api_post_fts(api_post_fts) VALUES ('rebuild');",
+    """
+    CREATE TRIGGER api_post_fts_insert AFTER INSERT ON api_post BEGIN
+        INSERT INTO api_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END;
+    """,
+    """
+    CREATE TRIGGER api_post_fts_delete AFTER DELETE ON api_post BEGIN
+        INSERT INTO api_post_fts(api_post_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+    END;
+    """,
+    """
+    CREATE TRIGGER api_post_fts_update AFTER UPDATE OF title, content ON api_post BEGIN
+        INSERT INTO api_post_fts(api_post_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO api_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END;
+    """,
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS api_post_fts_insert;",
+    "DROP TRIGGER IF EXISTS api_post_fts_delete;",
+    "DROP TRIGGER IF EXISTS api_post_fts_update;",
+    "DROP TABLE IF EXISTS api_post_fts;",
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_follow_timeline'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run_for_vendor({'postgresql': POSTGRES_REVERSE, 'sqlite': SQLITE_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.db import migrations
+
+from api import partitions
+
+
+def partition(partitioned):
+    def run(apps, schema_editor):
+        # Opt-in and Postgres only; see api/partitions.py.
+        if schema_editor.connection.vendor == 'postgresql' and getattr(settings, 'API_PARTITION_BY_MONTH', False):
+            partitions.partition_tables(schema_editor.connection.alias, partitioned)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_counter_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition(True), partition(False)),
+    ]
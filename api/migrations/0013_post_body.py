@@ -0,0 +1,205 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import migrations, models
+import django.db.models.deletion
+
+post_search = import_module('api.migrations.0010_post_search')
+
+# Bodies move from api_post to api_postbody, and search moves with them: the
+# tsvector column, GIN index and FTS5 table now index api_postbody, pulling
+# the title in from api_post, and a title change re-indexes the body.
+POSTGRES_FORWARD = [
+    "ALTER TABLE api_postbody ADD COLUMN search_vector tsvector;",
+    """
+    CREATE FUNCTION api_postbody_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce((SELECT title FROM api_post WHERE id = NEW.post_id), '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.content, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER api_postbody_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF content ON api_postbody
+    FOR EACH ROW EXECUTE FUNCTION api_postbody_search_vector_update();
+    """,
+    """
+    CREATE FUNCTION api_post_title_update() RETURNS trigger AS $$
+    BEGIN
+        UPDATE api_postbody SET content = content WHERE post_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER api_post_title_trigger
+    AFTER UPDATE OF title ON api_post
+    FOR EACH ROW WHEN (OLD.title IS DISTINCT FROM NEW.title) EXECUTE FUNCTION api_post_title_update();
+    """,
+    "UPDATE api_postbody SET content = content;",
+    "CREATE INDEX api_postbody_search_idx ON api_postbody USING GIN (search_vector);",
+]
+
+POSTGRES_REVERSE = [
+    "DROP TRIGGER IF EXISTS api_post_title_trigger ON api_post;",
+    "DROP FUNCTION IF EXISTS api_post_title_update();",
+    "DROP TRIGGER IF EXISTS api_postbody_search_vector_trigger ON api_postbody;",
+    "DROP FUNCTION IF EXISTS api_postbody_search_vector_update();",
+    "ALTER TABLE api_postbody DROP COLUMN IF EXISTS search_vector;",
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIEW api_post_search AS
+    SELECT api_post.id AS id, api_post.title AS title, api_postbody.content AS content
+    FROM api_post JOIN api_postbody ON api_postbody.post_id = api_post.id;
+    """,
+    "CREATE VIRTUAL TABLE api_post_fts USING fts5(title, content, content='api_post_search', content_rowid='id');",
+    "INSERT INTO api_post_fts(api_post_fts) VALUES ('rebuild');",
+    """
+    CREATE TRIGGER api_postbody_fts_insert AFTER INSERT ON api_postbody BEGIN
+        INSERT INTO api_post_fts(rowid, title, content)
+        VALUES (new.post_id, coalesce((SELECT title FROM api_post WHERE id = new.post_id), ''), new.content);
+    END;
+    """,
+    """
+    CREATE TRIGGER api_postbody_fts_delete AFTER DELETE ON api_postbody BEGIN
+        INSERT INTO api_post_fts(api_post_fts, rowid, title, content)
+        VALUES ('delete', old.post_id, coalesce((SELECT title FROM api_post WHERE id = old.post_id), ''), old.content);
+    END;
+    """,
+    """
+    CREATE TRIGGER api_postbody_fts_update AFTER UPDATE OF content ON api_postbody BEGIN
+        INSERT INTO api_post_fts(api_post_fts, rowid, title, content)
+        VALUES ('delete', old.post_id, coalesce((SELECT title FROM api_post WHERE id = old.post_id), ''), old.content);
+        INSERT INTO api_post_fts(rowid, title, content)
+        VALUES (new.post_id, coalesce((SELECT title FROM api_post WHERE id = new.post_id), ''), new.content);
+    END;
+    """,
+    """
+    CREATE TRIGGER api_post_fts_title AFTER UPDATE OF title ON api_post BEGIN
+        INSERT INTO api_post_fts(api_post_fts, rowid, title, content)
+        SELECT 'delete', old.id, old.title, content FROM api_postbody WHERE post_id = old.id;
+        INSERT INTO api_post_fts(rowid, title, content)
+        SELECT new.id, new.title, content FROM api_postbody WHERE post_id = new.id;
+    END;
+    """,
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS api_postbody_fts_insert;",
+    "DROP TRIGGER IF EXISTS api_postbody_fts_delete;",
+    "DROP TRIGGER IF EXISTS api_postbody_fts_update;",
+    "DROP TRIGGER IF EXISTS api_post_fts_title;",
+    "DROP TABLE IF EXISTS api_post_fts;",
+    "DROP VIEW IF EXISTS api_post_search;",
+]
+
+BATCH_SIZE = 2000
+EXCERPT_LENGTH = 200
+
+
+def make_excerpt(text):
+    # A copy of api.models.make_excerpt as of this migration.
+    text = ' '.join(text.split())
+    if len(text) <= EXCERPT_LENGTH:
+        return text
+    cut = text[:EXCERPT_LENGTH - 1]
+    if text[EXCERPT_LENGTH - 1] != ' ' and ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip() + '\u2026'
+
+
+def configure_storage(apps, schema_editor):
+    """
+    Applies API_POST_BODY_COMPRESSION and API_POST_BODY_COMPRESS_THRESHOLD
+    to api_postbody. Postgres compresses (TOASTs) a body once its row passes
+    the threshold; other backends store bodies as they are.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    compression = getattr(settings, 'API_POST_BODY_COMPRESSION', None)
+    threshold = getattr(settings, 'API_POST_BODY_COMPRESS_THRESHOLD', None)
+    if compression is False:
+        schema_editor.execute('ALTER TABLE api_postbody ALTER COLUMN content SET STORAGE EXTERNAL')
+    elif compression:
+        if compression not in ('pglz', 'lz4'):
+            raise ImproperlyConfigured("API_POST_BODY_COMPRESSION must be 'pglz', 'lz4', False or None.")
+        schema_editor.execute('ALTER TABLE api_postbody ALTER COLUMN content SET COMPRESSION %s' % compression)
+    if threshold:
+        schema_editor.execute('ALTER TABLE api_postbody SET (toast_tuple_target = %d)' % threshold)
+
+
+def move_bodies(apps, schema_editor):
+    schema_editor.execute('INSERT INTO api_postbody (post_id, content) SELECT id, content FROM api_post')
+    posts = apps.get_model('api', 'Post').objects.using(schema_editor.connection.alias)
+    last = 0
+    while True:
+        rows = list(posts.filter(pk__gt=last).order_by('pk').values_list('pk', 'content')[:BATCH_SIZE])
+        if not rows:
+            break
+        posts.bulk_update([posts.model(pk=pk, excerpt=make_excerpt(content)) for pk, content in rows], ['excerpt'])
+        last = rows[-1][0]
+
+
+def restore_bodies(apps, schema_editor):
+    schema_editor.execute('UPDATE api_post SET content = coalesce('
+                          '(SELECT content FROM api_postbody WHERE post_id = api_post.id), \'\')')
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_partition_by_month'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'postgresql': post_search.POSTGRES_REVERSE, 'sqlite': post_search.SQLITE_REVERSE}),
+            # Postgres won't build the index with the backwards data copy's foreign key checks pending.
+            run_for_vendor({'postgresql': ['SET CONSTRAINTS ALL IMMEDIATE;'] + post_search.POSTGRES_FORWARD,
+                            'sqlite': post_search.SQLITE_FORWARD}),
+        ),
+        migrations.CreateModel(
+            name='PostBody',
+            fields=[
+                ('post', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE,
+                                              primary_key=True, related_name='body', serialize=False,
+                                              to='api.post')),
+                ('content', models.TextField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.RunPython(move_bodies, restore_bodies),
+        # blank=True changes nothing in the database, but lets the column be
+        # added back with '' in every row when migrating backwards.
+        migrations.AlterField(
+            model_name='post',
+            name='content',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='content',
+        ),
+        migrations.RunPython(
+            run_for_vendor({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run_for_vendor({'postgresql': POSTGRES_REVERSE, 'sqlite': SQLITE_REVERSE}),
+        ),
+        migrations.RunPython(configure_storage, migrations.RunPython.noop),
+    ]
@@ -1,20 +1,168 @@
 from django.contrib.auth.models import User, Group, Permission
-from django.db import models
+from django.db import models, router, transaction
+
+# Longest excerpt stored on a post for list views.
+EXCERPT_LENGTH = 200
+
+
+def make_excerpt(text):
+    """`text` with whitespace collapsed, cut at a word boundary to fit EXCERPT_LENGTH."""
+    text = ' '.join(text.split())
+    if len(text) <= EXCERPT_LENGTH:
+        return text
+    cut = text[:EXCERPT_LENGTH - 1]
+    if text[EXCERPT_LENGTH - 1] != ' ' and ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip() + '\u2026'
+
+
+class PostQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # Writes the bodies of the new posts too, as save() does.
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            PostBody.objects.using(self.db).bulk_create(
+                [PostBody(post_id=obj.pk, content=obj.content) for obj in objs
+                 if obj.pk is not None and obj.__dict__.pop('_body_changed', False)])
+        return objs
 
 
 class Post(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
-    content = models.TextField()
+    # Set along with `content`; list views show this instead of the body.
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='api_post_user_created_idx'),
+        ]
+
     @staticmethod
     def get_posts_by_user(user_id):
         return Post.objects.filter(user=user_id)
 
+    @property
+    def content(self):
+        """The full body, loaded from PostBody on first use unless select_related('body') fetched it."""
+        if '_content' not in self.__dict__:
+            try:
+                self._content = self.body.content if self.pk is not None else ''
+            except PostBody.DoesNotExist:
+                self._content = ''
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+        self.excerpt = make_excerpt(value)
+        self._body_changed = True
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(Post, instance=self)
+        write_body = self.__dict__.get('_body_changed', False)
+        if kwargs.get('update_fields') is not None:
+            # 'content' lives in PostBody; on api_post it stands for the excerpt.
+            update_fields = set(kwargs['update_fields'])
+            write_body = 'content' in update_fields and '_content' in self.__dict__
+            if 'content' in update_fields:
+                update_fields.remove('content')
+                update_fields.add('excerpt')
+            kwargs['update_fields'] = update_fields
+        with transaction.atomic(using=using, savepoint=False):
+            adding = self._state.adding
+            super().save(*args, **kwargs)
+            if write_body:
+                self.__dict__.pop('_body_changed', None)
+                if adding:
+                    PostBody.objects.using(self._state.db).create(post_id=self.pk, content=self._content)
+                else:
+                    PostBody.objects.using(self._state.db).update_or_create(
+                        post_id=self.pk, defaults={'content': self._content})
+
+
+class PostBody(models.Model):
+    """
+    The full text of a post, kept out of api_post so that the rows list
+    views, counts and existence checks scan stay small. Detail reads join it
+    in. Postgres compresses bodies above a size threshold (see migration
+    0013); search indexes this table rather than api_post.
+
+    There's no database foreign key, since api_post may be partitioned
+    (api/partitions.py); Django still deletes the body with its post.
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='body',
+                                db_constraint=False)
+    content = models.TextField()
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created_at', 'id'], name='api_comment_post_created_idx'),
+        ]
+
+
+class Follow(models.Model):
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
+    followee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'followee'], name='api_follow_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['followee', 'follower'], name='api_follow_followee_idx'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """A post materialized into one user's home timeline (fan-out on write)."""
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    # Copied from the post so timeline pages are a range scan of this table.
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'post'], name='api_timelineentry_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'created_at', 'post'], name='api_timeline_owner_created_idx'),
+        ]
+
+
+class PullAuthor(models.Model):
+    """
+    An author with too many followers to fan out to. Their posts are not
+    copied into timelines and are merged in when a timeline is read instead.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class CounterShard(models.Model):
+    """
+    One shard of a denormalized count (api/counters.py). A count is the sum
+    of its shards; writers pick a shard at random, so concurrent updates to a
+    busy count rarely wait on the same row.
+    """
+    name = models.CharField(max_length=32)
+    object_id = models.BigIntegerField()
+    shard = models.PositiveSmallIntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'object_id', 'shard'], name='api_countershard_unique'),
+        ]
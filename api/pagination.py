@@ -0,0 +1,215 @@
+import base64
+import heapq
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def get_query_params(request):
+    # DRF requests expose query_params; the plain Django requests that async
+    # views receive only have GET.
+    return getattr(request, 'query_params', request.GET)
+
+
+def get_value(instance, field):
+    # Pages hold model instances, or dicts when paginating a values() queryset.
+    if isinstance(instance, dict):
+        return instance[field]
+    return getattr(instance, field)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on a unique column tuple, e.g. (created_at, id).
+
+    Each page is a `WHERE (created_at, id) > (...) ORDER BY created_at, id LIMIT n`
+    range scan, so deep pages cost the same as the first one. Cursors are opaque
+    base64 tokens holding the boundary row's key and the direction of travel.
+    Prefix the ordering fields with '-' for newest-first pages.
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering = ('created_at', 'id')
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def __init__(self, ordering=None, base_url=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+        # Links point at the current request unless the page is embedded in
+        # another resource and should link to its own endpoint.
+        self.base_url = base_url
+
+    @property
+    def fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def is_descending(self, index, reverse):
+        return self.ordering[index].startswith('-') != reverse
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_querysets([queryset], request, view=view)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """
+        Paginates the merge of several querysets that share the ordering key,
+        e.g. rows from two tables. Each one is range-scanned for a page and the
+        results are merged in Python. All ordering fields must share a direction.
+        """
+        querysets = self.get_page_querysets(querysets, request)
+        return self.build_page([list(queryset) for queryset in querysets])
+
+    async def apaginate_querysets(self, querysets, request, view=None):
+        """`paginate_querysets` for async views, evaluating each page with async iteration."""
+        pages = []
+        for queryset in self.get_page_querysets(querysets, request):
+            pages.append([instance async for instance in queryset])
+        return self.build_page(pages)
+
+    def get_page_querysets(self, querysets, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+
+        reverse, position = self.cursor if self.cursor else (False, None)
+        order = [('-' if self.is_descending(i, reverse) else '') + field for i, field in enumerate(self.fields)]
+        page_querysets = []
+        for queryset in querysets:
+            if position is not None:
+                try:
+                    queryset = queryset.filter(self.get_boundary_filter(position, reverse))
+                except (ValidationError, TypeError, ValueError):
+                    raise NotFound(self.invalid_cursor_message)
+            page_querysets.append(queryset.order_by(*order)[:self.page_size + 1])
+        return page_querysets
+
+    def build_page(self, pages):
+        reverse, position = self.cursor if self.cursor else (False, None)
+        if len(pages) == 1:
+            results = pages[0]
+        else:
+            results = self.merge(pages, descending=self.is_descending(0, reverse))
+
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def merge(self, pages, descending):
+        def key(instance):
+            return tuple(get_value(instance, field) for field in self.fields)
+
+        results = []
+        seen = set()
+        for instance in heapq.merge(*pages, key=key, reverse=descending):
+            # The same key can come from more than one source; keep the first.
+            if key(instance) in seen:
+                continue
+            seen.add(key(instance))
+            results.append(instance)
+            if len(results) > self.page_size:
+                break
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(get_query_params(request)[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_boundary_filter(self, position, reverse):
+        # Expands (a, b, c) > (x, y, z) into
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        # with < in place of > for descending fields, ANDed with a redundant
+        # a >= x: the planner can't start an index range scan from the OR
+        # alone and would walk the index from its first row.
+        fields = self.fields
+        condition = Q()
+        for i, field in enumerate(fields):
+            lookup = 'lt' if self.is_descending(i, reverse) else 'gt'
+            term = Q(**{'%s__%s' % (field, lookup): position[i]})
+            for previous_field, value in zip(fields[:i], position[:i]):
+                term &= Q(**{previous_field: value})
+            condition |= term
+        if len(fields) > 1:
+            lookup = 'lte' if self.is_descending(0, reverse) else 'gte'
+            condition = Q(**{'%s__%s' % (fields[0], lookup): position[0]}) & condition
+        return condition
+
+    def get_position(self, instance):
+        position = []
+        for field in self.fields:
+            value = get_value(instance, field)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return position
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # Walked back past the first row; the next page starts from the beginning.
+            return remove_query_param(self.get_base_url(), self.cursor_query_param)
+        return self.encode_cursor(False, self.get_position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return self.encode_cursor(True, self.cursor[1])
+        return self.encode_cursor(True, self.get_position(self.page[0]))
+
+    def encode_cursor(self, reverse, position):
+        payload = json.dumps({'r': int(reverse), 'p': position}, separators=(',', ':'))
+        token = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.get_base_url(), self.cursor_query_param, token)
+
+    def get_base_url(self):
+        if not self.base_url:
+            return self.request.build_absolute_uri()
+        if self.page_size_query_param in get_query_params(self.request):
+            return replace_query_param(self.base_url, self.page_size_query_param, self.page_size)
+        return self.base_url
+
+    def decode_cursor(self, request):
+        token = get_query_params(request).get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+            reverse = bool(payload['r'])
+            position = payload['p']
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
@@ -0,0 +1,313 @@
+"""
+Monthly range partitioning of api_post and api_comment on created_at.
+
+Postgres only, and opt-in: with API_PARTITION_BY_MONTH on at migrate time,
+migration 0012 rebuilds both tables as partitioned tables with one partition
+per calendar month (UTC) plus a default partition, copying existing rows
+across. Old months can then be archived by detaching and exporting whole
+partitions (`archive_partition`, the maintain_partitions command) instead of
+running huge DELETEs, and each month's indexes stay small.
+
+Postgres requires a partitioned table's unique keys to include the partition
+key, so the primary keys become (id, created_at) and nothing can hold a
+foreign key to a partitioned api_post: the comment -> post and timeline
+entry -> post constraints are dropped. Django still cascades deletes
+through the ORM, and `archive_partition` removes the rows that pointed at
+an archived month. Later migrations that alter those two foreign keys need
+to account for the missing constraints.
+
+Partitions must exist before rows for their month arrive, or the rows land
+in the default partition; `maintain_partitions` creates
+API_PARTITION_MONTHS_AHEAD months ahead and should run at least monthly.
+
+Lookups by primary key alone can't be pruned, since the id says nothing
+about created_at on its own. `prune_by_id` recovers a created_at range from
+the id range each partition holds (ids and created_at both increase with
+insertion order), which get-post uses.
+"""
+import datetime
+import gzip
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+
+TABLES = ('api_post', 'api_comment')
+
+_bounds = {}
+_bounds_lock = threading.Lock()
+BOUNDS_TIMEOUT = 300
+
+
+def is_enabled(using='default'):
+    return (getattr(settings, 'API_PARTITION_BY_MONTH', False)
+            and connections[using].vendor == 'postgresql')
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return '%s_y%04dm%02d' % (table, month.year, month.month)
+
+
+def parse_partition_name(table, name):
+    """Returns the month a partition of `table` covers, or None for the default partition."""
+    match = re.fullmatch(re.escape(table) + r'_y(\d{4})m(\d{2})', name)
+    return datetime.date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def to_timestamp(month):
+    return month.strftime('%Y-%m-%d 00:00:00+00')
+
+
+def to_datetime(month):
+    return datetime.datetime(month.year, month.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def list_partitions(cursor, table):
+    """Returns [(name, month)] for `table`'s partitions, oldest first; month is None for the default."""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s)", [table])
+    partitions = [(name, parse_partition_name(table, name)) for name, in cursor.fetchall()]
+    return sorted(partitions, key=lambda partition: (partition[1] is None, partition[1] or datetime.date.min))
+
+
+def create_partition(cursor, table, month):
+    cursor.execute('CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)'
+                   % (partition_name(table, month), table), [to_timestamp(month), to_timestamp(add_months(month, 1))])
+
+
+def ensure_partitions(cursor, table, months_ahead, start=None):
+    """Creates the monthly partitions from `start` (default: this month) to `months_ahead` months on."""
+    this_month = month_start(datetime.datetime.now(datetime.timezone.utc))
+    month = month_start(start) if start else this_month
+    created = []
+    existing = {name for name, _ in list_partitions(cursor, table)}
+    while month <= add_months(this_month, months_ahead):
+        if partition_name(table, month) not in existing:
+            create_partition(cursor, table, month)
+            created.append(partition_name(table, month))
+        month = add_months(month, 1)
+    return created
+
+
+def get_table_ddl(cursor, table):
+    """
+    The indexes (other than the primary key), triggers and outgoing foreign
+    keys of `table`, as statements that recreate them.
+    """
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+        "AND indexname <> %s ORDER BY indexname", [table, table + '_pkey'])
+    statements = [indexdef for indexdef, in cursor.fetchall()]
+    cursor.execute(
+        "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal "
+        "ORDER BY tgname", [table])
+    statements += [triggerdef for triggerdef, in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid), confrelid::regclass::text FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype = 'f' ORDER BY conname", [table])
+    foreign_keys = cursor.fetchall()
+    return statements, foreign_keys
+
+
+def rebuild_table(cursor, table, partitioned, months_ahead=3):
+    """
+    Replaces `table` with a copy that is (or, with partitioned=False, is no
+    longer) range partitioned by month on created_at. Indexes, triggers and
+    outgoing foreign keys are recreated, except foreign keys to partitioned
+    tables; foreign keys pointing at `table` are dropped. Run it in a
+    transaction: it holds an exclusive lock on the table throughout.
+    """
+    old = table + ('_unpartitioned' if partitioned else '_partitioned')
+    statements, foreign_keys = get_table_ddl(cursor, table)
+    cursor.execute('SELECT min(created_at) FROM %s' % table)
+    oldest, = cursor.fetchone()
+
+    cursor.execute('ALTER TABLE %s RENAME TO %s' % (table, old))
+    cursor.execute('ALTER TABLE %s RENAME CONSTRAINT %s_pkey TO %s_pkey' % (old, table, old))
+    if partitioned:
+        cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING IDENTITY) '
+                       'PARTITION BY RANGE (created_at)' % (table, old))
+        # Unique keys on a partitioned table must include the partition key.
+        cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s_pkey PRIMARY KEY (id, created_at)' % (table, table))
+        ensure_partitions(cursor, table, months_ahead, start=oldest)
+        cursor.execute('CREATE TABLE %s_default PARTITION OF %s DEFAULT' % (table, table))
+    else:
+        cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING IDENTITY)' % (table, old))
+        cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s_pkey PRIMARY KEY (id)' % (table, table))
+
+    cursor.execute('INSERT INTO %s SELECT * FROM %s' % (table, old))
+    cursor.execute("SELECT setval(pg_get_serial_sequence(%%s, 'id'), coalesce(max(id), 0) + 1, false) FROM %s"
+                   % table, [table])
+    # CASCADE drops the foreign keys that pointed at the old table, and its partitions.
+    cursor.execute('DROP TABLE %s CASCADE' % old)
+
+    for statement in statements:
+        cursor.execute(statement)
+    for name, definition, referenced in foreign_keys:
+        if not is_partitioned(cursor, referenced):
+            cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (table, name, definition))
+    cursor.execute('ANALYZE %s' % table)
+    clear_bounds()
+
+
+def get_id_bounds(table, using='default'):
+    """
+    Returns [(month, min_id, max_id)] for the non-empty monthly partitions of
+    `table`, cached for BOUNDS_TIMEOUT seconds, and whether the default
+    partition holds rows. Each partition's min and max come off its primary
+    key index, all in one query.
+    """
+    key = (using, table)
+    with _bounds_lock:
+        cached = _bounds.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    bounds = []
+    default_used = False
+    with connections[using].cursor() as cursor:
+        partitions = list_partitions(cursor, table)
+        if partitions:
+            cursor.execute(' UNION ALL '.join("SELECT '%s', min(id), max(id) FROM %s" % (name, name)
+                                              for name, _ in partitions))
+            ranges = {name: (low, high) for name, low, high in cursor.fetchall()}
+        for name, month in partitions:
+            low, high = ranges[name]
+            if low is None:
+                continue
+            if month is None:
+                default_used = True
+            else:
+                bounds.append((month, low, high))
+    value = (bounds, default_used)
+    with _bounds_lock:
+        _bounds[key] = (time.monotonic() + BOUNDS_TIMEOUT, value)
+    return value
+
+
+def clear_bounds():
+    with _bounds_lock:
+        _bounds.clear()
+
+
+def prune_by_id(table, pk, using='default'):
+    """
+    Filter kwargs bounding created_at for the row with primary key `pk`, so
+    Postgres only probes the partitions that can hold it; {} when
+    partitioning is off or the id can't be placed.
+
+    Ids above the newest partition's cached maximum may belong to a month
+    that started since, so the range is left open-ended for them. It starts
+    at the oldest partition whose id range holds `pk`, if one does: rows
+    imported with a backdated created_at and a fresh id widen an old
+    partition's range past the newest one's.
+    """
+    if not is_enabled(using):
+        return {}
+    bounds, default_used = get_id_bounds(table, using)
+    if not bounds or default_used:
+        return {}
+    pk = int(pk)
+    months = [month for month, low, high in bounds if low <= pk <= high]
+    newest_month, _, newest_high = bounds[-1]
+    if pk > newest_high:
+        return {'created_at__gte': to_datetime(months[0] if months else newest_month)}
+    if not months:
+        return {}
+    return {'created_at__gte': to_datetime(months[0]), 'created_at__lt': to_datetime(add_months(months[-1], 1))}
+
+
+def export_rows(cursor, query, path):
+    """Writes the rows of `query` to `path` as gzipped CSV with a header."""
+    with gzip.open(path, 'wb') as f:
+        cursor.copy_expert('COPY (%s) TO STDOUT WITH (FORMAT csv, HEADER)' % query, f)
+
+
+def archive_partition(cursor, table, month, output_dir=None):
+    """
+    Detaches `table`'s partition for `month`, exports it to gzipped CSV in
+    `output_dir` unless that's None, and drops it. Posts are exported with
+    their bodies, which are deleted with them, and the comments from later
+    months on them are exported and deleted too, along with their timeline
+    entries and comment counters.
+
+    Returns {'rows': n, 'affected': {object id: rows}}, where `affected`
+    maps user IDs to archived posts for api_post and post IDs to archived
+    comments for api_comment, for the caller to adjust counts and caches.
+    """
+    name = partition_name(table, month)
+    # Postgres won't drop a table with deferred foreign key checks pending in the transaction.
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    cursor.execute('ALTER TABLE %s DETACH PARTITION %s' % (table, name))
+    if output_dir is not None:
+        query = 'SELECT * FROM %s' % name
+        if table == 'api_post':
+            # The same columns as export_data writes, so the archive can be imported back.
+            query = ('SELECT %s.*, api_postbody.content FROM %s LEFT JOIN api_postbody '
+                     'ON api_postbody.post_id = %s.id' % (name, name, name))
+        export_rows(cursor, query, os.path.join(output_dir, name + '.csv.gz'))
+
+    owner = 'user_id' if table == 'api_post' else 'post_id'
+    cursor.execute('SELECT %s, count(*) FROM %s GROUP BY %s' % (owner, name, owner))
+    affected = dict(cursor.fetchall())
+
+    if table == 'api_post':
+        # Comments from later months on these posts, and their timeline entries.
+        orphans = 'SELECT * FROM api_comment WHERE post_id IN (SELECT id FROM %s)' % name
+        if output_dir is not None:
+            export_rows(cursor, orphans, os.path.join(output_dir, name + '_comments.csv.gz'))
+        cursor.execute('DELETE FROM api_comment WHERE post_id IN (SELECT id FROM %s)' % name)
+        cursor.execute('DELETE FROM api_timelineentry WHERE post_id IN (SELECT id FROM %s)' % name)
+        cursor.execute('DELETE FROM api_postbody WHERE post_id IN (SELECT id FROM %s)' % name)
+        cursor.execute("DELETE FROM api_countershard WHERE name = 'comment_count' "
+                       "AND object_id IN (SELECT id FROM %s)" % name)
+
+    cursor.execute('DROP TABLE %s' % name)
+    clear_bounds()
+    return {'rows': sum(affected.values()), 'affected': affected}
+
+
+def partitions_before(cursor, table, month):
+    """Monthly partitions of `table` that end on or before `month` starts."""
+    return [partition_month for _, partition_month in list_partitions(cursor, table)
+            if partition_month is not None and add_months(partition_month, 1) <= month]
+
+
+def partition_tables(using='default', partitioned=True):
+    """Converts api_post and api_comment; used by migration 0012."""
+    months_ahead = getattr(settings, 'API_PARTITION_MONTHS_AHEAD', 3)
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        # Postgres won't alter tables with deferred foreign key checks pending in the transaction.
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        for table in (TABLES if partitioned else reversed(TABLES)):
+            if is_partitioned(cursor, table) != partitioned:
+                rebuild_table(cursor, table, partitioned, months_ahead)
+        if not partitioned:
+            # Put back the constraints Postgres couldn't enforce while api_post was partitioned.
+            for referencing in ('api_comment', 'api_timelineentry'):
+                cursor.execute(
+                    "SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f' "
+                    "AND confrelid = to_regclass('api_post')", [referencing])
+                if cursor.fetchone() is None:
+                    cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s_post_id_fk_api_post_id FOREIGN KEY (post_id) '
+                                   'REFERENCES api_post (id) DEFERRABLE INITIALLY DEFERRED'
+                                   % (referencing, referencing))
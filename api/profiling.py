@@ -0,0 +1,235 @@
+"""
+Sampled request profiling, for looking into slow endpoints after the fact.
+
+ProfilingMiddleware runs a random API_PROFILE_SAMPLE_RATE of requests under
+cProfile. With API_PROFILE_SLOW_SECONDS set, it also records the SQL of
+every request, which is cheap, so that any request slower than the
+threshold gets a report too. A slow request that wasn't sampled has no
+profile, only its SQL. One request at a time per process is profiled:
+cProfile is costly, and from Python 3.12 only one profiler can be active.
+
+A report lists the request, its statements grouped by SQL text (repeats
+show up as N+1 patterns), and the EXPLAIN plans of the
+API_PROFILE_EXPLAIN_TOP slowest SELECTs. EXPLAIN runs after the response
+is built, on the same database, without ANALYZE, so it executes nothing.
+Reports are written as JSON files to API_PROFILE_DIR, where only the newest
+API_PROFILE_KEEP are kept. Browse them at the staff-only profiles endpoint
+or with the show_profiles command.
+
+Async requests are passed through unprofiled.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .metrics import get_route
+
+_profiler_lock = threading.Lock()
+
+# Statements kept per request; the rest are only counted.
+MAX_STATEMENTS = 1000
+# Rows of the cProfile summary kept, by cumulative time.
+PROFILE_ROWS = 40
+
+
+def get_sample_rate():
+    return getattr(settings, 'API_PROFILE_SAMPLE_RATE', 0)
+
+
+def get_slow_seconds():
+    return getattr(settings, 'API_PROFILE_SLOW_SECONDS', None)
+
+
+def get_directory():
+    return getattr(settings, 'API_PROFILE_DIR', None) or os.path.join(tempfile.gettempdir(), 'api-profiles')
+
+
+class StatementRecorder:
+    """`connection.execute_wrapper` that keeps each statement with its timing."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.statements = []
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            if len(self.statements) < MAX_STATEMENTS:
+                self.statements.append((sql, params, many, time.perf_counter() - start))
+
+
+def explain(alias, sql, params):
+    """The plan for `sql` as text lines, or the error raised getting it."""
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('%s %s' % (connection.ops.explain_query_prefix(), sql), params)
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    except DatabaseError as e:
+        return ['EXPLAIN failed: %s' % e]
+
+
+def build_report(request, response, seconds, reason, recorders, profiler):
+    statements = [(recorder.alias,) + statement for recorder in recorders for statement in recorder.statements]
+
+    grouped = {}
+    for alias, sql, params, many, elapsed in statements:
+        group = grouped.setdefault((alias, sql), {'alias': alias, 'sql': sql, 'count': 0, 'seconds': 0.0})
+        group['count'] += 1
+        group['seconds'] += elapsed
+
+    explains = []
+    slowest = sorted(statements, key=lambda statement: statement[4], reverse=True)
+    for alias, sql, params, many, elapsed in slowest:
+        if len(explains) >= getattr(settings, 'API_PROFILE_EXPLAIN_TOP', 3):
+            break
+        if many or not sql.lstrip().upper().startswith('SELECT'):
+            continue
+        explains.append({'alias': alias, 'sql': sql, 'params': [str(param) for param in params or ()],
+                         'seconds': elapsed, 'plan': explain(alias, sql, params)})
+
+    report = {
+        'id': '%d-%s' % (time.time() * 1000, uuid.uuid4().hex[:8]),
+        'time': time.time(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'route': get_route(request),
+        'status': response.status_code,
+        'seconds': seconds,
+        'reason': reason,
+        'queries': sum(recorder.count for recorder in recorders),
+        'query_seconds': sum(statement[4] for statement in statements),
+        'statements': sorted(grouped.values(), key=lambda group: group['seconds'], reverse=True),
+        'explains': explains,
+        'profile': None,
+    }
+    if profiler is not None:
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_ROWS)
+        report['profile'] = out.getvalue()
+    return report
+
+
+def save_report(report):
+    """Writes `report` and drops the oldest reports beyond API_PROFILE_KEEP."""
+    directory = get_directory()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, report['id'] + '.json')
+    # Written under a temporary name, so readers never see half a report.
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False, encoding='utf-8') as f:
+        json.dump(report, f)
+    os.replace(f.name, path)
+
+    names = list_report_ids()
+    for report_id in names[getattr(settings, 'API_PROFILE_KEEP', 100):]:
+        try:
+            os.remove(os.path.join(directory, report_id + '.json'))
+        except FileNotFoundError:
+            # Another process pruned it first.
+            pass
+
+
+def list_report_ids():
+    """Report IDs, newest first."""
+    try:
+        names = os.listdir(get_directory())
+    except FileNotFoundError:
+        return []
+    ids = [name[:-len('.json')] for name in names if name.endswith('.json')]
+    return sorted(ids, key=lambda report_id: int(report_id.split('-')[0]), reverse=True)
+
+
+def load_report(report_id):
+    """The report with `report_id`, or None."""
+    if os.path.basename(report_id) != report_id:
+        return None
+    try:
+        with open(os.path.join(get_directory(), report_id + '.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def summarize(report):
+    return {key: report[key] for key in ('id', 'time', 'method', 'path', 'route', 'status', 'seconds',
+                                         'reason', 'queries', 'query_seconds')}
+
+
+def clear_reports():
+    for report_id in list_report_ids():
+        try:
+            os.remove(os.path.join(get_directory(), report_id + '.json'))
+        except FileNotFoundError:
+            pass
+
+
+class ProfilingMiddleware:
+    """
+    Profiles sampled requests and records the SQL of every request when a
+    slow threshold is set. Sits first in MIDDLEWARE, so the EXPLAINs it runs
+    aren't counted by MetricsMiddleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+
+        sampled = get_sample_rate() > 0 and random.random() < get_sample_rate()
+        slow_seconds = get_slow_seconds()
+        if not sampled and slow_seconds is None:
+            return self.get_response(request)
+
+        profiler = None
+        if sampled and _profiler_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+        recorders = []
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    recorder = StatementRecorder(connection.alias)
+                    recorders.append(recorder)
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            if profiler is not None:
+                _profiler_lock.release()
+        seconds = time.perf_counter() - start
+
+        if slow_seconds is not None and seconds >= slow_seconds:
+            reason = 'slow'
+        elif sampled:
+            reason = 'sampled'
+        else:
+            return response
+        save_report(build_report(request, response, seconds, reason, recorders, profiler))
+        return response
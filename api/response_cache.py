@@ -0,0 +1,165 @@
+"""
+Cache of fully rendered, pre-compressed list responses.
+
+Each cached page is stored as identity, gzip and (when the brotli package is
+installed) brotli bodies, so a hit is a cache lookup plus a socket write in
+whichever encoding the client accepts. A cached ETag is sent with the coding
+appended ("<hash>-gzip") on compressed bodies, since a strong validator must
+differ between content-codings. Entries are grouped into scopes
+('users', 'posts-by-user:<id>') whose generation token is replaced whenever a
+row in the scope is written, orphaning every cached page at once.
+"""
+import gzip
+import uuid
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .cache import _record, get_cache
+from .routing import PIN_COOKIE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+
+def generation_key(scope):
+    return 'api:response-generation:%s' % scope
+
+
+def get_generation(scope):
+    cache = get_cache()
+    generation = cache.get(generation_key(scope))
+    if generation is None:
+        generation = uuid.uuid4().hex
+        # add() so concurrent first requests agree on one generation.
+        if not cache.add(generation_key(scope), generation, None):
+            generation = cache.get(generation_key(scope), generation)
+    return generation
+
+
+def invalidate(scope):
+    get_cache().set(generation_key(scope), uuid.uuid4().hex, None)
+
+
+def entry_key(request, scope):
+    return 'api:response:%s:%s:%s' % (scope, get_generation(scope), request.get_full_path())
+
+
+def is_cacheable(request):
+    # Only the plain compact JSON rendering is cached, not the browsable API or indented JSON.
+    renderer = getattr(request, 'accepted_renderer', None)
+    media_type = getattr(request, 'accepted_media_type', '') or ''
+    return (request.method == 'GET' and renderer is not None and renderer.format == 'json'
+            and 'indent' not in media_type)
+
+
+def parse_accept_encoding(header):
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+    return accepted
+
+
+def available_codings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(request, codings):
+    accepted = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    for coding in ('br', 'gzip'):
+        if coding in codings and accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return 'identity'
+
+
+def encoded_etag(etag, coding):
+    if coding == 'identity':
+        return etag
+    return '%s-%s"' % (etag[:-1], coding)
+
+
+def etag_for(request, etag):
+    """
+    The ETag `store` sends this request for a page whose uncompressed body
+    has `etag`; compare If-None-Match against it on a cache miss.
+    """
+    if not is_cacheable(request):
+        return etag
+    return encoded_etag(etag, choose_encoding(request, available_codings()))
+
+
+def build_response(request, entry):
+    coding = choose_encoding(request, [coding for coding in ('br', 'gzip') if entry.get(coding) is not None])
+    response = HttpResponse(entry[coding], status=200, content_type=entry['content_type'])
+    if coding != 'identity':
+        response['Content-Encoding'] = coding
+    response['Content-Length'] = str(len(entry[coding]))
+    for header, value in entry['headers'].items():
+        response[header] = encoded_etag(value, coding) if header == 'ETag' else value
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+def get(request, scope):
+    """
+    Returns the cached response for this request, or None. Clients pinned to
+    the primary after a write always miss, so they see their own writes even
+    if a replica-rendered page was cached just before the invalidation.
+    """
+    if not is_cacheable(request):
+        return None
+    # The key is fixed here, before the view reads anything, and reused by
+    # store(): a page rendered from rows read before an invalidation is then
+    # filed under the old generation, where nothing will look it up.
+    key = entry_key(request, scope)
+    if not hasattr(request, 'response_cache_keys'):
+        request.response_cache_keys = {}
+    request.response_cache_keys[scope] = key
+    if PIN_COOKIE in request.COOKIES:
+        return None
+    entry = get_cache().get(key)
+    if entry is None:
+        _record('response', 'miss')
+        return None
+    _record('response', 'hit')
+    return build_response(request, entry)
+
+
+def store(request, scope, view, response, headers=None):
+    """
+    Renders and compresses `response` (a DRF Response), caches it under the
+    key `get()` chose for this request, and returns the compressed
+    equivalent for the current request.
+    """
+    key = getattr(request, 'response_cache_keys', {}).get(scope)
+    if key is None or not is_cacheable(request) or response.status_code != 200:
+        return response
+
+    renderer = request.accepted_renderer
+    body = renderer.render(response.data, request.accepted_media_type, view.get_renderer_context())
+    content_type = '%s; charset=%s' % (renderer.media_type, renderer.charset) if renderer.charset \
+        else renderer.media_type
+    entry = {
+        'content_type': content_type,
+        'headers': dict(headers or {}),
+        'identity': body,
+        'gzip': gzip.compress(body, compresslevel=GZIP_LEVEL),
+        'br': brotli.compress(body, quality=BROTLI_QUALITY) if brotli is not None else None,
+    }
+    get_cache().set(key, entry, getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', 60))
+    return build_response(request, entry)
@@ -0,0 +1,114 @@
+import itertools
+import threading
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# True while handling a read-only request that may be served from a replica.
+_use_replica = ContextVar('api_use_replica', default=False)
+# True while handling a read from a client pinned to the primary after a write.
+_pinned = ContextVar('api_pinned', default=False)
+
+_cycle = None
+_cycle_replicas = None
+_cycle_lock = threading.Lock()
+
+PIN_COOKIE = 'api_pin_primary'
+
+
+def get_replicas():
+    return list(getattr(settings, 'API_READ_REPLICAS', []))
+
+
+def is_pinned():
+    """
+    True while serving a client that wrote recently. Its reads skip anything
+    that may have been filled from a lagging replica, such as the object cache.
+    """
+    return _pinned.get()
+
+
+def next_replica():
+    """Round-robins over API_READ_REPLICAS."""
+    global _cycle, _cycle_replicas
+    replicas = get_replicas()
+    with _cycle_lock:
+        if replicas != _cycle_replicas:
+            _cycle = itertools.cycle(replicas)
+            _cycle_replicas = replicas
+        return next(_cycle)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to a replica while ReplicaRoutingMiddleware has marked the
+    request as replica-safe, and everything else to the primary. Code running
+    outside a request (management commands, signal handlers during writes)
+    always uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and get_replicas():
+            return next_replica()
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Marks GET and HEAD requests as readable from a replica, unless the client
+    wrote recently. Any other request is a write: it is served from the
+    primary and sets a short-lived cookie that pins the client's following
+    reads to the primary for API_REPLICA_PIN_SECONDS, so users see their own
+    new posts before replication catches up.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tokens = self.enter(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.exit(tokens)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        tokens = self.enter(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.exit(tokens)
+        return self.process_response(request, response)
+
+    def enter(self, request):
+        pinned = PIN_COOKIE in request.COOKIES and bool(get_replicas())
+        return (_use_replica.set(self.can_use_replica(request)),
+                _pinned.set(pinned and request.method in ('GET', 'HEAD')))
+
+    def exit(self, tokens):
+        _use_replica.reset(tokens[0])
+        _pinned.reset(tokens[1])
+
+    def can_use_replica(self, request):
+        return request.method in ('GET', 'HEAD') and PIN_COOKIE not in request.COOKIES
+
+    def process_response(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and get_replicas():
+            response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'API_REPLICA_PIN_SECONDS', 5),
+                                httponly=True, samesite='Lax')
+        return response
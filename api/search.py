@@ -0,0 +1,47 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+POSTGRES_QUERY = "websearch_to_tsquery('english', %s)"
+
+
+def to_fts5_query(text):
+    # Quote every term so user input can't use FTS5 operators or break the syntax.
+    terms = re.findall(r'\w+', text)
+    return ' '.join('"%s"' % term for term in terms)
+
+
+def search_posts(text):
+    """
+    Posts matching `text`, annotated with a `rank` where higher is better.
+
+    Uses the tsvector column and GIN index on api_postbody (migration 0013)
+    on Postgres and the FTS5 table on SQLite; other backends fall back to an
+    unranked substring match.
+    """
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        return Post.objects.annotate(
+            # Cast to float8 so the rank survives the round trip through a cursor exactly.
+            rank=RawSQL('SELECT ts_rank(search_vector, ' + POSTGRES_QUERY + ')::float8 FROM api_postbody '
+                        'WHERE api_postbody.post_id = api_post.id', [text], output_field=FloatField()),
+        ).filter(id__in=RawSQL('SELECT post_id FROM api_postbody WHERE search_vector @@ ' + POSTGRES_QUERY,
+                               [text]))
+
+    if vendor == 'sqlite':
+        query = to_fts5_query(text)
+        if not query:
+            return Post.objects.none()
+        return Post.objects.annotate(
+            # bm25() is lower for better matches; weight titles twice as heavily as bodies.
+            rank=RawSQL('SELECT -bm25(api_post_fts, 2.0, 1.0) FROM api_post_fts '
+                        'WHERE api_post_fts MATCH %s AND api_post_fts.rowid = api_post.id', [query],
+                        output_field=FloatField()),
+        ).filter(id__in=RawSQL('SELECT rowid FROM api_post_fts WHERE api_post_fts MATCH %s', [query]))
+
+    return Post.objects.filter(Q(title__icontains=text) | Q(body__content__icontains=text)).annotate(
+        rank=Value(0.0, output_field=FloatField()))
@@ -1,29 +1,42 @@
+from django.contrib.auth.validators import UnicodeUsernameValidator
 from rest_framework import serializers
-from .models import User, Post, Comment
+from . import hashing
+from .fieldsets import SparseFieldsMixin
+from .models import User, Post, Comment, Follow
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'password']
         extra_kwargs = {
-            'password': {'write_only': True}
+            'password': {'write_only': True},
+            # No UniqueValidator query: CreateUserView checks through api/usernames.py
+            # and the database's unique constraint catches the rest.
+            'username': {'validators': [UnicodeUsernameValidator()]},
         }
 
     def create(self, validated_data):
         # pass the password as plaintext so Django can hash it
         password = validated_data.pop('password')
 
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data.get('email'),
+        # Same as User.objects.create_user, but the hash is computed on the
+        # bounded hashing pool (may raise hashing.HashingBusy).
+        user = User(
+            username=User.normalize_username(validated_data['username']),
+            email=User.objects.normalize_email(validated_data.get('email')),
             first_name=validated_data['first_name'],
             last_name=validated_data['last_name'],
-            password=password
+            password=hashing.hash_password(password)
         )
+        user.save()
         return user
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Post.content is a property backed by PostBody; to read it without a
+    # query per post, fetch posts with select_related('body').
+    content = serializers.CharField()
+
     class Meta:
         model = Post
         fields = ['id', 'title', 'content', 'user', 'created_at']
@@ -33,10 +46,73 @@ class PostSerializer(serializers.ModelSerializer):
         return Post.objects.create(**validated_data)
 
 
+class PostListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Posts in lists, which carry the stored excerpt instead of the body."""
+
+    class Meta:
+        model = Post
+        fields = ['id', 'title', 'excerpt', 'user', 'created_at']
+
+
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = ['id', 'content', 'user', 'post', 'created_at']
         read_only_fields = ['created_at']
     def create(self, validated_data):
-        return Comment.objects.create(**validated_data)
\ No newline at end of file
+        return Comment.objects.create(**validated_data)
+
+
+class AuthorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name']
+
+
+class CommentWithAuthorSerializer(CommentSerializer):
+    # Expects the queryset to use select_related('user').
+    author = AuthorSerializer(source='user', read_only=True)
+
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['author']
+
+
+class PostDetailSerializer(PostSerializer):
+    author = AuthorSerializer(source='user', read_only=True)
+
+    class Meta(PostSerializer.Meta):
+        fields = PostSerializer.Meta.fields + ['author']
+
+
+class BulkPostSerializer(serializers.ModelSerializer):
+    # Plain integer so validating a batch doesn't fetch each user; the view
+    # checks all referenced IDs with a single query.
+    user = serializers.IntegerField(source='user_id')
+    content = serializers.CharField()
+
+    class Meta:
+        model = Post
+        fields = ['id', 'title', 'content', 'user', 'created_at']
+        read_only_fields = ['created_at']
+
+
+class BulkCommentSerializer(serializers.ModelSerializer):
+    user = serializers.IntegerField(source='user_id')
+    post = serializers.IntegerField(source='post_id')
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'content', 'user', 'post', 'created_at']
+        read_only_fields = ['created_at']
+
+
+class FollowSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Follow
+        fields = ['id', 'follower', 'followee', 'created_at']
+        read_only_fields = ['created_at']
+
+    def validate(self, data):
+        if data['follower'] == data['followee']:
+            raise serializers.ValidationError({'followee': 'Users cannot follow themselves.'})
+        return data
@@ -8,7 +8,22 @@ DATABASES = {
         'PASSWORD': 'testpassword',
         'HOST': 'localhost',
         'PORT': '5432',
-    }
+    },
+    # Stands in for a read replica in the routing tests, which enable it with
+    # override_settings(API_READ_REPLICAS=['replica']). As a test mirror it is
+    # a second connection to the default test database, so replica reads see
+    # the same (committed) rows.
+    'replica': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': 'test_social_db',
+        'USER': 'test_admin',
+        'PASSWORD': 'testpassword',
+        'HOST': 'localhost',
+        'PORT': '5432',
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
 
 DEBUG = True
@@ -0,0 +1,83 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import cache, counters, response_cache, timeline, usernames
+from .models import Comment, Post
+
+
+def after_commit(using, func, *args):
+    # Cache entries are dropped once the write commits. Dropped any earlier, a
+    # concurrent read could cache the old row (or a 404) again before the new
+    # one is visible, and that entry would outlive the write until it expired.
+    transaction.on_commit(lambda: func(*args), using=using)
+
+
+def drop_user(pk):
+    cache.invalidate('user', pk)
+    response_cache.invalidate('users')
+    response_cache.invalidate('posts-by-user:%s' % pk)
+
+
+def drop_post(pk, user_id):
+    cache.invalidate('post', pk)
+    response_cache.invalidate('posts-by-user:%s' % user_id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user(sender, instance, using, **kwargs):
+    after_commit(using, drop_user, instance.pk)
+
+
+@receiver(post_save, sender=User)
+def remember_username(sender, instance, **kwargs):
+    usernames.taken.add(instance.username)
+
+
+@receiver([post_save, post_delete], sender=Post)
+def invalidate_post(sender, instance, using, **kwargs):
+    after_commit(using, drop_post, instance.pk, instance.user_id)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out([instance])
+
+
+def deleted_with(origin, model):
+    """True if the delete cascaded from deleting `model` rows."""
+    return isinstance(origin, model) or getattr(origin, 'model', None) is model
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(counters.POST_COUNT, instance.user_id)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, origin=None, **kwargs):
+    # The author's count goes with the author.
+    if not deleted_with(origin, User):
+        counters.increment(counters.POST_COUNT, instance.user_id, -1)
+    counters.delete(counters.COMMENT_COUNT, [instance.pk])
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(counters.COMMENT_COUNT, instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, origin=None, **kwargs):
+    # The post's count goes with the post.
+    if not deleted_with(origin, Post):
+        counters.increment(counters.COMMENT_COUNT, instance.post_id, -1)
+
+
+@receiver(post_delete, sender=User)
+def delete_user_counts(sender, instance, **kwargs):
+    counters.delete(counters.POST_COUNT, [instance.pk])
@@ -0,0 +1,55 @@
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Lets DRF content negotiation accept `Accept: application/x-ndjson` and
+    `?format=ndjson`. Views check for it and hand back a streaming response.
+    """
+    media_type = NDJSON_MEDIA_TYPE
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only reached for non-streaming responses such as errors.
+        if data is None:
+            return b''
+        return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+STREAMING_RENDERER_CLASSES = list(api_settings.DEFAULT_RENDERER_CLASSES) + [NDJSONRenderer]
+
+
+def wants_stream(request):
+    if request.query_params.get('stream') in ('1', 'true'):
+        return True
+    renderer = getattr(request, 'accepted_renderer', None)
+    return isinstance(renderer, NDJSONRenderer)
+
+
+def stream_ndjson(queryset, serializer_class, chunk_size=2000, fields=None):
+    """
+    Serializes `queryset` one row at a time as newline-delimited JSON,
+    limited to a sparse fieldset if `fields` is given.
+
+    Rows are read with `iterator()`, which uses a server-side cursor on
+    Postgres, so memory stays flat however many rows are returned. The
+    database is chosen now: the rows are read after the view returns, once
+    ReplicaRoutingMiddleware has stopped routing the request's reads.
+    """
+    queryset = queryset.using(queryset.db)
+    serializer = serializer_class(many=True, fields=fields).child
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def rows():
+        for instance in queryset.iterator(chunk_size=chunk_size):
+            yield encoder.encode(serializer.to_representation(instance)) + '\n'
+
+    return StreamingHttpResponse(rows(), content_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,27 @@
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin for holding endpoints to a maximum number of SQL queries.
+
+    Subclasses set `query_budgets` to a {url name: max queries} mapping and wrap
+    requests in `assertQueryBudget(name)`; going over budget fails the test and
+    lists the statements that ran.
+    """
+    query_budgets = {}
+
+    @contextmanager
+    def assertQueryBudget(self, url_name):
+        budget = self.query_budgets[url_name]
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            statements = '\n'.join(
+                '%d. %s' % (i, query['sql']) for i, query in enumerate(context.captured_queries, start=1)
+            )
+            self.fail('%s ran %d queries, budget is %d:\n%s' % (url_name, executed, budget, statements))
@@ -1,10 +1,35 @@
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from unittest import mock
+import datetime
+import gzip
+import http.server
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from api import (admission, benchmark, cache, counters, hashing, ingest, loaders, partitions, profiling,
+                 response_cache, usernames, views)
+from api.models import (EXCERPT_LENGTH, Comment, CounterShard, Follow, Post, PostBody, PostQuerySet, PullAuthor,
+                        make_excerpt)
+from api.pagination import KeysetPagination
+from api.serializers import PostListSerializer, PostSerializer, UserSerializer
+from api.testing import QueryBudgetMixin
 
 
 class UserTests(APITestCase):
     def setUp(self):
+        cache.get_cache().clear()
         self.url = reverse('create-user')
         self.data = {
             'username': 'testuser',
@@ -37,6 +62,36 @@ class UserTests(APITestCase):
         self.assertEqual(test_response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(test_response.data['username'], 'A user with that username already exists.')
 
+    def test_create_user_hashing_busy(self):
+        data = dict(self.data, username='busyuser')
+        with mock.patch('api.hashing.hash_password', side_effect=hashing.HashingBusy):
+            response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(User.objects.filter(username='busyuser').exists())
+
+    def test_created_user_password_hashed(self):
+        user = User.objects.get(username=self.data['username'])
+        self.assertTrue(user.check_password(self.data['password']))
+
+    def test_import_users_command(self):
+        rows = [
+            {'username': 'imported%d' % i, 'email': 'Imported%d@TEST.com' % i, 'password': 'pw%d' % i,
+             'first_name': 'first', 'last_name': 'last'}
+            for i in range(3)
+        ] + [dict(self.data)]
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as f:
+            f.write('\n'.join(json.dumps(row) for row in rows))
+        self.addCleanup(os.remove, f.name)
+
+        call_command('import_users', f.name, workers=1, batch_size=2, stdout=io.StringIO())
+
+        self.assertEqual(User.objects.filter(username__startswith='imported').count(), 3)
+        imported = User.objects.get(username='imported1')
+        self.assertEqual(imported.email, 'Imported1@test.com')
+        self.assertTrue(imported.check_password('pw1'))
+
     def test_create_blank_username(self):
         url = reverse('create-user')
 
@@ -60,6 +115,12 @@ class UserTests(APITestCase):
         self.assertEqual(get_response.status_code, status.HTTP_200_OK)
         self.assertEqual(get_response.data.get('username'), self.post_response.data.get('username'))
 
+    def test_get_user_conditional(self):
+        get_url = reverse('get-user', kwargs={'id': self.post_response.data['id']})
+        etag = self.client.get(get_url, format='json')['ETag']
+        get_response = self.client.get(get_url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(get_response.status_code, status.HTTP_304_NOT_MODIFIED)
+
     def test_get_user_doesnt_exist(self):
         get_url = reverse('get-user', args=[5])
         get_response = self.client.get(get_url, format='json')
@@ -80,13 +141,95 @@ class UserTests(APITestCase):
         get_response = self.client.get(get_all_url, format='json')
         self.assertEqual(get_response.status_code, status.HTTP_200_OK)
 
-        usernames = [user['username'] for user in get_response.data]
+        usernames = [user['username'] for user in get_response.json()['results']]
         self.assertIn('testuser', usernames)
         self.assertIn('testuser2', usernames)
 
+    def test_get_users_stream(self):
+        get_all_url = reverse('get-users')
+        get_response = self.client.get(get_all_url, {'stream': 1})
+        self.assertEqual(get_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_response['Content-Type'], 'application/x-ndjson')
+
+        lines = b''.join(get_response.streaming_content).decode('utf-8').splitlines()
+        users = [json.loads(line) for line in lines]
+        self.assertEqual([user['username'] for user in users], ['testuser'])
+        self.assertNotIn('password', users[0])
+
+
+class UsernameTests(APITestCase):
+    def setUp(self):
+        usernames.taken.reset()
+        self.user = User.objects.create_user(username='taken', password='testpassword')
+        self.url = reverse('username-available')
+
+    def test_bloom_filter(self):
+        bloom = usernames.BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add('user%d' % i)
+        self.assertTrue(all('user%d' % i in bloom for i in range(1000)))
+        false_positives = sum('other%d' % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_username_available(self):
+        response = self.client.get(self.url, {'username': 'taken'}, format='json')
+        self.assertEqual(response.json(), {'username': 'taken', 'available': False})
+
+        usernames.taken.get_filter()
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'username': 'free'}, format='json')
+        self.assertEqual(response.json(), {'username': 'free', 'available': True})
+
+        for bad in ('', 'no spaces'):
+            response = self.client.get(self.url, {'username': bad}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_new_users_added(self):
+        usernames.taken.get_filter()
+        User.objects.create_user(username='newcomer', password='testpassword')
+        self.assertTrue(usernames.is_taken('newcomer'))
+
+        # bulk_create sends no signals; the refresh finds the user by ID.
+        User.objects.bulk_create([User(username='bulk', password='!')])
+        self.assertFalse(usernames.is_taken('bulk'))
+        with override_settings(API_USERNAME_FILTER_REFRESH=0):
+            self.assertTrue(usernames.is_taken('bulk'))
+
+    def test_checks_go_to_database_while_filter_loads(self):
+        # Another caller is building the filter; this one doesn't wait for it.
+        usernames.taken.loading = True
+        self.addCleanup(setattr, usernames.taken, 'loading', False)
+        with self.assertNumQueries(1):
+            self.assertTrue(usernames.is_taken('taken'))
+        self.assertIsNone(usernames.taken.filter)
+
+    def test_names_added_during_rebuild_kept(self):
+        read = usernames.TakenUsernames.read
+
+        def read_and_add(queryset):
+            # Runs without the lock held, or add() would block here.
+            usernames.taken.add('midbuild')
+            return read(queryset)
+
+        with mock.patch.object(usernames.TakenUsernames, 'read', staticmethod(read_and_add)):
+            usernames.taken.get_filter()
+        self.assertIn('midbuild', usernames.taken.filter)
+        self.assertIn('taken', usernames.taken.filter)
+
+    def test_signup_missed_by_filter_fails_on_constraint(self):
+        usernames.taken.get_filter()
+        User.objects.bulk_create([User(username='ghost', password='!')])
+        data = {'username': 'ghost', 'email': 'ghost@test.com', 'password': 'testpassword',
+                'first_name': 'first', 'last_name': 'last'}
+        response = self.client.post(reverse('create-user'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['username'], 'A user with that username already exists.')
+        self.assertEqual(User.objects.filter(username='ghost').count(), 1)
+
 
 class PostTests(APITestCase):
     def setUp(self):
+        cache.get_cache().clear()
         self.user_url = reverse('create-user')
         self.post_url = reverse('create-post')
 
@@ -178,17 +321,107 @@ class PostTests(APITestCase):
 
         self.assertEqual(get_response.status_code, status.HTTP_200_OK)
 
-        response_data = get_response.json()
+        response_data = get_response.json()['results']
         self.assertEqual(len(response_data), 2)
 
         for i in range(len(response_data)):
             self.assertEqual(response_data[i]['title'], post_data_list[i]['title'])
-            self.assertEqual(response_data[i]['content'], post_data_list[i]['content'])
+            self.assertEqual(response_data[i]['excerpt'], post_data_list[i]['content'])
             self.assertEqual(response_data[i]['user'], post_data_list[i]['user'])
 
+    def test_get_posts_by_user_paginated(self):
+        for i in range(4):
+            post_data = {
+                'title': 'Paged Post %d' % i,
+                'content': 'Paged content.',
+                'user': self.user_id
+            }
+            response = self.client.post(self.post_url, post_data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        get_url = reverse('get-posts-by-user', kwargs={'user_id': self.user_id})
+        first_page = self.client.get(get_url, {'page_size': 2}, format='json').json()
+        self.assertEqual(len(first_page['results']), 2)
+        self.assertIsNone(first_page['previous'])
+        self.assertIsNotNone(first_page['next'])
+
+        titles = [post['title'] for post in first_page['results']]
+        next_url = first_page['next']
+        while next_url:
+            page = self.client.get(next_url, format='json').json()
+            titles.extend(post['title'] for post in page['results'])
+            next_url = page['next']
+
+        self.assertEqual(titles, ['Test Post Title'] + ['Paged Post %d' % i for i in range(4)])
+
+        last_page = page
+        previous_page = self.client.get(last_page['previous'], format='json').json()
+        self.assertEqual([post['title'] for post in previous_page['results']], ['Paged Post 1', 'Paged Post 2'])
+
+    def test_get_posts_by_user_stream_accept_header(self):
+        get_url = reverse('get-posts-by-user', kwargs={'user_id': self.user_id})
+        get_response = self.client.get(get_url, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(get_response.status_code, status.HTTP_200_OK)
+
+        lines = b''.join(get_response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 1)
+        expected = dict(self.post_response.data, excerpt=self.post_response.data['content'])
+        del expected['content']
+        self.assertEqual(json.loads(lines[0]), expected)
+
+    def test_get_post_conditional(self):
+        get_url = reverse('get-post', kwargs={'id': self.post_response.data['id']})
+        response = self.client.get(get_url, format='json')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        not_modified = self.client.get(get_url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], etag)
+
+        post = Post.objects.get(id=self.post_response.data['id'])
+        post.title = 'Edited Title'
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        modified = self.client.get(get_url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(modified['ETag'], etag)
+
+    def test_get_posts_by_user_conditional(self):
+        get_url = reverse('get-posts-by-user', kwargs={'user_id': self.user_id})
+        etag = self.client.get(get_url, format='json')['ETag']
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(get_url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        paged = self.client.get(get_url, {'page_size': 1}, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(paged.status_code, status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.post_url, dict(self.post_data, title='Newer Post'), format='json')
+        modified = self.client.get(get_url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+
+    def test_get_posts_by_user_invalid_cursor(self):
+        get_url = reverse('get-posts-by-user', kwargs={'user_id': self.user_id})
+        get_response = self.client.get(get_url, {'cursor': 'not-a-cursor'}, format='json')
+        self.assertEqual(get_response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_keyset_boundary_leads_with_range_predicate(self):
+        position = ['2024-01-01T00:00:00+00:00', 10]
+        for ordering, reverse, operator in [(('created_at', 'id'), False, '>='),
+                                            (('-created_at', '-id'), False, '<='),
+                                            (('-created_at', '-id'), True, '>=')]:
+            boundary = KeysetPagination(ordering=ordering).get_boundary_filter(position, reverse)
+            sql = str(Post.objects.filter(boundary).query)
+            where = sql[sql.index(' WHERE '):]
+            # The range predicate comes first, outside the OR, so the index scan can start from it.
+            self.assertRegex(where, r'^ WHERE \("api_post"\."created_at" %s ' % operator)
 
 class CommentTests(APITestCase):
     def setUp(self):
+        cache.get_cache().clear()
         user_url = reverse('create-user')
         post_url = reverse('create-post')
         comment_url = reverse('create-comment')
@@ -234,3 +467,1277 @@ class CommentTests(APITestCase):
 
         created_at = self.comment_response.data.get('created_at')
         self.assertIsNotNone(created_at, "'created_at' not found.")
+
+    def test_get_post_with_comments(self):
+        other_user = User.objects.create_user(username='otheruser', email='other@test.com', password='testpassword')
+        comments = [
+            {'content': 'Comment %d' % i, 'user': [self.user_id, other_user.id][i % 2], 'post': self.post_id}
+            for i in range(10)
+        ]
+        self.client.post(reverse('create-comments'), comments, format='json')
+
+        get_url = reverse('get-post', kwargs={'id': self.post_id})
+        with self.assertNumQueries(2):
+            response = self.client.get(get_url, {'include': 'comments', 'page_size': 5}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['author']['username'], 'testuser')
+        page = response.data['comments']
+        self.assertEqual([comment['content'] for comment in page['results']],
+                         ['This is a test comment.'] + ['Comment %d' % i for i in range(4)])
+        self.assertEqual(page['results'][2]['author']['username'], 'otheruser')
+        self.assertIn(reverse('get-comments-by-post', kwargs={'post_id': self.post_id}), page['next'])
+
+        with self.assertNumQueries(1):
+            next_page = self.client.get(page['next'], format='json')
+        self.assertEqual([comment['content'] for comment in next_page.data['results']],
+                         ['Comment %d' % i for i in range(4, 9)])
+
+    def test_get_post_with_comments_not_found(self):
+        get_url = reverse('get-post', kwargs={'id': self.post_id + 1000})
+        response = self.client.get(get_url, {'include': 'comments'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(API_COUNTER_SHARDS={'comment_count': 1})
+    def test_create_comments_batch(self):
+        comments = [
+            {'content': 'Batch comment %d' % i, 'user': self.user_id, 'post': self.post_id}
+            for i in range(20)
+        ]
+        counters.increment(counters.COMMENT_COUNT, self.post_id, 0)
+        # One IN query per relation, a savepoint pair, a single INSERT and one
+        # UPDATE of the post's (now existing) comment counter shard.
+        with self.assertNumQueries(6):
+            response = self.client.post(reverse('create-comments'), comments, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['created']), 20)
+        self.assertEqual(response.data['errors'], [])
+        self.assertEqual(Comment.objects.filter(post=self.post_id).count(), 21)
+
+    def test_create_comments_batch_partial(self):
+        comments = [
+            {'content': 'Valid comment', 'user': self.user_id, 'post': self.post_id},
+            {'content': 'Bad post', 'user': self.user_id, 'post': self.post_id + 1000},
+            {'user': self.user_id, 'post': self.post_id},
+        ]
+        response = self.client.post(reverse('create-comments'), comments, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([comment['content'] for comment in response.data['created']], ['Valid comment'])
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertEqual(response.data['errors'][0]['errors'], {'post': 'Invalid post ID.'})
+        self.assertIn('content', response.data['errors'][1]['errors'])
+
+    def test_create_posts_batch_invalid_user(self):
+        posts = [{'title': 'Title', 'content': 'Content', 'user': self.user_id + 1000}]
+        response = self.client.post(reverse('create-posts'), posts, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'][0]['errors'], {'user': 'Invalid user ID.'})
+
+    def test_create_posts_batch_related_row_deleted(self):
+        posts = [{'title': 'Title', 'content': 'Content', 'user': self.user_id}, {'title': 'No content'}]
+        # The author is deleted between the ID check and the insert.
+        with mock.patch.object(PostQuerySet, 'bulk_create', side_effect=IntegrityError):
+            response = self.client.post(reverse('create-posts'), posts, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['created'], [])
+        self.assertEqual([error['index'] for error in response.data['errors']], [0, 1])
+        self.assertEqual(response.data['errors'][0]['errors'], {'non_field_errors': [views.RELATED_ROW_DELETED]})
+
+    def test_create_posts_batch_not_a_list(self):
+        response = self.client.post(reverse('create-posts'), {'title': 'Title'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ObjectCacheTests(APITestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+
+        user_data = {
+            'username': 'testuser',
+            'email': 'test@test.com',
+            'password': 'testpassword',
+            'first_name': 'testfirst',
+            'last_name': 'testlast'
+        }
+        user_response = self.client.post(reverse('create-user'), user_data, format='json')
+        self.assertEqual(user_response.status_code, status.HTTP_201_CREATED)
+        self.user_id = user_response.data['id']
+
+        post_data = {
+            'title': 'Test Post Title',
+            'content': 'This is the content of the test post.',
+            'user': self.user_id
+        }
+        post_response = self.client.post(reverse('create-post'), post_data, format='json')
+        self.assertEqual(post_response.status_code, status.HTTP_201_CREATED)
+        self.post_id = post_response.data['id']
+
+    def test_get_post_cached(self):
+        get_url = reverse('get-post', kwargs={'id': self.post_id})
+        first_response = self.client.get(get_url, format='json')
+
+        with self.assertNumQueries(0):
+            second_response = self.client.get(get_url, format='json')
+
+        self.assertEqual(second_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(second_response.data, first_response.data)
+
+    def test_get_user_invalidated_on_save(self):
+        get_url = reverse('get-user', kwargs={'id': self.user_id})
+        self.client.get(get_url, format='json')
+
+        user = User.objects.get(id=self.user_id)
+        user.first_name = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+        get_response = self.client.get(get_url, format='json')
+        self.assertEqual(get_response.data['first_name'], 'renamed')
+
+    def test_invalidation_waits_for_commit(self):
+        get_url = reverse('get-user', kwargs={'id': self.user_id})
+        self.client.get(get_url, format='json')
+        key = cache.cache_key('user', self.user_id)
+
+        user = User.objects.get(id=self.user_id)
+        user.first_name = 'renamed'
+        with self.captureOnCommitCallbacks() as callbacks:
+            user.save()
+        # Until the write commits, readers still see the old row, and so does the cache.
+        self.assertIsNotNone(cache.get_cache().get(key))
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(cache.get_cache().get(key), cache.INVALIDATED)
+        self.assertEqual(self.client.get(get_url, format='json').data['first_name'], 'renamed')
+
+    def test_load_racing_invalidation_not_cached(self):
+        def load():
+            # The write commits and invalidates while the old row is being read.
+            cache.invalidate('post', self.post_id)
+            return {'id': self.post_id, 'title': 'Old title'}
+
+        self.assertEqual(cache.get_or_load('post', self.post_id, load)['title'], 'Old title')
+        response = self.client.get(reverse('get-post', kwargs={'id': self.post_id}), format='json')
+        self.assertEqual(response.data['title'], 'Test Post Title')
+
+    def test_get_post_not_found_cached(self):
+        missing_id = self.post_id + 1000
+        get_url = reverse('get-post', kwargs={'id': missing_id})
+        self.assertEqual(self.client.get(get_url, format='json').status_code, status.HTTP_404_NOT_FOUND)
+
+        with self.assertNumQueries(0):
+            get_response = self.client.get(get_url, format='json')
+        self.assertEqual(get_response.status_code, status.HTTP_404_NOT_FOUND)
+
+        stats = cache.get_stats()
+        self.assertGreaterEqual(stats[('post', 'hit')], 1)
+        self.assertGreaterEqual(stats[('post', 'miss')], 1)
+
+
+class MultiGetTests(APITestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.users = [User.objects.create_user(username='user%d' % i, password='testpassword') for i in range(3)]
+        self.posts = [Post.objects.create(user=user, title='Post', content='Content') for user in self.users]
+
+    def test_get_users_by_ids(self):
+        ids = [self.users[2].id, self.users[0].id, 999999]
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('get-users'), {'ids': ','.join(map(str, ids))}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([user['id'] for user in response.json()['results']], ids[:2])
+        self.assertEqual(response.json()['missing'], [999999])
+        self.assertEqual(response.json()['results'][0],
+                         self.client.get(reverse('get-user', kwargs={'id': ids[0]}), format='json').json())
+
+        # Found and missing IDs are both cached now.
+        with self.assertNumQueries(0):
+            self.client.get(reverse('get-users'), {'ids': ','.join(map(str, ids))}, format='json')
+
+    def test_get_posts_by_ids_with_authors(self):
+        ids = ','.join(str(post.id) for post in self.posts)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('get-posts'), {'ids': ids, 'include': 'authors'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.json()
+        self.assertEqual([post['id'] for post in body['results']], [post.id for post in self.posts])
+        self.assertEqual([user['username'] for user in body['authors']], ['user0', 'user1', 'user2'])
+
+    def test_invalid_ids(self):
+        for ids in ('', 'a,b', ','.join(str(i) for i in range(101))):
+            response = self.client.get(reverse('get-posts'), {'ids': ids}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('get-posts')).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_loader_batches_and_memoizes(self):
+        request = mock.Mock(spec=[])
+        loader = loaders.get_loader(request, 'user')
+        self.assertIs(loaders.get_loader(request, 'user'), loader)
+
+        loader.want([self.users[0].id, self.users[1].id, 999999])
+        with self.assertNumQueries(1):
+            self.assertEqual(loader.get(self.users[2].id)['username'], 'user2')
+            self.assertEqual(loader.get(self.users[0].id)['username'], 'user0')
+            self.assertIsNone(loader.get(999999))
+
+
+class SparseFieldsetTests(APITestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.user = User.objects.create_user(username='testuser', email='test@test.com', password='testpassword')
+        self.author = User.objects.create_user(username='author', password='testpassword')
+        for i in range(3):
+            Post.objects.create(user=self.user, title='Sourdough %d' % i, content='A long sourdough body.')
+
+    def get(self, name, params, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name, kwargs=kwargs), params, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The post excerpts and bodies were never read.
+        self.assertFalse([query for query in queries
+                          if '"api_post"."excerpt"' in query['sql'] or '"api_postbody"."content"' in query['sql']])
+        return response.json()
+
+    def test_posts_by_user(self):
+        body = self.get('get-posts-by-user', {'fields': 'title,id', 'page_size': 2}, user_id=self.user.id)
+        self.assertEqual([list(post) for post in body['results']], [['id', 'title']] * 2)
+
+        # The cursor still works without created_at in the fieldset.
+        response = self.client.get(body['next'], format='json')
+        self.assertEqual([post['title'] for post in response.json()['results']], ['Sourdough 2'])
+
+    def test_search(self):
+        body = self.get('search-posts', {'q': 'sourdough', 'fields': 'id,created_at'})
+        self.assertEqual([list(post) for post in body['results']], [['id', 'created_at']] * 3)
+
+    def test_home_timeline(self):
+        Follow.objects.create(follower=self.author, followee=self.user)
+        PullAuthor.objects.create(user=self.user)
+        # Fanned out to the author's own timeline; self.user's posts are pulled in at read time.
+        Post.objects.create(user=self.author, title='Own post', content='Body.')
+
+        with self.assertNumQueries(2):
+            body = self.get('get-home-timeline', {'fields': 'title,user'}, user_id=self.author.id)
+        self.assertEqual([post['title'] for post in body['results']],
+                         ['Own post', 'Sourdough 2', 'Sourdough 1', 'Sourdough 0'])
+        self.assertEqual(list(body['results'][0]), ['title', 'user'])
+
+    def test_users_and_single_objects(self):
+        body = self.get('get-users', {'fields': 'username'})
+        self.assertEqual(body['results'], [{'username': 'testuser'}, {'username': 'author'}])
+
+        body = self.get('get-user', {'fields': 'id,email', 'include': 'counts'}, id=self.user.id)
+        self.assertEqual(body, {'id': self.user.id, 'email': 'test@test.com', 'post_count': 3})
+
+        post = Post.objects.first()
+        body = self.client.get(reverse('get-post', kwargs={'id': post.id}), {'fields': 'title'}, format='json').json()
+        self.assertEqual(body, {'title': post.title})
+
+    def test_stream(self):
+        response = self.client.get(reverse('get-posts-by-user', kwargs={'user_id': self.user.id}),
+                                   {'stream': 1, 'fields': 'id'})
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([list(json.loads(line)) for line in lines], [['id']] * 3)
+
+    def test_unknown_field(self):
+        for fields in ('title,password', ''):
+            response = self.client.get(reverse('get-posts-by-user', kwargs={'user_id': self.user.id}),
+                                       {'fields': fields}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('fields', response.json())
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.user = User.objects.create_user(username='testuser', email='test@test.com', password='testpassword')
+        Post.objects.create(user=self.user, title='Test Post Title', content='This is the content of the test post.')
+        self.get_url = reverse('get-posts-by-user', kwargs={'user_id': self.user.id})
+
+    def test_cached_page_served_without_queries(self):
+        first_response = self.client.get(self.get_url, format='json')
+        self.assertEqual(first_response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            second_response = self.client.get(self.get_url, format='json')
+        self.assertEqual(second_response.content, first_response.content)
+        self.assertEqual(second_response['ETag'], first_response['ETag'])
+        self.assertIn('Accept-Encoding', second_response['Vary'])
+
+    def test_gzip_encoding(self):
+        plain = self.client.get(self.get_url, format='json')
+        compressed = self.client.get(self.get_url, format='json', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+
+    def test_etag_differs_per_encoding(self):
+        plain_etag = self.client.get(self.get_url, format='json')['ETag']
+        gzip_etag = self.client.get(self.get_url, format='json', HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        self.assertEqual(gzip_etag, plain_etag[:-1] + '-gzip"')
+
+        # Both from the cache, then both after it is dropped.
+        for clear in (False, True):
+            if clear:
+                cache.get_cache().clear()
+            response = self.client.get(self.get_url, format='json', HTTP_ACCEPT_ENCODING='gzip',
+                                       HTTP_IF_NONE_MATCH=plain_etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            response = self.client.get(self.get_url, format='json', HTTP_ACCEPT_ENCODING='gzip',
+                                       HTTP_IF_NONE_MATCH=gzip_etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['ETag'], gzip_etag)
+            response = self.client.get(self.get_url, format='json', HTTP_IF_NONE_MATCH=gzip_etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+    @unittest.skipIf(response_cache.brotli is None, 'brotli is not installed')
+    def test_brotli_encoding(self):
+        plain = self.client.get(self.get_url, format='json')
+        compressed = self.client.get(self.get_url, format='json', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(compressed['Content-Encoding'], 'br')
+        self.assertEqual(response_cache.brotli.decompress(compressed.content), plain.content)
+
+    @mock.patch.object(response_cache, 'brotli', None)
+    def test_brotli_unavailable_falls_back_to_gzip(self):
+        response = self.client.get(self.get_url, format='json', HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_encoding_refused_with_zero_quality(self):
+        response = self.client.get(self.get_url, format='json', HTTP_ACCEPT_ENCODING='gzip;q=0, br;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_invalidated_on_new_post(self):
+        self.client.get(self.get_url, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(user=self.user, title='Newer Post', content='More content.')
+
+        get_response = self.client.get(self.get_url, format='json')
+        titles = [post['title'] for post in get_response.json()['results']]
+        self.assertIn('Newer Post', titles)
+
+    def test_page_rendered_before_invalidation_not_served(self):
+        store = response_cache.store
+
+        def store_after_write(request, scope, *args, **kwargs):
+            # A post is written and its invalidation lands after the view read the page's rows.
+            Post.objects.create(user=self.user, title='Newer Post', content='More content.')
+            response_cache.invalidate(scope)
+            return store(request, scope, *args, **kwargs)
+
+        with mock.patch.object(response_cache, 'store', store_after_write):
+            stale = self.client.get(self.get_url, format='json')
+        self.assertNotIn('Newer Post', [post['title'] for post in stale.json()['results']])
+
+        fresh = self.client.get(self.get_url, format='json')
+        self.assertIn('Newer Post', [post['title'] for post in fresh.json()['results']])
+
+    def test_get_users_invalidated_on_new_user(self):
+        get_all_url = reverse('get-users')
+        self.client.get(get_all_url, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(username='testuser2', email='test2@test.com', password='testpassword')
+
+        usernames = [user['username'] for user in self.client.get(get_all_url, format='json').json()['results']]
+        self.assertIn('testuser2', usernames)
+
+    def test_browsable_api_not_cached(self):
+        self.client.get(self.get_url, HTTP_ACCEPT='text/html')
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.client.get(self.get_url, HTTP_ACCEPT='text/html')
+        self.assertGreater(len(queries), 0)
+
+@override_settings(API_COMMENT_INGEST=True)
+@mock.patch.object(ingest.CommentIngest, 'start_flusher')
+class CommentIngestTests(APITestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.user = User.objects.create_user(username='testuser', email='test@test.com', password='testpassword')
+        self.post = Post.objects.create(user=self.user, title='Test Post Title', content='Test content.')
+        self.comment_data = {'user': self.user.id, 'post': self.post.id, 'content': 'Queued comment.'}
+        patcher = mock.patch.object(ingest, 'comments', ingest.CommentIngest())
+        self.comments = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_comment_queued_then_flushed(self, start_flusher):
+        response = self.client.post(reverse('create-comment'), self.comment_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(response.data['receipt'])
+        self.assertTrue(start_flusher.called)
+        self.assertFalse(Comment.objects.exists())
+
+        self.comments.flush()
+        self.assertEqual(list(Comment.objects.values_list('content', flat=True)), ['Queued comment.'])
+        self.assertEqual(self.comments.get_stats()['written'], 1)
+
+    def test_invalid_post_rejected(self, start_flusher):
+        response = self.client.post(reverse('create-comment'), dict(self.comment_data, post=self.post.id + 1000),
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.comments.get_stats()['depth'], 0)
+
+    @override_settings(API_COMMENT_INGEST_MAX_QUEUE=1)
+    def test_full_queue_sheds(self, start_flusher):
+        self.client.post(reverse('create-comment'), self.comment_data, format='json')
+        response = self.client.post(reverse('create-comment'), self.comment_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+    @override_settings(API_COMMENT_INGEST_BATCH_SIZE=2)
+    def test_flush_writes_in_batches(self, start_flusher):
+        for _ in range(5):
+            self.client.post(reverse('create-comment'), self.comment_data, format='json')
+
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.comments.flush()
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "api_comment"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(Comment.objects.count(), 5)
+
+    def test_enqueue_skips_database_when_cached(self, start_flusher):
+        self.client.post(reverse('create-comment'), self.comment_data, format='json')
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('create-comment'), self.comment_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+    def test_comments_on_deleted_post_skipped(self, start_flusher):
+        self.client.post(reverse('create-comment'), self.comment_data, format='json')
+        Post.objects.filter(id=self.post.id).delete()
+
+        self.comments.flush()
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(self.comments.get_stats()['orphaned'], 1)
+
+
+class CounterTests(APITestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.user = User.objects.create_user(username='testuser', email='test@test.com', password='testpassword')
+        self.post = Post.objects.create(user=self.user, title='Test Post Title', content='Test content.')
+
+    def comment_count(self):
+        return counters.get_count(counters.COMMENT_COUNT, self.post.id)
+
+    def test_counts_follow_single_and_bulk_writes(self):
+        comment_data = {'content': 'Test comment.', 'user': self.user.id, 'post': self.post.id}
+        self.client.post(reverse('create-comment'), comment_data, format='json')
+        self.client.post(reverse('create-comments'), [comment_data] * 3, format='json')
+        self.client.post(reverse('create-posts'), [{'title': 'Bulk', 'content': 'Bulk.', 'user': self.user.id}] * 2,
+                         format='json')
+
+        self.assertEqual(self.comment_count(), 4)
+        self.assertEqual(counters.get_count(counters.POST_COUNT, self.user.id), 3)
+
+    @override_settings(API_COUNTER_SHARDS={'comment_count': 4})
+    def test_comment_count_sharded(self):
+        for i in range(40):
+            Comment.objects.create(post=self.post, user=self.user, content='Comment %d' % i)
+
+        shards = CounterShard.objects.filter(name=counters.COMMENT_COUNT, object_id=self.post.id)
+        self.assertGreater(shards.count(), 1)
+        self.assertLessEqual(shards.count(), 4)
+        self.assertEqual(self.comment_count(), 40)
+
+    def test_counts_follow_deletes(self):
+        comment = Comment.objects.create(post=self.post, user=self.user, content='Comment')
+        Comment.objects.create(post=self.post, user=self.user, content='Comment')
+        comment.delete()
+        self.assertEqual(self.comment_count(), 1)
+
+        self.post.delete()
+        self.assertFalse(CounterShard.objects.filter(name=counters.COMMENT_COUNT).exists())
+        self.assertEqual(counters.get_count(counters.POST_COUNT, self.user.id), 0)
+
+        self.user.delete()
+        self.assertFalse(CounterShard.objects.exists())
+
+    def test_reconcile_repairs_drift(self):
+        Comment.objects.create(post=self.post, user=self.user, content='Comment')
+        CounterShard.objects.update(value=99)
+
+        out = io.StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('%s %s: 99 -> 1' % (counters.COMMENT_COUNT, self.post.id), out.getvalue())
+        self.assertEqual(self.comment_count(), 99)
+
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.assertEqual(self.comment_count(), 1)
+        self.assertEqual(counters.get_count(counters.POST_COUNT, self.user.id), 1)
+        self.assertEqual(counters.reconcile(counters.COMMENT_COUNT), {})
+
+    def test_include_counts(self):
+        Comment.objects.create(post=self.post, user=self.user, content='Comment')
+
+        user_response = self.client.get(reverse('get-user', kwargs={'id': self.user.id}), {'include': 'counts'},
+                                        format='json')
+        self.assertEqual(user_response.data['post_count'], 1)
+        post_response = self.client.get(reverse('get-post', kwargs={'id': self.post.id}), {'include': 'counts'},
+                                        format='json')
+        self.assertEqual(post_response.data['comment_count'], 1)
+        self.assertNotIn('comment_count', self.client.get(reverse('get-post', kwargs={'id': self.post.id}),
+                                                          format='json').data)
+
+
+class QueryBudgetTests(QueryBudgetMixin, APITestCase):
+    query_budgets = {
+        # The INSERT in a savepoint; the username check is answered by the warm filter.
+        'create-user': 3,
+        'get-user': 1,
+        'get-users': 1,
+        # Writes include the counter update: an UPDATE, plus a savepoint-wrapped
+        # INSERT when the count's shard doesn't exist yet. A post's body is a
+        # second INSERT.
+        'create-post': 10,
+        'get-post': 1,
+        'get-posts-by-user': 2,
+        'create-comment': 9,
+        'create-comments': 9,
+    }
+
+    def setUp(self):
+        cache.get_cache().clear()
+        usernames.taken.reset()
+        usernames.taken.get_filter()
+
+    def test_endpoints_within_budget(self):
+        user_data = {
+            'username': 'testuser',
+            'email': 'test@test.com',
+            'password': 'testpassword',
+            'first_name': 'testfirst',
+            'last_name': 'testlast'
+        }
+        with self.assertQueryBudget('create-user'):
+            user_id = self.client.post(reverse('create-user'), user_data, format='json').data['id']
+        with self.assertQueryBudget('get-user'):
+            self.client.get(reverse('get-user', kwargs={'id': user_id}), format='json')
+        with self.assertQueryBudget('get-users'):
+            self.client.get(reverse('get-users'), format='json')
+
+        post_data = {'title': 'Test Post Title', 'content': 'Test content.', 'user': user_id}
+        with self.assertQueryBudget('create-post'):
+            post_id = self.client.post(reverse('create-post'), post_data, format='json').data['id']
+        with self.assertQueryBudget('get-post'):
+            self.client.get(reverse('get-post', kwargs={'id': post_id}), format='json')
+        with self.assertQueryBudget('get-posts-by-user'):
+            self.client.get(reverse('get-posts-by-user', kwargs={'user_id': user_id}), format='json')
+
+        comment_data = {'content': 'Test comment.', 'user': user_id, 'post': post_id}
+        with self.assertQueryBudget('create-comment'):
+            self.client.post(reverse('create-comment'), comment_data, format='json')
+        with self.assertQueryBudget('create-comments'):
+            self.client.post(reverse('create-comments'), [comment_data] * 50, format='json')
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('get-users'), format='json')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+        body = response.content.decode('utf-8')
+        self.assertIn('api_requests_total{route="get-users",method="GET",status="200"}', body)
+        self.assertIn('api_request_duration_seconds_count{route="get-users",method="GET"}', body)
+        self.assertIn('api_db_queries_total{route="get-users",method="GET"}', body)
+
+
+class TimelineTests(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpassword')
+        self.bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpassword')
+        self.carol = User.objects.create_user(username='carol', email='carol@test.com', password='testpassword')
+
+    def follow(self, follower, followee):
+        response = self.client.post(reverse('follow'), {'follower': follower.id, 'followee': followee.id},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def create_post(self, user, title):
+        post_data = {'title': title, 'content': 'Timeline content.', 'user': user.id}
+        response = self.client.post(reverse('create-post'), post_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def get_timeline_titles(self, user, **params):
+        get_url = reverse('get-home-timeline', kwargs={'user_id': user.id})
+        response = self.client.get(get_url, params, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post['title'] for post in response.data['results']]
+
+    def test_home_timeline_fan_out_on_write(self):
+        self.follow(self.alice, self.bob)
+        self.create_post(self.bob, 'Bob 1')
+        self.create_post(self.carol, 'Carol 1')
+        self.create_post(self.alice, 'Alice 1')
+        self.create_post(self.bob, 'Bob 2')
+
+        with self.assertNumQueries(2):
+            titles = self.get_timeline_titles(self.alice)
+        self.assertEqual(titles, ['Bob 2', 'Alice 1', 'Bob 1'])
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        self.create_post(self.bob, 'Bob 1')
+        self.follow(self.alice, self.bob)
+        self.assertEqual(self.get_timeline_titles(self.alice), ['Bob 1'])
+
+        response = self.client.post(reverse('unfollow'), {'follower': self.alice.id, 'followee': self.bob.id},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.get_timeline_titles(self.alice), [])
+
+    def test_follow_self_rejected(self):
+        response = self.client.post(reverse('follow'), {'follower': self.alice.id, 'followee': self.alice.id},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_home_timeline_fan_out_on_read(self):
+        self.follow(self.alice, self.bob)
+        self.follow(self.carol, self.bob)
+        self.create_post(self.carol, 'Carol 1')
+        with self.settings(API_TIMELINE_FAN_OUT_LIMIT=1):
+            self.create_post(self.bob, 'Bob 1')
+        self.create_post(self.carol, 'Carol 2')
+        self.create_post(self.alice, 'Alice 1')
+
+        self.assertTrue(PullAuthor.objects.filter(user=self.bob).exists())
+        self.assertEqual(self.get_timeline_titles(self.alice), ['Alice 1', 'Bob 1'])
+
+        get_url = reverse('get-home-timeline', kwargs={'user_id': self.alice.id})
+        first_page = self.client.get(get_url, {'page_size': 1}, format='json')
+        self.assertEqual([post['title'] for post in first_page.data['results']], ['Alice 1'])
+        second_page = self.client.get(first_page.data['next'], format='json')
+        self.assertEqual([post['title'] for post in second_page.data['results']], ['Bob 1'])
+        self.assertIsNone(second_page.data['next'])
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.user = User.objects.create_user(username='testuser', email='test@test.com', password='testpassword')
+
+    def test_async_create_and_get_post(self):
+        post_data = {'title': 'Async Post', 'content': 'Async content.', 'user': self.user.id}
+        create_response = self.client.post(reverse('async-create-post'), post_data, format='json')
+        self.assertEqual(create_response.status_code, status.HTTP_201_CREATED)
+        post_id = create_response.json()['id']
+
+        get_response = self.client.get(reverse('async-get-post', kwargs={'id': post_id}))
+        self.assertEqual(get_response.status_code, status.HTTP_200_OK)
+        sync_response = self.client.get(reverse('get-post', kwargs={'id': post_id}), format='json')
+        self.assertEqual(get_response.content, sync_response.content)
+
+        user_response = self.client.get(reverse('async-get-user', kwargs={'id': self.user.id}))
+        sync_response = self.client.get(reverse('get-user', kwargs={'id': self.user.id}), format='json')
+        self.assertEqual(user_response.content, sync_response.content)
+
+        list_response = self.client.get(reverse('async-get-posts-by-user', kwargs={'user_id': self.user.id}))
+        self.assertEqual([post['title'] for post in list_response.json()['results']], ['Async Post'])
+
+    def test_async_create_post_invalid_user(self):
+        post_data = {'title': 'Async Post', 'content': 'Async content.', 'user': self.user.id + 1000}
+        response = self.client.post(reverse('async-create-post'), post_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('user', response.json())
+
+    def test_async_create_comment(self):
+        post = Post.objects.create(user=self.user, title='Post', content='Content')
+        comment_data = {'content': 'Async comment.', 'user': self.user.id, 'post': post.id}
+        response = self.client.post(reverse('async-create-comment'), comment_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Comment.objects.filter(post=post).count(), 1)
+
+    def test_async_get_user_not_found(self):
+        response = self.client.get(reverse('async-get-user', kwargs={'id': self.user.id + 1000}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_async_get_users(self):
+        response = self.client.get(reverse('async-get-users'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([user['username'] for user in response.json()['results']], ['testuser'])
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@test.com', password='testpassword')
+        Post.objects.create(user=self.user, title='Sourdough basics', content='Flour, water and salt.')
+        Post.objects.create(user=self.user, title='Weeknight pasta', content='A quick sourdough crumb topping.')
+        Post.objects.create(user=self.user, title='Cycling', content='Hill repeats.')
+
+    def search(self, **params):
+        response = self.client.get(reverse('search-posts'), params, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_search_ranks_title_matches_first(self):
+        titles = [post['title'] for post in self.search(q='sourdough')['results']]
+        self.assertEqual(titles, ['Sourdough basics', 'Weeknight pasta'])
+
+    def test_search_tracks_updates_and_deletes(self):
+        post = Post.objects.get(title='Cycling')
+        post.content = 'Sourdough for the ride.'
+        post.save()
+        self.assertEqual(len(self.search(q='sourdough')['results']), 3)
+
+        Post.objects.filter(title='Sourdough basics').delete()
+        self.assertEqual(len(self.search(q='sourdough')['results']), 2)
+
+    def test_search_paginated(self):
+        first_page = self.search(q='sourdough', page_size=1)
+        self.assertEqual([post['title'] for post in first_page['results']], ['Sourdough basics'])
+        next_page = self.client.get(first_page['next'], format='json').data
+        self.assertEqual([post['title'] for post in next_page['results']], ['Weeknight pasta'])
+        self.assertIsNone(next_page['next'])
+
+    def test_search_requires_query(self):
+        response = self.client.get(reverse('search-posts'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_malformed_query(self):
+        # Unbalanced quotes and stray operators must not become query syntax errors.
+        for q in ('sourdough OR "', '"unterminated', 'sourdough -', 'a:b* & | !'):
+            self.search(q=q)
+
+
+class PostBodyTests(APITestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.user = User.objects.create_user(username='testuser', email='test@test.com', password='testpassword')
+        self.body = ' '.join('word%d' % i for i in range(400))
+        self.post = Post.objects.create(user=self.user, title='Long read', content=self.body)
+
+    def test_make_excerpt(self):
+        self.assertEqual(make_excerpt('  Short\n\tpost. '), 'Short post.')
+        excerpt = make_excerpt(self.body)
+        self.assertLessEqual(len(excerpt), EXCERPT_LENGTH)
+        self.assertTrue(excerpt.endswith(' word%d…' % (excerpt.count(' '))))
+        self.assertTrue(self.body.startswith(excerpt[:-1]))
+        self.assertEqual(Post.objects.get(pk=self.post.pk).excerpt, excerpt)
+
+    def test_lists_serve_excerpt_without_reading_bodies(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('get-posts-by-user', kwargs={'user_id': self.user.id}), format='json')
+            search = self.client.get(reverse('search-posts'), {'q': 'read'}, format='json')
+        self.assertEqual(response.json()['results'][0]['excerpt'], make_excerpt(self.body))
+        self.assertNotIn('content', response.json()['results'][0])
+        self.assertEqual([post['title'] for post in search.json()['results']], ['Long read'])
+        self.assertFalse([query for query in queries if '"api_postbody"."content"' in query['sql']])
+
+    def test_detail_reads_body(self):
+        url = reverse('get-post', kwargs={'id': self.post.pk})
+        self.client.get(url, format='json')
+        cache.invalidate('post', self.post.pk)
+        # The post joined to its body, once any partition bounds are cached.
+        with self.assertNumQueries(1):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.json()['content'], self.body)
+
+        response = self.client.get(reverse('get-post', kwargs={'id': self.post.pk}), {'include': 'comments'},
+                                   format='json')
+        self.assertEqual(response.json()['content'], self.body)
+
+    def test_bodies_written_and_deleted_with_posts(self):
+        response = self.client.post(reverse('create-posts'), [{'title': 'Bulk', 'content': 'Bulk body.',
+                                                               'user': self.user.id}] * 2, format='json')
+        ids = [post['id'] for post in response.json()['created']]
+        self.assertEqual(dict(PostBody.objects.filter(pk__in=ids).values_list('pk', 'content')),
+                         {pk: 'Bulk body.' for pk in ids})
+
+        Post.objects.filter(pk__in=ids).delete()
+        self.assertFalse(PostBody.objects.filter(pk__in=ids).exists())
+
+    def test_save_update_fields(self):
+        post = Post.objects.get(pk=self.post.pk)
+        post.title = 'Edited'
+        post.content = 'Edited body.'
+        post.save(update_fields=['title'])
+        self.assertEqual(PostBody.objects.get(pk=post.pk).content, self.body)
+
+        post.save(update_fields=['content'])
+        self.assertEqual(PostBody.objects.get(pk=post.pk).content, 'Edited body.')
+        self.assertEqual(Post.objects.get(pk=post.pk).excerpt, 'Edited body.')
+
+    def test_search_tracks_title_changes(self):
+        self.post.title = 'Sourdough notes'
+        self.post.save()
+        response = self.client.get(reverse('search-posts'), {'q': 'sourdough'}, format='json')
+        self.assertEqual([post['id'] for post in response.json()['results']], [self.post.pk])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Body compression is done by Postgres')
+    def test_large_bodies_compressed(self):
+        small = Post.objects.create(user=self.user, title='Short', content='Short body.')
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT post_id, pg_column_compression(content) FROM api_postbody')
+            compression = dict(cursor.fetchall())
+        self.assertIsNotNone(compression[self.post.pk])
+        self.assertIsNone(compression[small.pk])
+
+
+class PartitionTests(APITestCase):
+    def test_month_helpers(self):
+        month = datetime.date(2024, 11, 1)
+        self.assertEqual(partitions.add_months(month, 2), datetime.date(2025, 1, 1))
+        self.assertEqual(partitions.add_months(month, -11), datetime.date(2023, 12, 1))
+        self.assertEqual(partitions.partition_name('api_post', month), 'api_post_y2024m11')
+        self.assertEqual(partitions.parse_partition_name('api_post', 'api_post_y2024m11'), month)
+        self.assertIsNone(partitions.parse_partition_name('api_post', 'api_post_default'))
+
+    def test_maintain_partitions_requires_partitioning(self):
+        with self.assertRaises(CommandError):
+            call_command('maintain_partitions', stdout=io.StringIO())
+        self.assertEqual(partitions.prune_by_id('api_post', 1), {})
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Partitioning needs Postgres')
+@override_settings(API_PARTITION_BY_MONTH=True)
+class PostgresPartitionTests(APITestCase):
+    # The conversion is DDL inside the test's transaction, so it's rolled back afterwards.
+    def setUp(self):
+        cache.get_cache().clear()
+        partitions.partition_tables()
+        self.addCleanup(partitions.clear_bounds)
+        self.user = User.objects.create_user(username='testuser', email='test@test.com', password='testpassword')
+        this_month = partitions.month_start(datetime.datetime.now(datetime.timezone.utc))
+        self.old_month = partitions.add_months(this_month, -3)
+        with connection.cursor() as cursor:
+            for table in partitions.TABLES:
+                partitions.ensure_partitions(cursor, table, 0, start=self.old_month)
+
+        self.old_post = Post.objects.create(user=self.user, title='Old post', content='Old content.')
+        Comment.objects.create(post=self.old_post, user=self.user, content='Old comment.')
+        old_time = partitions.to_datetime(self.old_month) + datetime.timedelta(days=1)
+        # Moves the rows into the old month's partition.
+        Post.objects.filter(id=self.old_post.id).update(created_at=old_time)
+        Comment.objects.filter(post=self.old_post).update(created_at=old_time)
+        self.new_post = Post.objects.create(user=self.user, title='New post', content='New content.')
+        # A comment posted today on the old post.
+        Comment.objects.create(post=self.old_post, user=self.user, content='Late comment.')
+
+    def test_tables_partitioned(self):
+        with connection.cursor() as cursor:
+            for table in partitions.TABLES:
+                self.assertTrue(partitions.is_partitioned(cursor, table))
+                names = [name for name, _ in partitions.list_partitions(cursor, table)]
+                self.assertIn(partitions.partition_name(table, self.old_month), names)
+                self.assertIn(table + '_default', names)
+
+    def test_get_post_pruned_by_id(self):
+        self.assertEqual(partitions.prune_by_id('api_post', self.old_post.id),
+                         {'created_at__gte': partitions.to_datetime(self.old_month),
+                          'created_at__lt': partitions.to_datetime(partitions.add_months(self.old_month, 1))})
+        for post in (self.old_post, self.new_post):
+            response = self.client.get(reverse('get-post', kwargs={'id': post.id}), format='json')
+            self.assertEqual(response.data['title'], post.title)
+
+    def test_get_imported_backdated_post(self):
+        # Imported without an ID, the post gets the highest one, in the old month's partition.
+        old_time = partitions.to_datetime(self.old_month) + datetime.timedelta(days=2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'posts.ndjson')
+            with open(path, 'w') as f:
+                f.write(json.dumps({'user_id': self.user.id, 'title': 'Imported post', 'content': 'Imported.',
+                                    'created_at': old_time.isoformat()}) + '\n')
+            call_command('import_data', 'posts', path, stdout=io.StringIO())
+        partitions.clear_bounds()
+
+        imported = Post.objects.get(title='Imported post')
+        self.assertGreater(imported.id, self.new_post.id)
+        response = self.client.get(reverse('get-post', kwargs={'id': imported.id}), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], 'Imported post')
+
+    def test_comments_by_post(self):
+        response = self.client.get(reverse('get-comments-by-post', kwargs={'post_id': self.old_post.id}),
+                                   format='json')
+        self.assertEqual([comment['content'] for comment in response.data['results']],
+                         ['Old comment.', 'Late comment.'])
+
+    def test_archive_old_months(self):
+        with tempfile.TemporaryDirectory() as archive_dir:
+            call_command('maintain_partitions', retain_months=1, archive_dir=archive_dir, stdout=io.StringIO())
+            name = partitions.partition_name('api_post', self.old_month)
+            with gzip.open(os.path.join(archive_dir, name + '.csv.gz'), 'rt') as f:
+                self.assertIn('Old post', f.read())
+            with gzip.open(os.path.join(archive_dir, name + '_comments.csv.gz'), 'rt') as f:
+                self.assertIn('Late comment.', f.read())
+
+        self.assertEqual(list(Post.objects.values_list('title', flat=True)), ['New post'])
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(counters.get_count(counters.POST_COUNT, self.user.id), 1)
+        self.assertEqual(counters.reconcile(counters.COMMENT_COUNT), {})
+
+
+class SeedDataTests(APITestCase):
+    def test_seed_data_command(self):
+        call_command('seed_data', users=3, posts_per_user=2, comments_per_post=4, batch_size=5,
+                     stdout=io.StringIO())
+
+        self.assertEqual(User.objects.filter(username__startswith='seeduser').count(), 3)
+        self.assertEqual(Post.objects.count(), 6)
+        self.assertEqual(Comment.objects.count(), 24)
+
+        with self.assertRaises(CommandError):
+            call_command('seed_data', users=1, stdout=io.StringIO())
+
+    def test_seed_data_timelines(self):
+        call_command('seed_data', users=4, follows_per_user=2, posts_per_user=2, comments_per_post=0,
+                     stdout=io.StringIO())
+
+        user = User.objects.get(username='seeduser0')
+        followees = set(Follow.objects.filter(follower=user).values_list('followee_id', flat=True))
+        self.assertEqual(len(followees), 2)
+        self.assertNotIn(user.id, followees)
+
+        response = self.client.get(reverse('get-home-timeline', kwargs={'user_id': user.id}), format='json')
+        authors = [post['user'] for post in response.data['results']]
+        self.assertEqual(len(authors), 6)
+        self.assertEqual(set(authors), followees | {user.id})
+
+
+class BenchmarkTests(APITestCase):
+    def test_run_load_counts_only_2xx_latencies(self):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.send_response(int(self.path.strip('/')))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        base_url = 'http://127.0.0.1:%d' % server.server_port
+        result = benchmark.run_load(['%s/%d/' % (base_url, code) for code in (200, 429, 404, 500)],
+                                    concurrency=2, requests=8)
+        self.assertEqual((len(result.latencies), result.rejected, result.client_errors, result.errors),
+                         (2, 2, 2, 2))
+        self.assertEqual(result.requests, 8)
+
+
+class BulkDataTests(APITestCase):
+    def setUp(self):
+        call_command('seed_data', users=3, posts_per_user=2, comments_per_post=2, stdout=io.StringIO())
+        PostBody.objects.filter(pk=Post.objects.order_by('pk').first().pk).update(content='tab\there\nback\\slash')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def snapshot(self):
+        return {
+            'users': list(User.objects.order_by('pk').values_list('pk', 'username', 'password', 'date_joined')),
+            'posts': list(Post.objects.order_by('pk').values_list('pk', 'user_id', 'title', 'excerpt', 'body__content',
+                                                                  'created_at')),
+            'comments': list(Comment.objects.order_by('pk').values_list('pk', 'post_id', 'user_id', 'content')),
+        }
+
+    def round_trip(self, extension):
+        before = self.snapshot()
+        paths = {}
+        for table in ('users', 'posts', 'comments'):
+            paths[table] = os.path.join(self.directory.name, table + extension)
+            call_command('export_data', table, paths[table], stdout=io.StringIO())
+        User.objects.all().delete()
+        CounterShard.objects.all().delete()
+
+        for table in ('users', 'posts', 'comments'):
+            call_command('import_data', table, paths[table], batch_size=4, stdout=io.StringIO())
+
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(counters.reconcile(counters.POST_COUNT, dry_run=True), {})
+        self.assertEqual(counters.reconcile(counters.COMMENT_COUNT, dry_run=True), {})
+        # The ID sequence was moved past the imported rows.
+        post = Post.objects.create(user=User.objects.first(), title='new', content='new')
+        self.assertGreater(post.pk, before['posts'][-1][0])
+
+    def test_round_trip_ndjson(self):
+        self.round_trip('.ndjson')
+
+    def test_round_trip_gzipped_csv(self):
+        self.round_trip('.csv.gz')
+
+    def test_import_skips_existing_and_orphaned_rows(self):
+        path = os.path.join(self.directory.name, 'comments.ndjson')
+        call_command('export_data', 'comments', path, stdout=io.StringIO())
+        with open(path, 'a') as f:
+            f.write(json.dumps({'post_id': 999999, 'user_id': User.objects.first().pk, 'content': 'orphan'}) + '\n')
+            f.write(json.dumps({'post_id': Post.objects.first().pk, 'user_id': User.objects.first().pk,
+                                'content': 'new'}) + '\n')
+
+        out = io.StringIO()
+        call_command('import_data', 'comments', path, stdout=out)
+
+        self.assertIn('Imported 1 comments (13 skipped: 12 existing id, 1 missing post)', out.getvalue())
+        self.assertTrue(Comment.objects.filter(content='new').exists())
+        self.assertEqual(counters.reconcile(counters.COMMENT_COUNT, dry_run=True), {})
+
+    def test_import_rejects_bad_rows(self):
+        path = os.path.join(self.directory.name, 'posts.csv')
+        with open(path, 'w') as f:
+            f.write('user_id,title\n1,no content\n')
+
+        with self.assertRaisesMessage(CommandError, 'Row 1: missing column content'):
+            call_command('import_data', 'posts', path, stdout=io.StringIO())
+
+
+class FastPathTests(APITestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.user = User.objects.create_user(username='tëstuser', email='test@test.com', password='testpassword',
+                                             first_name='Zoë "Z"', last_name='Line\nBreak\u2028')
+        User.objects.create_user(username='other', email='', password='testpassword')
+        Post.objects.create(user=self.user, title='Émoji 😀 </script>', content='Tab\there \\ \x01 end')
+        Post.objects.create(user=self.user, title='Plain', content='Plain content.')
+
+    def expected_page(self, serializer_class, instances):
+        return JSONRenderer().render({'next': None, 'previous': None,
+                                      'results': serializer_class(instances, many=True).data})
+
+    def test_get_users_matches_serializer(self):
+        response = self.client.get(reverse('get-users'))
+        expected = self.expected_page(UserSerializer, User.objects.order_by('date_joined', 'id'))
+        self.assertEqual(response.content, expected)
+
+    def test_get_posts_by_user_matches_serializer(self):
+        response = self.client.get(reverse('get-posts-by-user', kwargs={'user_id': self.user.id}))
+        expected = self.expected_page(PostListSerializer,
+                                      Post.objects.filter(user=self.user).order_by('created_at', 'id'))
+        self.assertEqual(response.content, expected)
+
+    def test_get_user_and_post_match_serializer(self):
+        response = self.client.get(reverse('get-user', kwargs={'id': self.user.id}))
+        self.assertEqual(response.content, JSONRenderer().render(UserSerializer(self.user).data))
+
+        post = Post.objects.get(title='Plain')
+        response = self.client.get(reverse('get-post', kwargs={'id': post.id}))
+        self.assertEqual(response.content, JSONRenderer().render(PostSerializer(post).data))
+
+
+# The replica is a test mirror of default (see api/settings_test.py): a second
+# connection to the same database, which only sees committed rows, hence the
+# transaction test case.
+@override_settings(API_READ_REPLICAS=['replica'])
+class ReplicaRoutingTests(APITransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@test.com', password='testpassword')
+
+    def get_users(self, **params):
+        """Returns the usernames listed by get-users and the (primary, replica) query counts."""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(reverse('get-users'), params, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            if response.streaming:
+                users = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+            else:
+                users = response.json()['results']
+        return [user['username'] for user in users], (len(primary), len(replica))
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.get_users(), (['testuser'], (0, 1)))
+
+    def test_streamed_reads_go_to_replica(self):
+        # The rows are read after the middleware has finished with the request.
+        User.objects.create_user(username='testuser2', email='test2@test.com', password='testpassword')
+        usernames, (primary, replica) = self.get_users(stream=1)
+        self.assertEqual(usernames, ['testuser', 'testuser2'])
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_writes_pin_client_to_primary(self):
+        post_data = {'title': 'Test Post Title', 'content': 'Test content.', 'user': self.user.id}
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.post(reverse('create-post'), post_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(replica), 0)
+        self.assertIn('api_pin_primary', response.cookies)
+
+        self.assertEqual(self.get_users(), (['testuser'], (1, 0)))
+
+        self.client.cookies.pop('api_pin_primary')
+        cache.get_cache().clear()
+        self.assertEqual(self.get_users(), (['testuser'], (0, 1)))
+
+    def test_pinned_client_skips_object_cache(self):
+        post_data = {'title': 'Test Post Title', 'content': 'Test content.', 'user': self.user.id}
+        post_id = self.client.post(reverse('create-post'), post_data, format='json').json()['id']
+        # A 404 cached from a replica that hadn't seen the post yet.
+        cache.get_cache().set(cache.cache_key('post', post_id), cache.MISSING)
+
+        get_url = reverse('get-post', kwargs={'id': post_id})
+        response = self.client.get(get_url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['title'], 'Test Post Title')
+
+        self.client.cookies.pop('api_pin_primary')
+        self.assertEqual(self.client.get(get_url, format='json').status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(API_READ_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        self.assertEqual(self.get_users(), (['testuser'], (1, 0)))
+
+
+class AdmissionTests(APITestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+
+    @override_settings(API_RATE_LIMITS={'get-users': {'client': (1, 2)}})
+    def test_client_rate_limit(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get(reverse('get-users')).status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('get-users'))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '1')
+
+        # Other clients have their own budget.
+        response = self.client.get(reverse('get-users'), REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('api_shed_requests_total{route="get-users",reason="rate_limited"}',
+                      self.client.get(reverse('metrics')).content.decode('utf-8'))
+
+    @override_settings(API_RATE_LIMITS={'*': {'route': (0.5, 1)}})
+    def test_route_rate_limit(self):
+        self.assertEqual(self.client.get(reverse('get-users')).status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('get-users'), REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '2')
+        # Budgets are per route, and metrics is exempt.
+        self.assertEqual(self.client.get(reverse('get-user', kwargs={'id': 1})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_200_OK)
+
+    @override_settings(API_RATE_LIMITS={'get-users': {'client': (1, 1), 'route': (1, 1)}})
+    def test_route_rejection_not_charged_to_client(self):
+        self.assertEqual(admission.check_rate('get-users', '10.0.0.1'), 0)
+        self.assertGreater(admission.check_rate('get-users', '10.0.0.2'), 0)
+        # Once the route has a token again, the second client still has its own.
+        admission.get_cache().delete('api:ratelimit:get-users')
+        self.assertEqual(admission.check_rate('get-users', '10.0.0.2'), 0)
+
+    @override_settings(API_RATE_LIMITS={'get-users': {'client': (1, 1)}},
+                       API_CLIENT_IP_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_client_ip_header(self):
+        self.client.get(reverse('get-users'), HTTP_X_FORWARDED_FOR='10.0.0.3')
+        response = self.client.get(reverse('get-users'), HTTP_X_FORWARDED_FOR='10.0.0.4')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('get-users'), HTTP_X_FORWARDED_FOR='10.0.0.4')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(API_RATE_LIMITS={'get-users': {'client': (1, 1)}},
+                       API_CLIENT_IP_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_client_ip_header_spoofed(self):
+        # The client sends its own X-Forwarded-For; the proxy appends the real address.
+        self.client.get(reverse('get-users'), HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.3')
+        response = self.client.get(reverse('get-users'), HTTP_X_FORWARDED_FOR='2.2.2.2, 10.0.0.3')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(API_RATE_LIMITS={'get-users': {'client': (1, 1)}},
+                       API_CLIENT_IP_HEADER='HTTP_X_FORWARDED_FOR', API_TRUSTED_PROXY_COUNT=2)
+    def test_client_ip_header_proxy_chain(self):
+        self.client.get(reverse('get-users'), HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.3, 10.0.0.1')
+        response = self.client.get(reverse('get-users'), HTTP_X_FORWARDED_FOR='10.0.0.4, 10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('get-users'), HTTP_X_FORWARDED_FOR='2.2.2.2, 10.0.0.3, 10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(API_MAX_CONCURRENT_REQUESTS=1)
+    def test_concurrency_cap(self):
+        self.assertEqual(self.client.get(reverse('get-users')).status_code, status.HTTP_200_OK)
+
+        slots = admission.limiter.acquire(0)
+        try:
+            with self.assertNumQueries(0):
+                response = self.client.get(reverse('get-users'))
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_200_OK)
+        finally:
+            admission.limiter.release(slots)
+
+        self.assertEqual(self.client.get(reverse('get-users')).status_code, status.HTTP_200_OK)
+
+    @override_settings(API_MAX_CONCURRENT_REQUESTS=1, API_CONCURRENCY_WAIT=0.05)
+    async def test_concurrency_cap_async(self):
+        slots = admission.limiter.acquire(0)
+        try:
+            response = await self.async_client.get(reverse('async-get-users'))
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        finally:
+            admission.limiter.release(slots)
+        response = await self.async_client.get(reverse('async-get-users'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(API_PROFILE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.get_cache().clear()
+        self.user = User.objects.create_user(username='testuser', email='test@test.com', password='testpassword')
+        Post.objects.create(user=self.user, title='Post', content='Content')
+
+    @override_settings(API_PROFILE_SAMPLE_RATE=1)
+    def test_sampled_request(self):
+        self.client.get(reverse('get-posts-by-user', kwargs={'user_id': self.user.id}), format='json')
+
+        report_ids = profiling.list_report_ids()
+        self.assertEqual(len(report_ids), 1)
+        report = profiling.load_report(report_ids[0])
+        self.assertEqual((report['route'], report['status'], report['reason']), ('get-posts-by-user', 200, 'sampled'))
+        self.assertGreater(report['queries'], 0)
+        self.assertTrue(report['statements'])
+        self.assertTrue(report['explains'])
+        self.assertFalse(report['explains'][0]['plan'][0].startswith('EXPLAIN failed'))
+        self.assertIn('cumulative', report['profile'])
+
+        out = io.StringIO()
+        call_command('show_profiles', stdout=out)
+        self.assertIn(report['id'], out.getvalue())
+        out = io.StringIO()
+        call_command('show_profiles', report['id'], stdout=out)
+        self.assertIn('EXPLAIN', out.getvalue())
+
+    @override_settings(API_PROFILE_SLOW_SECONDS=0, API_PROFILE_KEEP=2)
+    def test_slow_requests_kept_in_ring_buffer(self):
+        for _ in range(3):
+            self.client.get(reverse('get-users'), format='json')
+
+        report_ids = profiling.list_report_ids()
+        self.assertEqual(len(report_ids), 2)
+        report = profiling.load_report(report_ids[0])
+        self.assertEqual(report['reason'], 'slow')
+        self.assertIsNone(report['profile'])
+
+    def test_off_by_default(self):
+        self.client.get(reverse('get-users'), format='json')
+        self.assertEqual(profiling.list_report_ids(), [])
+
+    @override_settings(API_PROFILE_SAMPLE_RATE=1)
+    def test_profiles_endpoint_is_staff_only(self):
+        self.client.get(reverse('get-users'), format='json')
+        self.assertIn(self.client.get(reverse('profiles')).status_code,
+                      (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+        User.objects.create_user(username='staff', password='staffpassword', is_staff=True)
+        self.client.login(username='staff', password='staffpassword')
+        response = self.client.get(reverse('profiles'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        report_id = response.json()[-1]['id']
+        response = self.client.get(reverse('profile', kwargs={'report_id': report_id}), format='json')
+        self.assertEqual(response.json()['route'], 'get-users')
+        response = self.client.get(reverse('profile', kwargs={'report_id': '0-missing'}), format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.db.models import F
+
+from .models import Follow, Post, PullAuthor, TimelineEntry
+
+
+def get_fan_out_limit():
+    return getattr(settings, 'API_TIMELINE_FAN_OUT_LIMIT', 5000)
+
+
+def fan_out(posts):
+    """
+    Copies new posts into the timelines of their authors and followers.
+
+    Authors with more than API_TIMELINE_FAN_OUT_LIMIT followers are recorded as
+    PullAuthors and only get an entry in their own timeline; followers see
+    their posts through the read-time merge in `timeline_querysets`.
+    """
+    limit = get_fan_out_limit()
+    by_author = {}
+    for post in posts:
+        by_author.setdefault(post.user_id, []).append(post)
+
+    entries = []
+    for author_id, author_posts in by_author.items():
+        followers = list(
+            Follow.objects.filter(followee=author_id).values_list('follower_id', flat=True)[:limit + 1]
+        )
+        if len(followers) > limit:
+            PullAuthor.objects.get_or_create(user_id=author_id)
+            followers = []
+        for post in author_posts:
+            for owner_id in [author_id] + followers:
+                entries.append(TimelineEntry(owner_id=owner_id, post_id=post.pk, author_id=author_id,
+                                             created_at=post.created_at))
+
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def backfill(follower_id, followee_id):
+    """Copies a newly followed author's recent posts into the follower's timeline."""
+    if PullAuthor.objects.filter(user_id=followee_id).exists():
+        return
+    recent = Post.objects.filter(user=followee_id).order_by('-created_at', '-id').values_list('id', 'created_at')
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=follower_id, post_id=post_id, author_id=followee_id, created_at=created_at)
+         for post_id, created_at in recent[:getattr(settings, 'API_TIMELINE_BACKFILL', 20)]],
+        ignore_conflicts=True,
+    )
+
+
+def remove_author(follower_id, followee_id):
+    TimelineEntry.objects.filter(owner=follower_id, author=followee_id).delete()
+
+
+def timeline_querysets(user_id):
+    """
+    The two sources of a home timeline, both keyed on (created_at, post_id):
+    materialized entries, and posts by followed PullAuthors.
+    """
+    entries = TimelineEntry.objects.filter(owner=user_id).select_related('post')
+    pulled_authors = Follow.objects.filter(
+        follower=user_id, followee__in=PullAuthor.objects.values('user'),
+    ).values('followee')
+    pulled = Post.objects.filter(user__in=pulled_authors).annotate(post_id=F('id'))
+    return [entries, pulled]
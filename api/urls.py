@@ -1,12 +1,33 @@
 from django.urls import path
 from .views import *
+from . import async_views
 
 urlpatterns = [
     path('create-user/', CreateUserView.as_view(), name='create-user'),
+    path('username-available/', UsernameAvailableView.as_view(), name='username-available'),
     path('get-user/<int:id>/', GetUserView.as_view(), name='get-user'),
     path('get-users/', GetAllUsersView.as_view(), name='get-users'),
     path('create-post/', CreatePostView.as_view(), name='create-post'),
+    path('create-posts/', CreatePostsView.as_view(), name='create-posts'),
     path('get-post/<int:id>/', GetPostView.as_view(), name='get-post'),
+    path('get-posts/', GetPostsView.as_view(), name='get-posts'),
     path('get-posts-by-user/<int:user_id>/', GetPostsByUserView.as_view(), name='get-posts-by-user'),
-    path('create-comment/', CreateCommentView.as_view(), name='create-comment')
+    path('search-posts/', SearchPostsView.as_view(), name='search-posts'),
+    path('get-comments-by-post/<int:post_id>/', GetCommentsByPostView.as_view(), name='get-comments-by-post'),
+    path('create-comment/', CreateCommentView.as_view(), name='create-comment'),
+    path('create-comments/', CreateCommentsView.as_view(), name='create-comments'),
+    path('follow/', FollowView.as_view(), name='follow'),
+    path('unfollow/', UnfollowView.as_view(), name='unfollow'),
+    path('get-home-timeline/<int:user_id>/', GetHomeTimelineView.as_view(), name='get-home-timeline'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('profiles/', ProfileListView.as_view(), name='profiles'),
+    path('profiles/<str:report_id>/', ProfileView.as_view(), name='profile'),
+
+    path('async/get-user/<int:id>/', async_views.AsyncGetUserView.as_view(), name='async-get-user'),
+    path('async/get-users/', async_views.AsyncGetAllUsersView.as_view(), name='async-get-users'),
+    path('async/create-post/', async_views.AsyncCreatePostView.as_view(), name='async-create-post'),
+    path('async/get-post/<int:id>/', async_views.AsyncGetPostView.as_view(), name='async-get-post'),
+    path('async/get-posts-by-user/<int:user_id>/', async_views.AsyncGetPostsByUserView.as_view(),
+         name='async-get-posts-by-user'),
+    path('async/create-comment/', async_views.AsyncCreateCommentView.as_view(), name='async-create-comment'),
 ]
\ No newline at end of file
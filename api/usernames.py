@@ -0,0 +1,179 @@
+"""
+Username availability checks against an in-process Bloom filter of taken
+usernames.
+
+Signups and the username-available endpoint call `is_taken()`. A Bloom
+filter never misses a name that was added to it, so when the filter says a
+name is free the answer comes without a query; only a possible hit is
+confirmed against the database. The unique constraint on auth_user.username
+still has the last word: a signup that loses a race, or that the filter
+didn't know about, fails on it and gets the usual 400.
+
+Each process builds its filter from the user table on its first check,
+sized for API_USERNAME_FILTER_ERROR_RATE false positives at twice the
+current number of users. Users saved in this process are added by a
+post_save handler (api/signals.py). Users created by other processes,
+bulk_create or imports are picked up every API_USERNAME_FILTER_REFRESH
+seconds by reading the users above the highest ID seen; until then such a
+name reads as available. Names of deleted or renamed users stay in the
+filter, since a Bloom filter can't remove entries, and cost a query each.
+The filter is rebuilt once it holds more names than it was sized for.
+
+The refresh goes by ID, so a rename made in another process (or with
+queryset.update()) isn't seen until the filter is next rebuilt, at the
+latest when the process restarts: until then the new name reads as
+available, and a signup that takes it fails on the unique constraint.
+
+Builds and refreshes read the user table without holding the lock. One
+caller does the reading and swaps the result in, while the others carry on
+with the filter as it was, or check the database directly if there is no
+filter yet.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+# Room for this many names at least, so a small site doesn't rebuild on every few signups.
+MIN_CAPACITY = 1000
+# Users committed out of ID order can land below the highest ID seen; a
+# refresh rereads this many IDs below it so they aren't missed.
+REFRESH_OVERLAP = 1000
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def get_stats():
+    """Returns an {outcome: count} snapshot of this process's checks."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+class BloomFilter:
+    """A set of strings that answers "maybe" or "no", in about 10 bits per name at 1% false positives."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(1, capacity)
+        self.size = max(64, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        # Double hashing: k positions from the two halves of one digest.
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        if key in self:
+            return
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class TakenUsernames:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = None
+        self.max_id = 0
+        self.refreshed_at = 0.0
+        # True while one caller reads the user table.
+        self.loading = False
+        # Names added during a rebuild, for the new filter.
+        self.pending = None
+
+    def get_filter(self):
+        """
+        Returns the filter, or None if it hasn't been built yet. Rebuilds or
+        refreshes it first when due, unless another caller already is.
+        """
+        with self.lock:
+            if self.loading:
+                return self.filter
+            if self.filter is None or self.filter.count > self.filter.capacity:
+                load = self.rebuild
+                self.pending = []
+            elif time.monotonic() - self.refreshed_at >= getattr(settings, 'API_USERNAME_FILTER_REFRESH', 60):
+                load = self.refresh
+            else:
+                return self.filter
+            self.loading = True
+        try:
+            load()
+        finally:
+            with self.lock:
+                self.loading = False
+                self.pending = None
+        return self.filter
+
+    def rebuild(self):
+        capacity = max(MIN_CAPACITY, 2 * User.objects.count())
+        bloom = BloomFilter(capacity, getattr(settings, 'API_USERNAME_FILTER_ERROR_RATE', 0.01))
+        max_id = 0
+        for pk, username in self.read(User.objects.all()):
+            bloom.add(username)
+            max_id = max(max_id, pk)
+        with self.lock:
+            for username in self.pending:
+                bloom.add(username)
+            self.filter = bloom
+            self.max_id = max_id
+            self.refreshed_at = time.monotonic()
+
+    def refresh(self):
+        rows = list(self.read(User.objects.filter(id__gt=self.max_id - REFRESH_OVERLAP)))
+        with self.lock:
+            for pk, username in rows:
+                self.filter.add(username)
+                self.max_id = max(self.max_id, pk)
+            self.refreshed_at = time.monotonic()
+
+    @staticmethod
+    def read(queryset):
+        return queryset.order_by().values_list('id', 'username').iterator(chunk_size=5000)
+
+    def add(self, username):
+        """Adds a newly taken username, if the filter has been built or is being built."""
+        with self.lock:
+            if self.filter is not None:
+                self.filter.add(username)
+            if self.pending is not None:
+                self.pending.append(username)
+
+    def reset(self):
+        with self.lock:
+            self.filter = None
+
+
+taken = TakenUsernames()
+
+
+def is_taken(username):
+    """True if a user has `username` (after the normalization signups apply)."""
+    username = User.normalize_username(username)
+    bloom = taken.get_filter()
+    if bloom is not None and username not in bloom:
+        _record('filtered')
+        return False
+    exists = User.objects.filter(username=username).exists()
+    if bloom is None:
+        _record('unfiltered')
+    else:
+        _record('taken' if exists else 'false_positive')
+    return exists
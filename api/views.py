@@ -1,40 +1,148 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.http import HttpResponse
 from django.shortcuts import render
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from .models import Post
-from .serializers import UserSerializer, PostSerializer, CommentSerializer
+from . import (cache, conditional, counters, fastpath, fieldsets, hashing, ingest, loaders, partitions,
+               profiling, response_cache, timeline, usernames)
+from .metrics import registry
+from .models import Post, Comment, Follow, TimelineEntry
+from .pagination import KeysetPagination
+from .search import search_posts
+from .streaming import STREAMING_RENDERER_CLASSES, stream_ndjson, wants_stream
+from .serializers import (UserSerializer, PostSerializer, PostListSerializer, CommentSerializer,
+                          BulkPostSerializer, BulkCommentSerializer, PostDetailSerializer,
+                          CommentWithAuthorSerializer, FollowSerializer)
 from django.contrib.auth.models import User
 
 
+def get_user_data(id):
+    """The cached representation of user `id`, or None if it doesn't exist."""
+    def load():
+        row = fastpath.user_values(User.objects.filter(id=id)).first()
+        return None if row is None else fastpath.user_representation(row)
+
+    return cache.get_or_load('user', id, load)
+
+
+def get_post_data(id):
+    """The cached representation of post `id`, or None if it doesn't exist."""
+    def load():
+        row = fastpath.post_values(Post.objects.filter(id=id, **partitions.prune_by_id('api_post', id))).first()
+        return None if row is None else fastpath.post_representation(row)
+
+    return cache.get_or_load('post', id, load)
+
+
+# Most IDs one multi-get request may ask for.
+MAX_IDS = 100
+
+
+def get_many(request, kind):
+    """
+    The multi-get form of get-users and get-posts: `?ids=3,1,2` returns those
+    objects in the order asked for, through the request's loader, and lists
+    the IDs that don't exist under `missing`. Posts take `include=authors`
+    to add their authors, fetched in one more batch.
+    """
+    fields = fieldsets.parse_fields(request, fieldsets.POST_FIELDS if kind == 'post' else fieldsets.USER_FIELDS)
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in request.query_params['ids'].split(',') if pk.strip()))
+    except ValueError:
+        return Response({'ids': 'Expected comma-separated IDs.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not ids or len(ids) > MAX_IDS:
+        return Response({'ids': 'Pass between 1 and %d IDs.' % MAX_IDS}, status=status.HTTP_400_BAD_REQUEST)
+
+    found = loaders.get_loader(request, kind).get_many(ids)
+    body = {
+        'results': [fieldsets.trim(found[pk], fields) for pk in ids if found[pk] is not None],
+        'missing': [pk for pk in ids if found[pk] is None],
+    }
+    if kind == 'post' and request.query_params.get('include') == 'authors':
+        authors = loaders.get_loader(request, 'user').get_many({found[pk]['user'] for pk in ids if found[pk]})
+        body['authors'] = [authors[pk] for pk in sorted(authors) if authors[pk] is not None]
+    return Response(body)
+
+
+USERNAME_TAKEN = 'A user with that username already exists.'
+
+
 class CreateUserView(APIView):
     def post(self, request, *args, **kwargs):
-        if User.objects.filter(username=request.data.get('username')).exists():
-            return Response(
-                {'username': 'A user with that username already exists.'},
-                status=status.HTTP_400_BAD_REQUEST)
+        username = request.data.get('username')
+        if isinstance(username, str) and usernames.is_taken(username):
+            return Response({'username': USERNAME_TAKEN}, status=status.HTTP_400_BAD_REQUEST)
         serializer = UserSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            try:
+                with transaction.atomic():
+                    serializer.save()
+            except hashing.HashingBusy:
+                return Response({'error': 'Too many signups in progress, try again shortly.'},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+            except IntegrityError:
+                # Taken since the check, or by a user this process's filter hasn't seen yet.
+                return Response({'username': USERNAME_TAKEN}, status=status.HTTP_400_BAD_REQUEST)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status.HTTP_400_BAD_REQUEST)
 
 
+class UsernameAvailableView(APIView):
+    def get(self, request, *args, **kwargs):
+        username = request.query_params.get('username', '')
+        field = User._meta.get_field('username')
+        try:
+            field.clean(username, None)
+        except ValidationError as e:
+            return Response({'username': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'username': username, 'available': not usernames.is_taken(username)})
+
+
 class GetUserView(APIView):
     def get(self, request, id):
-        try:
-            user = User.objects.get(id=id)
-            serializer = UserSerializer(user)
-            return Response(serializer.data)
-        except User.DoesNotExist:
+        fields = fieldsets.parse_fields(request, fieldsets.USER_FIELDS)
+        data = get_user_data(id)
+        if data is None:
             return Response({"message": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+        if request.query_params.get('include') == 'counts':
+            data = dict(fieldsets.trim(data, fields), post_count=counters.get_count(counters.POST_COUNT, data['id']))
+        else:
+            data = fieldsets.trim(data, fields)
+
+        etag = conditional.etag_for_data('user', data)
+        return conditional.not_modified(request, etag) or Response(data, headers={'ETag': etag})
 
 class GetAllUsersView(APIView):
+    renderer_classes = STREAMING_RENDERER_CLASSES
+
     def get(self, request):
-        users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        if 'ids' in request.query_params:
+            return get_many(request, 'user')
+        fields = fieldsets.parse_fields(request, fieldsets.USER_FIELDS)
+        if wants_stream(request):
+            users = User.objects.order_by('date_joined', 'id')
+            if fields is not None:
+                users = users.only(*fieldsets.columns(fields))
+            return stream_ndjson(users, UserSerializer, fields=fields)
+
+        response = response_cache.get(request, 'users')
+        if response is not None:
+            return response
+
+        paginator = KeysetPagination(ordering=('date_joined', 'id'))
+        rows = paginator.paginate_queryset(fastpath.user_values(User.objects.all(), *paginator.fields, fields=fields),
+                                           request, view=self)
+        response = paginator.get_paginated_response([fastpath.user_representation(row, fields) for row in rows])
+        return response_cache.store(request, 'users', self, response)
 
 class CreatePostView(APIView):
     def post(self, request, *args, **kwargs):
@@ -50,28 +158,125 @@ class CreatePostView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class GetPostsView(APIView):
+    def get(self, request, *args, **kwargs):
+        if 'ids' not in request.query_params:
+            return Response({'ids': 'Pass the post IDs to fetch, e.g. ?ids=1,2,3.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return get_many(request, 'post')
+
+
 class GetPostView(APIView):
     def get(self, request, id, *args, **kwargs):
+        fields = fieldsets.parse_fields(request, fieldsets.POST_FIELDS)
+        if request.query_params.get('include') == 'comments':
+            return self.get_with_comments(request, id, fields)
+
+        data = get_post_data(id)
+        if data is None:
+            return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
+        if request.query_params.get('include') == 'counts':
+            data = dict(fieldsets.trim(data, fields),
+                        comment_count=counters.get_count(counters.COMMENT_COUNT, data['id']))
+        else:
+            data = fieldsets.trim(data, fields)
+
+        etag = conditional.etag_for_data('post', data)
+        return conditional.not_modified(request, etag) or Response(data, status=status.HTTP_200_OK,
+                                                                   headers={'ETag': etag})
+
+    def get_with_comments(self, request, id, fields=None):
+        # Two queries however many comments there are: the post joined to its
+        # author and body, then one page of comments joined to their authors.
         try:
-            post = Post.objects.get(id=id)
+            post = Post.objects.select_related('user', 'body').get(id=id)
         except Post.DoesNotExist:
             return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = PostSerializer(post)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        comments_url = request.build_absolute_uri(reverse('get-comments-by-post', kwargs={'post_id': id}))
+        paginator = KeysetPagination(base_url=comments_url)
+        comments = Comment.objects.filter(post=post).select_related('user')
+        if partitions.is_enabled():
+            # Comments can't predate their post, so older partitions are skipped.
+            comments = comments.filter(created_at__gte=post.created_at)
+        comments = paginator.paginate_queryset(comments, request)
+
+        # The author is part of this representation, so it stays whatever `fields` says.
+        data = PostDetailSerializer(post, fields=fields and fields + ('author',)).data
+        data['comments'] = paginator.get_paginated_data(CommentWithAuthorSerializer(comments, many=True).data)
+        return Response(data, status=status.HTTP_200_OK)
 
 class GetPostsByUserView(APIView):
+    renderer_classes = STREAMING_RENDERER_CLASSES
+
     def get(self, request, user_id, *args, **kwargs):
+        fields = fieldsets.parse_fields(request, fieldsets.POST_LIST_FIELDS)
+        if wants_stream(request):
+            posts = Post.get_posts_by_user(user_id=user_id).order_by('created_at', 'id')
+            if fields is not None:
+                posts = posts.only(*fieldsets.columns(fields))
+            return stream_ndjson(posts, PostListSerializer, fields=fields)
 
-        posts = Post.get_posts_by_user(user_id=user_id)
-        if not posts.exists():
+        scope = 'posts-by-user:%s' % user_id
+        response = response_cache.get(request, scope)
+        if response is not None:
+            return conditional.not_modified(request, response['ETag']) or response
+
+        # Answered from the (user, created_at, id) index alone: any new or
+        # deleted post changes the count or the maxima and so the ETag.
+        stats = Post.get_posts_by_user(user_id=user_id).aggregate(
+            count=Count('id'), latest=Max('created_at'), last_id=Max('id'))
+        if not stats['count'] and 'cursor' not in request.query_params:
             return Response({'error': 'Posts not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = PostSerializer(posts, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        etag = conditional.make_etag('posts-by-user', user_id, stats['count'], stats['latest'], stats['last_id'],
+                                     request.get_full_path())
+        response = conditional.not_modified(request, response_cache.etag_for(request, etag))
+        if response is not None:
+            return response
+
+        paginator = KeysetPagination()
+        posts = fastpath.post_list_values(Post.get_posts_by_user(user_id=user_id), *paginator.fields, fields=fields)
+        rows = paginator.paginate_queryset(posts, request, view=self)
+        response = paginator.get_paginated_response([fastpath.post_list_representation(row, fields)
+                                                     for row in rows])
+        response['ETag'] = etag
+        return response_cache.store(request, scope, self, response, headers={'ETag': etag})
+
+class SearchPostsView(APIView):
+    def get(self, request, *args, **kwargs):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'q': 'A search query is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        fields = fieldsets.parse_fields(request, fieldsets.POST_LIST_FIELDS)
+        posts = search_posts(text)
+        if fields is not None:
+            posts = posts.only(*fieldsets.columns(fields, 'id'))
+        paginator = KeysetPagination(ordering=('-rank', '-id'))
+        posts = paginator.paginate_queryset(posts, request, view=self)
+        serializer = PostListSerializer(posts, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
+
+class GetCommentsByPostView(APIView):
+    def get(self, request, post_id, *args, **kwargs):
+        paginator = KeysetPagination()
+        comments = Comment.objects.filter(post=post_id).select_related('user')
+        if partitions.is_enabled():
+            # Comments can't predate their post, so older partitions are skipped.
+            post = get_post_data(post_id)
+            if post is not None:
+                comments = comments.filter(created_at__gte=parse_datetime(post['created_at']))
+        comments = paginator.paginate_queryset(comments, request, view=self)
+
+        serializer = CommentWithAuthorSerializer(comments, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 class CreateCommentView(APIView):
     def post(self, request, *args, **kwargs):
+        if ingest.is_enabled():
+            return self.enqueue(request)
+
         user_id = request.data.get('user')
         if not user_id or not User.objects.filter(id=user_id).exists():
             return Response({'user': 'Invalid user ID.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -85,4 +290,194 @@ class CreateCommentView(APIView):
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def enqueue(self, request):
+        """
+        Ingest mode (API_COMMENT_INGEST): validates the comment, checking the
+        user and post through the object cache, and queues it for a batched
+        insert (api/ingest.py). The response carries a receipt ID, not the
+        comment's ID, which isn't known until the batch is written.
+        """
+        serializer = BulkCommentSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        if get_user_data(data['user_id']) is None:
+            return Response({'user': 'Invalid user ID.'}, status=status.HTTP_400_BAD_REQUEST)
+        if get_post_data(data['post_id']) is None:
+            return Response({'post': 'Invalid post ID.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            receipt = ingest.comments.submit(dict(data))
+        except ingest.IngestFull:
+            return Response({'error': 'Too many comments queued, try again shortly.'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+        return Response({'receipt': receipt, 'status': 'queued'}, status=status.HTTP_202_ACCEPTED)
+
+
+class FollowView(APIView):
+    def post(self, request, *args, **kwargs):
+        serializer = FollowSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        follower = serializer.validated_data['follower']
+        followee = serializer.validated_data['followee']
+        if Follow.objects.filter(follower=follower, followee=followee).exists():
+            return Response({'followee': 'Already following this user.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            serializer.save()
+            timeline.backfill(follower.id, followee.id)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class UnfollowView(APIView):
+    def post(self, request, *args, **kwargs):
+        try:
+            follower_id = int(request.data.get('follower'))
+            followee_id = int(request.data.get('followee'))
+        except (TypeError, ValueError):
+            return Response({'error': 'follower and followee must be user IDs.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(follower=follower_id, followee=followee_id).delete()
+            if not deleted:
+                return Response({'error': 'Not following this user.'}, status=status.HTTP_404_NOT_FOUND)
+            timeline.remove_author(follower_id, followee_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class GetHomeTimelineView(APIView):
+    def get(self, request, user_id, *args, **kwargs):
+        fields = fieldsets.parse_fields(request, fieldsets.POST_LIST_FIELDS)
+        entries, pulled = timeline.timeline_querysets(user_id)
+        if fields is not None:
+            columns = fieldsets.columns(fields, 'id')
+            entries = entries.only('created_at', 'post_id', *['post__' + column for column in columns])
+            pulled = pulled.only('created_at', *columns)
+        paginator = KeysetPagination(ordering=('-created_at', '-post_id'))
+        items = paginator.paginate_querysets([entries, pulled], request, view=self)
+
+        posts = [item.post if isinstance(item, TimelineEntry) else item for item in items]
+        serializer = PostListSerializer(posts, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
+
+
+RELATED_ROW_DELETED = 'A related row was deleted while the batch was written; nothing was created.'
+
+
+class BulkCreateView(APIView):
+    """
+    Creates a list of rows in one request.
+
+    Every item is validated, foreign keys are checked with one `id IN (...)`
+    query per relation, and the valid rows are inserted with a single
+    `bulk_create` inside a transaction. Invalid items are reported by index
+    and skipped.
+    """
+    model = None
+    serializer_class = None
+    # Maps a request field to the model its ID must exist in.
+    relations = {}
+    max_items = 1000
+
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'Expected a non-empty list.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.max_items:
+            return Response({'error': 'At most %d items per request.' % self.max_items},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        valid = {}
+        errors = {}
+        for index, item in enumerate(items):
+            serializer = self.serializer_class(data=item)
+            if serializer.is_valid():
+                valid[index] = serializer.validated_data
+            else:
+                errors[index] = serializer.errors
+
+        for field, related_model in self.relations.items():
+            source = field + '_id'
+            ids = {data[source] for data in valid.values()}
+            existing = set(related_model.objects.filter(id__in=ids).values_list('id', flat=True))
+            for index in [i for i, data in valid.items() if data[source] not in existing]:
+                del valid[index]
+                errors[index] = {field: 'Invalid %s ID.' % field}
+
+        try:
+            with transaction.atomic():
+                created = self.model.objects.bulk_create([self.model(**data) for data in valid.values()])
+        except IntegrityError:
+            # A referenced row was deleted after the check; nothing was written.
+            for index in valid:
+                errors[index] = {'non_field_errors': [RELATED_ROW_DELETED]}
+            body = {'created': [], 'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)]}
+            return Response(body, status=status.HTTP_409_CONFLICT)
+        self.created(created)
+
+        body = {
+            'created': self.serializer_class(created, many=True).data,
+            'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)],
+        }
+        if not errors:
+            return Response(body, status=status.HTTP_201_CREATED)
+        if not created:
+            return Response(body, status=status.HTTP_400_BAD_REQUEST)
+        return Response(body, status=status.HTTP_207_MULTI_STATUS)
+
+    def created(self, objs):
+        pass
+
+
+class CreatePostsView(BulkCreateView):
+    model = Post
+    serializer_class = BulkPostSerializer
+    relations = {'user': User}
+
+    def created(self, objs):
+        # bulk_create skips post_save, so do what the signal handlers would:
+        # clear any cached 404s for the new IDs, drop the authors' cached
+        # post lists, count the posts and fan out to timelines.
+        cache.invalidate_many('post', [obj.pk for obj in objs])
+        for user_id in {obj.user_id for obj in objs}:
+            response_cache.invalidate('posts-by-user:%s' % user_id)
+        counters.increment_many(counters.POST_COUNT, Counter(obj.user_id for obj in objs))
+        timeline.fan_out(objs)
+
+
+class CreateCommentsView(BulkCreateView):
+    model = Comment
+    serializer_class = BulkCommentSerializer
+    relations = {'user': User, 'post': Post}
+
+    def created(self, objs):
+        counters.increment_many(counters.COMMENT_COUNT, Counter(obj.post_id for obj in objs))
+
+
+class MetricsView(APIView):
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class ProfileListView(APIView):
+    """Summaries of the stored request profiles (api/profiling.py), newest first."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        reports = (profiling.load_report(report_id) for report_id in profiling.list_report_ids())
+        return Response([profiling.summarize(report) for report in reports if report is not None])
+
+
+class ProfileView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, report_id):
+        report = profiling.load_report(report_id)
+        if report is None:
+            return Response({"message": "Profile not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(report)
@@ -43,6 +43,10 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',
+    'api.metrics.MetricsMiddleware',
+    'api.admission.AdmissionMiddleware',
+    'api.routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,6 +58,13 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'backend.urls'
 
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.fastpath.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -87,6 +98,118 @@ DATABASES = {
     }
 }
 
+# Read replicas (api/routing.py). Add replica aliases to DATABASES and list
+# them here to serve GET requests from them; clients that just wrote are
+# pinned to the primary for API_REPLICA_PIN_SECONDS.
+DATABASE_ROUTERS = ['api.routing.ReplicaRouter']
+API_READ_REPLICAS = []
+API_REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Read-through cache for serialized users and posts (api/cache.py)
+API_OBJECT_CACHE_ALIAS = 'default'
+API_OBJECT_CACHE_TIMEOUT = 300
+API_OBJECT_CACHE_MISS_TIMEOUT = 30
+# After a write, the row isn't cached again for this many seconds, so reads
+# that started before the write can't put the old version back.
+API_OBJECT_CACHE_INVALIDATED_TIMEOUT = 5
+
+# Pre-rendered, pre-compressed pages of get-users and get-posts-by-user
+# (api/response_cache.py). Writes invalidate them; the timeout bounds how long
+# a page rendered from a lagging replica can outlive the write.
+API_RESPONSE_CACHE_TIMEOUT = 60
+
+# Home timelines (api/timeline.py): authors with more followers than this are
+# merged in at read time instead of fanned out on write.
+API_TIMELINE_FAN_OUT_LIMIT = 5000
+API_TIMELINE_BACKFILL = 20
+
+# Shards per denormalized count (api/counters.py). Comments on one post can
+# arrive concurrently, so their count is spread over several rows.
+API_COUNTER_SHARDS = {
+    'post_count': 1,
+    'comment_count': 8,
+}
+
+# Monthly range partitioning of posts and comments (api/partitions.py).
+# Postgres only; takes effect when migration 0012 runs, so set it before
+# migrating (or migrate back to 0011 and forward again to convert). The
+# maintain_partitions command creates upcoming months and archives old ones.
+API_PARTITION_BY_MONTH = False
+API_PARTITION_MONTHS_AHEAD = 3
+API_PARTITION_RETENTION_MONTHS = None
+API_PARTITION_ARCHIVE_DIR = None
+
+# Post bodies live in api_postbody, apart from the rows list views read. On
+# Postgres, a body is compressed once its row passes about 2kB, or
+# API_POST_BODY_COMPRESS_THRESHOLD bytes (up to 8160) when set. Set
+# API_POST_BODY_COMPRESSION to 'pglz' or 'lz4' (if the server has it) to pick
+# the method, or False to store bodies uncompressed; None keeps the server's
+# default_toast_compression. Both are applied by migration 0013.
+API_POST_BODY_COMPRESSION = None
+API_POST_BODY_COMPRESS_THRESHOLD = None
+
+# Admission control (api/admission.py). Token-bucket rate limits as
+# (requests per second, burst), per route name for each client and for the
+# route as a whole; '*' covers unlisted routes. For example:
+#   {'create-post': {'client': (2, 10), 'route': (100, 200)},
+#    'get-users': {'client': (10, 20)}}
+# Buckets live in the API_RATE_LIMIT_CACHE_ALIAS cache; point it at a shared
+# cache so the budgets hold across processes. Clients are told apart by IP;
+# behind a proxy set API_CLIENT_IP_HEADER (e.g. 'HTTP_X_FORWARDED_FOR') and
+# API_TRUSTED_PROXY_COUNT to the number of proxies in front of the app that
+# append to it. The client is the address the outermost one appended.
+# API_MAX_CONCURRENT_REQUESTS caps the requests each process serves at once;
+# the rest wait up to API_CONCURRENCY_WAIT seconds, then get a 503.
+API_RATE_LIMITS = {}
+API_RATE_LIMIT_CACHE_ALIAS = 'default'
+API_CLIENT_IP_HEADER = None
+API_TRUSTED_PROXY_COUNT = 1
+API_MAX_CONCURRENT_REQUESTS = None
+API_CONCURRENCY_WAIT = 0
+API_ADMISSION_EXEMPT = ['metrics']
+
+# Request profiling (api/profiling.py): cProfile a random fraction of
+# requests, and report the SQL and EXPLAIN plans of sampled requests and of
+# any request slower than API_PROFILE_SLOW_SECONDS. Off while the rate is 0
+# and the threshold None. Reports go to API_PROFILE_DIR (a directory in the
+# system temp dir by default), keeping the newest API_PROFILE_KEEP.
+API_PROFILE_SAMPLE_RATE = 0
+API_PROFILE_SLOW_SECONDS = None
+API_PROFILE_EXPLAIN_TOP = 3
+API_PROFILE_DIR = None
+API_PROFILE_KEEP = 100
+
+# Username availability (api/usernames.py): each process keeps a Bloom
+# filter of taken usernames and queries the database only on a possible hit.
+# Users created by other processes are picked up every
+# API_USERNAME_FILTER_REFRESH seconds.
+API_USERNAME_FILTER_ERROR_RATE = 0.01
+API_USERNAME_FILTER_REFRESH = 60
+
+# Password hashing pool for signups (api/hashing.py). None means one worker per core.
+API_PASSWORD_HASH_WORKERS = None
+API_PASSWORD_HASH_QUEUE = 32
+API_PASSWORD_HASH_WAIT = 2
+
+# Comment ingest mode (api/ingest.py): create-comment queues comments and
+# answers 202; a background thread writes them with bulk_create. Queued
+# comments are flushed at graceful shutdown but lost if the process crashes.
+API_COMMENT_INGEST = False
+API_COMMENT_INGEST_BATCH_SIZE = 500
+API_COMMENT_INGEST_FLUSH_INTERVAL = 0.05
+API_COMMENT_INGEST_MAX_QUEUE = 10000
+API_COMMENT_INGEST_RETRIES = 3
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators